@@ -0,0 +1,287 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Microbenchmarks for evaluation and refresh paths of Merci.
+
+Generates synthetic feature flag and config corpora of configurable size and depth, measures evaluation
+latency, mapper throughput, reader refresh time and memory per configuration, and writes the results as
+JSON, so that they can be compared across releases.
+
+Sample usage:
+
+python -m merci.benchmarks.run_benchmarks --configurations 1000 --depth 3 --fanout 4 --output bench.json
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from merci.deserialization import ConfigurationMapper, SingleValueDecoderFactory, ObjectValueDecoderFactory
+from merci.fetchers import ConfigurationFetcher
+from merci.managers import ConfigurationManager, FeatureFlagManager, ConfigManager
+from merci.metrics import ConfigurationManagerMetrics
+from merci.readers import ConfigurationReader
+
+CONTEXT_TYPES = ['environment', 'region', 'cluster', 'tenant', 'user']
+APPLICATION = 'benchmark-app'
+FEATURE_FLAGS_FILE = '/featureflags.json'
+
+
+class BenchmarkConfig:
+    """ Config class for benchmarks. """
+    def __init__(self, hosts: List[str] = None, port: int = -1, timeout_seconds: int = -1):
+        self.hosts = hosts
+        if self.hosts is None:
+            self.hosts = []
+        self.port = port
+        self.timeout_seconds = timeout_seconds
+
+
+class CorpusGenerator:
+    """ Generates synthetic, reproducible configuration corpora. """
+    def __init__(self, configurations: int, depth: int, fanout: int, seed: int = 42):
+        """
+        Initialize generator.
+        :param configurations: number of feature flags and of configs
+        :param depth: number of nested modifiers levels per configuration
+        :param fanout: number of context values per modifiers level
+        :param seed: seed for random generator
+        """
+        self.configurations = configurations
+        self.depth = min(depth, len(CONTEXT_TYPES))
+        self.fanout = fanout
+        self.random = random.Random(seed)
+
+    def context_value(self, context_type: str, index: int) -> str:
+        """ Return context value with provided index for provided context type, i.e. 'tenant-3'. """
+        return context_type + '-' + str(index)
+
+    def feature_flags(self, generation: int = 0) -> str:
+        """ Return JSON document with feature flags. Different generations differ in their default values. """
+        flags = {}
+        for index in range(self.configurations):
+            flags['feature-' + str(index)] = self.__tree(lambda: self.random.random() < 0.5, 0, generation % 2 == 1)
+        return json.dumps({'feature-flags': flags})
+
+    def configs(self, generation: int = 0) -> str:
+        """ Return JSON document with configs. Different generations differ in their default values. """
+        configs = {}
+        for index in range(self.configurations):
+            # each config needs its own class, all but the first one are created on demand in this module
+            class_name = 'BenchmarkConfig' if index == 0 else 'BenchmarkConfig' + str(index)
+            globals().setdefault(class_name, type(class_name, (BenchmarkConfig,), {}))
+            default_value = {'hosts': ['generation-' + str(generation)], 'port': generation, 'timeout_seconds': 30}
+            configs[__name__ + '.' + class_name] = self.__tree(self.__config_value, 0, default_value)
+        return json.dumps({'configs': configs})
+
+    def __config_value(self) -> Dict:
+        return {'hosts': ['host-' + str(self.random.randrange(1000))],
+                'port': self.random.randrange(1024, 65536),
+                'timeout_seconds': self.random.randrange(1, 120)}
+
+    def __tree(self, value: Callable[[], object], level: int, default_value: object) -> Dict:
+        tree = {'value': default_value if level == 0 else value()}
+        if level < self.depth:
+            context_type = CONTEXT_TYPES[level]
+            contexts = {}
+            for index in range(self.fanout):
+                contexts[self.context_value(context_type, index)] = self.__tree(value, level + 1, default_value)
+            tree['modifiers'] = {'type': context_type, 'contexts': contexts}
+        return tree
+
+    def runtime_contexts(self, count: int) -> List[Dict[str, str]]:
+        """ Return runtime contexts, that match context values on all levels in about half of all cases. """
+        runtime_contexts = []
+        for _ in range(count):
+            runtime_context = {}
+            for context_type in CONTEXT_TYPES:
+                runtime_context[context_type] = self.context_value(context_type, self.random.randrange(2 * self.fanout))
+            runtime_contexts.append(runtime_context)
+        return runtime_contexts
+
+
+class CorpusFetcher(ConfigurationFetcher):
+    """ Fetches configuration content from memory. """
+    def __init__(self, contents: Dict[str, str]):
+        self.contents = contents
+
+    def fetch_files(self, application: str, file_names: List[str]) -> Dict[str, str]:
+        return {file_name: self.contents[file_name] for file_name in file_names}
+
+
+def _latencies(operation: Callable[[int], object], iterations: int) -> Dict[str, float]:
+    """ Return latency statistics of operation in nanoseconds, called with the index of each iteration. """
+    samples = []
+    for iteration in range(iterations):
+        start = time.perf_counter_ns()
+        operation(iteration)
+        samples.append(time.perf_counter_ns() - start)
+    samples.sort()
+    return {'iterations': iterations,
+            'mean_ns': statistics.mean(samples),
+            'p50_ns': samples[len(samples) // 2],
+            'p90_ns': samples[int(len(samples) * 0.9)],
+            'p99_ns': samples[int(len(samples) * 0.99)],
+            'max_ns': samples[-1]}
+
+
+def _durations(operation: Callable[[int], object], repetitions: int) -> Dict[str, float]:
+    """ Return duration statistics of a long running operation in seconds. """
+    samples = []
+    for repetition in range(repetitions):
+        start = time.perf_counter()
+        operation(repetition)
+        samples.append(time.perf_counter() - start)
+    return {'repetitions': repetitions,
+            'mean_seconds': statistics.mean(samples),
+            'min_seconds': min(samples),
+            'max_seconds': max(samples)}
+
+
+def benchmark_evaluation(generator: CorpusGenerator, iterations: int) -> Dict[str, Dict]:
+    """ Measure latency of is_active and get_config. """
+    flags_mapper = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), True, ConfigurationManagerMetrics())
+    configs_mapper = ConfigurationMapper('configs', ObjectValueDecoderFactory(), True, ConfigurationManagerMetrics())
+    flags_store = ConfigurationManager()
+    flags_store.set_configuration_store(flags_mapper.read_value(generator.feature_flags()))
+    configs_store = ConfigurationManager()
+    configs_store.set_configuration_store(configs_mapper.read_value(generator.configs()))
+    feature_flag_manager = FeatureFlagManager(flags_store)
+    config_manager = ConfigManager(configs_store)
+    runtime_contexts = generator.runtime_contexts(1024)
+    flag_names = ['feature-' + str(index) for index in range(generator.configurations)]
+
+    def is_active(iteration: int):
+        feature_flag_manager.is_active(flag_names[iteration % len(flag_names)],
+                                       runtime_contexts[iteration % len(runtime_contexts)], False)
+
+    def is_active_missing(iteration: int):
+        feature_flag_manager.is_active('missing-feature', runtime_contexts[iteration % len(runtime_contexts)], False)
+
+    def get_config(iteration: int):
+        config_manager.get_config(BenchmarkConfig, runtime_contexts[iteration % len(runtime_contexts)])
+
+    return {'is_active': _latencies(is_active, iterations),
+            'is_active_missing': _latencies(is_active_missing, iterations),
+            'get_config': _latencies(get_config, iterations)}
+
+
+def benchmark_mapper(generator: CorpusGenerator, repetitions: int) -> Dict[str, Dict]:
+    """ Measure throughput of ConfigurationMapper.read_value. """
+    results = {}
+    for name, root, decoder_factory, content in [
+            ('feature_flags', 'feature-flags', SingleValueDecoderFactory(), generator.feature_flags()),
+            ('configs', 'configs', ObjectValueDecoderFactory(), generator.configs())]:
+        mapper = ConfigurationMapper(root, decoder_factory, True, ConfigurationManagerMetrics())
+        durations = _durations(lambda _: mapper.read_value(content), repetitions)
+        durations['bytes'] = len(content.encode('utf-8'))
+        durations['configurations_per_second'] = generator.configurations / durations['mean_seconds']
+        durations['megabytes_per_second'] = durations['bytes'] / durations['mean_seconds'] / 1e6
+        results[name] = durations
+    return results
+
+
+def benchmark_reader(generator: CorpusGenerator, repetitions: int) -> Dict[str, Dict]:
+    """ Measure time of ConfigurationReader.execute for same-content and new-content cycles. """
+    contents = [{FEATURE_FLAGS_FILE: generator.feature_flags(generation)} for generation in range(2)]
+    fetcher = CorpusFetcher(contents[0])
+    metrics = ConfigurationManagerMetrics()
+    mapper = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), True, metrics)
+    reader = ConfigurationReader(APPLICATION, [FEATURE_FLAGS_FILE], fetcher, mapper, ConfigurationManager(),
+                                 metrics, sys.maxsize)
+    reader.execute()
+
+    def new_content(repetition: int):
+        fetcher.contents = contents[(repetition + 1) % 2]
+        reader.execute()
+
+    same_content = _durations(lambda _: reader.execute(), repetitions)
+    reader.maximum_skips = reader.skips_left = 0
+    return {'same_content': same_content,
+            'new_content': _durations(new_content, repetitions)}
+
+
+def benchmark_memory(generator: CorpusGenerator) -> Dict[str, float]:
+    """ Measure memory retained by parsed feature flags and configs. """
+    results = {}
+    for name, root, decoder_factory, content in [
+            ('feature_flags', 'feature-flags', SingleValueDecoderFactory(), generator.feature_flags()),
+            ('configs', 'configs', ObjectValueDecoderFactory(), generator.configs())]:
+        mapper = ConfigurationMapper(root, decoder_factory, True, ConfigurationManagerMetrics())
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        configurations = mapper.read_value(content)
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = {'bytes_per_configuration': (retained - baseline) / len(configurations),
+                         'peak_bytes': peak - baseline}
+        del configurations
+    return results
+
+
+def run(configurations: int, depth: int, fanout: int, iterations: int, repetitions: int) -> Dict:
+    """
+    Run all benchmarks.
+    :param configurations: number of feature flags and of configs in generated corpora
+    :param depth: number of nested modifiers levels per configuration
+    :param fanout: number of context values per modifiers level
+    :param iterations: number of evaluations per latency benchmark
+    :param repetitions: number of repetitions per mapper and reader benchmark
+    :return: dictionary with parameters and results
+    """
+    generator = CorpusGenerator(configurations, depth, fanout)
+    return {
+        'timestamp': time.time(),
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'configurations': configurations, 'depth': generator.depth, 'fanout': fanout,
+                       'iterations': iterations, 'repetitions': repetitions},
+        'results': {'evaluation': benchmark_evaluation(generator, iterations),
+                    'mapper': benchmark_mapper(generator, repetitions),
+                    'reader': benchmark_reader(generator, repetitions),
+                    'memory': benchmark_memory(generator)}
+    }
+
+
+def main(arguments: List[str] = None):
+    """ Parse command line arguments, run benchmarks and write JSON results. """
+    parser = argparse.ArgumentParser(description='Run Merci microbenchmarks.')
+    parser.add_argument('--configurations', type=int, default=1000, help='number of feature flags and of configs')
+    parser.add_argument('--depth', type=int, default=3, help='number of nested modifiers levels')
+    parser.add_argument('--fanout', type=int, default=4, help='number of context values per modifiers level')
+    parser.add_argument('--iterations', type=int, default=100000, help='number of evaluations per latency benchmark')
+    parser.add_argument('--repetitions', type=int, default=10, help='number of repetitions per refresh benchmark')
+    parser.add_argument('--output', help='file for JSON results, standard output if omitted')
+    options = parser.parse_args(arguments)
+    results = run(options.configurations, options.depth, options.fanout, options.iterations, options.repetitions)
+    if options.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(options.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Local on-disk cache of last-known-good configuration content.
+
+Sample code on how to use a content cache:
+
+merci: Merci = Merci(fetcher)
+merci.set_content_cache(ContentCache("/var/cache/myapp/merci"))
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+from typing import Dict, Iterable, List, Optional, TextIO, Union
+
+
+class ContentCache:
+    """
+    Persists the content of configuration files per application, configuration root, i.e. 'feature-flags', and
+    set of registered files, after it was successfully applied. All files of a reader are stored as a single snapshot, that is written
+    to a temporary file and atomically renamed, so that readers of the cache never see partial content.
+    """
+    FORMAT_VERSION = 1
+    # Number of characters of content, that are copied to the snapshot at once. */
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, directory: str):
+        """
+        Initialize cache.
+        :param directory: directory of cached content, created on first write
+        """
+        self.directory = directory
+
+    def path(self, application: str, root: str, file_names: Iterable[str]) -> str:
+        """
+        Return path of the snapshot file for provided application, configuration root and registered files.
+        Managers with the same application and root, but different files, have snapshots of their own.
+        """
+        digest = hashlib.sha256('\0'.join(_sorted_names(file_names)).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, _sanitize(application), _sanitize(root) + '-' + digest + '.json')
+
+    def store(self, application: str, root: str, file_names: Iterable[str],
+              content_map: Dict[str, Union[str, TextIO]]):
+        """
+        Atomically replace the snapshot for provided application, configuration root and registered files.
+        Content, that is provided as a text stream, i.e. of decompressed content, is copied to the snapshot
+        in chunks, so that it is never held in memory as a whole.
+        :param application: application name
+        :param root: configuration root, i.e. 'configs'
+        :param file_names: names of files registered with the reader
+        :param content_map: content, or text stream of content, by file name
+        """
+        file_names = _sorted_names(file_names)
+        path = self.path(application, root, file_names)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(prefix='.merci-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(file_descriptor, 'w', encoding='utf-8') as file:
+                file.write('{"version": %d, "file_names": %s, "files": {' % (self.FORMAT_VERSION,
+                                                                          json.dumps(file_names)))
+                for index, (file_name, content) in enumerate(content_map.items()):
+                    file.write((', ' if index else '') + json.dumps(file_name) + ': "')
+                    self.__write_escaped(file, content)
+                    file.write('"')
+                file.write('}}')
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def __write_escaped(self, file: TextIO, content: Union[str, TextIO]):
+        """ Write content as the body of a JSON string, escaping each chunk on its own. """
+        if isinstance(content, str):
+            file.write(json.dumps(content)[1:-1])
+            return
+        chunk = content.read(self.CHUNK_SIZE)
+        while chunk:
+            file.write(json.dumps(chunk)[1:-1])
+            chunk = content.read(self.CHUNK_SIZE)
+
+    def load(self, application: str, root: str, file_names: Iterable[str]) -> Optional[Dict[str, str]]:
+        """
+        Return snapshot for provided application, configuration root and registered files.
+        :param application: application name
+        :param root: configuration root, i.e. 'configs'
+        :param file_names: names of files registered with the reader
+        :return: content by file name, or None if nothing was cached
+        :raises IOError: if the snapshot could not be read or is corrupt
+        """
+        file_names = _sorted_names(file_names)
+        try:
+            with open(self.path(application, root, file_names), 'r', encoding='utf-8') as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return None
+        except ValueError as exception:
+            raise IOError('Corrupt content cache for ' + application + '.') from exception
+        if not isinstance(snapshot, dict) or snapshot.get('version') != self.FORMAT_VERSION:
+            raise IOError('Unsupported content cache for ' + application + '.')
+        content_map = snapshot.get('files')
+        if snapshot.get('file_names') != file_names or not isinstance(content_map, dict) or \
+                not all(isinstance(content, str) and file_name in file_names
+                        for file_name, content in content_map.items()):
+            raise IOError('Corrupt content cache for ' + application + '.')
+        return content_map
+
+
+def _sorted_names(file_names: Iterable[str]) -> List[str]:
+    """ Return sorted, distinct file names. """
+    return sorted(set(file_names))
+
+
+def _sanitize(name: str) -> str:
+    """ Return name, that is safe to use as a single path segment. """
+    sanitized = re.sub(r'[^A-Za-z0-9._-]', '_', name)
+    return '_' + sanitized if sanitized.startswith('.') else sanitized
@@ -18,11 +18,18 @@ Classes for de-serializing feature flag and runtime config JSON to Merci evaluat
 """
 from abc import abstractmethod, ABC
 import json
-from json import JSONDecoder
-from typing import Dict
+import marshal
+import time
+from concurrent.futures import BrokenExecutor, Executor
+from json import JSONDecodeError, JSONDecoder
+from typing import Dict, Iterator, Optional, TextIO, Tuple
 
-from merci.metrics import ConfigurationMapperMetrics
-from merci.structure import Modifiers, Context
+from merci.fetchers import FetchedFile
+from merci.metrics import ConfigurationMapperMetrics, RefreshPhases
+from merci.spillover import SpillStore, SpilledContexts
+from merci.tracing import RefreshTracer, NO_OP_TRACER
+from merci.structure import Modifiers, Context, PercentageModifiers, SetModifiers, RangeModifiers, \
+    PrefixModifiers, SuffixModifiers
 
 
 class InstantiationException(Exception):
@@ -117,6 +124,12 @@ class ContextDecoder(JSONDecoder):
     """ JSON decoder for de-serializing JSON to feature flag and runtime config contexts. """
     def __init__(self, *args, **kwargs):
         self.value_decoder: type = kwargs.pop('value_decoder', dict)
+        # default seed for hashing in percentage modifiers, i.e. name of configuration
+        self.seed: str = kwargs.pop('seed', '')
+        # store for contexts maps with many entries, that are decoded on demand, or None to decode all of them
+        self.spill_store: Optional[SpillStore] = kwargs.pop('spill_store', None)
+        # True, if a contexts map was spilled by decode_tree
+        self.spilled = False
         JSONDecoder.__init__(
             self, object_hook=self.object_hook, *args, **kwargs)
 
@@ -125,6 +138,26 @@ class ContextDecoder(JSONDecoder):
             type_name = dct['type']
             contexts = dct['contexts']
             return Modifiers(type_name, contexts)
+        elif 'type' in dct and 'percentages' in dct:
+            type_name = dct['type']
+            percentages = dct['percentages']
+            return PercentageModifiers(type_name, percentages, dct.get('seed', self.seed))
+        elif 'type' in dct and 'sets' in dct:
+            type_name = dct['type']
+            sets = [(entry['members'], entry['context']) for entry in dct['sets']]
+            return SetModifiers(type_name, sets)
+        elif 'type' in dct and 'ranges' in dct:
+            type_name = dct['type']
+            ranges = [(entry.get('from'), entry.get('to'), entry['context']) for entry in dct['ranges']]
+            return RangeModifiers(type_name, ranges, dct.get('comparison', RangeModifiers.NUMERIC))
+        elif 'type' in dct and 'prefixes' in dct:
+            type_name = dct['type']
+            prefixes = dct['prefixes']
+            return PrefixModifiers(type_name, prefixes)
+        elif 'type' in dct and 'suffixes' in dct:
+            type_name = dct['type']
+            suffixes = dct['suffixes']
+            return SuffixModifiers(type_name, suffixes)
         elif 'modifiers' in dct:
             modifiers = dct['modifiers']
             value_object = self.value_decoder.decode_value(dct['value'])
@@ -134,35 +167,439 @@ class ContextDecoder(JSONDecoder):
             return Context(value_object, None)
         return dct
 
+    def decode_tree(self, tree: object) -> object:
+        """
+        Decode already parsed JSON tree, applying the object hook bottom-up, like decode() does for JSON text.
+        The provided tree is not modified.
+        """
+        if isinstance(tree, dict):
+            contexts = tree.get('contexts')
+            if self.spill_store is not None and isinstance(contexts, dict) and \
+                    len(contexts) >= self.spill_store.min_contexts:
+                return self.object_hook({key: self.__spill(value) if key == 'contexts' else self.decode_tree(value)
+                                         for key, value in tree.items()})
+            return self.object_hook({key: self.decode_tree(value) for key, value in tree.items()})
+        if isinstance(tree, list):
+            return [self.decode_tree(value) for value in tree]
+        return tree
+
+    def __spill(self, contexts: Dict[str, object]) -> SpilledContexts:
+        """
+        Write trees of sub-contexts to the spill store, instead of keeping them all in memory. Each sub-context
+        is decoded once, so that invalid sub-contexts fail the instantiation, like without spilling, instead of
+        their lookups. Decoded sub-contexts are dropped right away.
+        """
+        # sub-contexts are decoded on demand without spilling again
+        decoder = ContextDecoder(value_decoder=self.value_decoder, seed=self.seed)
+        for tree in contexts.values():
+            decoder.decode_tree(tree)
+        self.spilled = True
+        return self.spill_store.spill(contexts, decoder.decode_tree)
+
+
+def _validate_root(json_tree: object, root: str) -> Dict:
+    """ Return configurations under the root node of a parsed file, i.e. 'feature-flags'. """
+    if not isinstance(json_tree, dict) or not isinstance(json_tree.get(root), dict):
+        raise IOError('Missing root node ' + root + '.')
+    return json_tree[root]
+
+
+def _parse_in_worker(json_content: str, root: str) -> bytes:
+    """
+    Parse and validate JSON content in a worker process, and return configurations under the root node
+    in the compact marshal format, that loads much faster than JSON.
+    """
+    try:
+        json_tree = json.loads(json_content)
+    except ValueError as exception:
+        # JSON errors carry the whole document, so only the message is sent back.
+        raise IOError('Bad configuration content: ' + str(exception)) from None
+    return marshal.dumps(_validate_root(json_tree, root))
+
+
+class _StreamScanner:
+    """
+    Incremental scanner of a JSON document from a text stream. Only the unconsumed rest of the latest chunks is
+    buffered, so memory is bounded by the size of the largest value decoded at once, not by the document size.
+    """
+    __slots__ = ('stream', 'chunk_size', 'buffer', 'position', 'exhausted', 'decoder')
+
+    def __init__(self, stream: TextIO, chunk_size: int):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+        self.exhausted = False
+        self.decoder = JSONDecoder()
+
+    def __read(self, size: int) -> bool:
+        """ Append next chunk to the buffer, dropping consumed content. Return False at the end of the stream. """
+        chunk = self.stream.read(size)
+        if not chunk:
+            self.exhausted = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def next_token(self) -> str:
+        """ Skip whitespace and return next character without consuming it, or '' at the end of the document. """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\n\r':
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if self.exhausted or not self.__read(self.chunk_size):
+                return ''
+
+    def expect(self, token: str):
+        """ Consume provided structural character, i.e. '{'. """
+        if self.next_token() != token:
+            raise JSONDecodeError('Expecting ' + repr(token), self.buffer, self.position)
+        self.position += 1
+
+    def decode(self) -> object:
+        """ Decode next JSON value, reading further chunks until it is complete. """
+        self.next_token()
+        read_size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # a number may continue in the next chunk, unless a delimiter follows it, i.e. '1' of '1.5' or '1e3'
+                if self.exhausted or end < len(self.buffer) and \
+                        (self.buffer[end] in ' \t\n\r,]}' or not isinstance(value, (int, float))):
+                    self.position = end
+                    return value
+            except JSONDecodeError:
+                if self.exhausted:
+                    raise
+            # reading ever larger chunks keeps repeated decoding of a large value linear in its size
+            self.__read(read_size)
+            read_size *= 2
+
+    def members(self) -> Iterator[Tuple[str, '_StreamScanner']]:
+        """ Iterate over names of members of the next JSON object, leaving each value to the caller. """
+        self.expect('{')
+        if self.next_token() == '}':
+            self.position += 1
+            return
+        while True:
+            name = self.decode()
+            if not isinstance(name, str):
+                raise JSONDecodeError('Expecting property name', self.buffer, self.position)
+            self.expect(':')
+            yield name, self
+            token = self.next_token()
+            self.position += 1
+            if token == '}':
+                return
+            if token != ',':
+                raise JSONDecodeError("Expecting ',' delimiter", self.buffer, self.position - 1)
+
+
+def _stream_root(stream: TextIO, root: str, chunk_size: int) -> Iterator[Tuple[str, object]]:
+    """ Iterate over parsed configurations under the root node of a streamed file, one at a time. """
+    scanner = _StreamScanner(stream, chunk_size)
+    found = False
+    for name, value_scanner in scanner.members():
+        if name != root:
+            value_scanner.decode()
+            continue
+        if value_scanner.next_token() != '{':
+            raise IOError('Missing root node ' + root + '.')
+        found = True
+        for configuration_name, configuration_scanner in value_scanner.members():
+            yield configuration_name, configuration_scanner.decode()
+    if scanner.next_token() != '':
+        raise JSONDecodeError('Extra data', scanner.buffer, scanner.position)
+    if not found:
+        raise IOError('Missing root node ' + root + '.')
+
+
+class _CompiledConfiguration:
+    """ Parsed tree of a configuration with its current context, kept for re-instantiation without parsing. """
+    __slots__ = ('tree', 'value_decoder', 'value_class', 'volatile', 'context')
+
+    def __init__(self, tree: Dict, value_decoder: object):
+        self.tree = tree
+        self.value_decoder = value_decoder
+        # Class of config value objects at instantiation, or None for single values and non-instantiable configs. */
+        self.value_class: Optional[type] = None
+        # Re-instantiated on each forced refresh, i.e. for values that depend on process state. */
+        self.volatile: bool = isinstance(tree, dict) and tree.get('volatile') is True
+        # Current context, or None if the configuration could not be instantiated. */
+        self.context: Optional[Context] = None
+
+    def is_stale(self) -> bool:
+        """ Return True, if the configuration needs to be instantiated again. """
+        if self.volatile or self.context is None:
+            return True
+        if self.value_class is None:
+            return False
+        try:
+            return self.value_decoder.find_class() is not self.value_class
+        except InstantiationException:
+            return True
+
+    def release_tree(self):
+        """ Drop parsed tree, unless forced refreshes may instantiate the configuration again. """
+        if not self.volatile and self.context is not None and self.value_class is None:
+            self.tree = None
+
+
+class _TimeSlicer:
+    """ Yields the GIL to other threads, whenever a slice of cooperative work exceeds its time budget. """
+    __slots__ = ('slice_seconds', 'metrics', 'slice_start')
+
+    def __init__(self, slice_seconds: Optional[float], metrics: ConfigurationMapperMetrics):
+        self.slice_seconds = slice_seconds
+        self.metrics = metrics
+        self.slice_start = time.perf_counter()
+
+    def checkpoint(self):
+        """ End current slice and yield, if it exceeded the time budget. """
+        if self.slice_seconds is None:
+            return
+        elapsed = time.perf_counter() - self.slice_start
+        if elapsed >= self.slice_seconds:
+            self.metrics.observe_slice_duration(elapsed)
+            time.sleep(0)
+            self.slice_start = time.perf_counter()
+
+    def finish(self):
+        """ End last slice. """
+        if self.slice_seconds is not None:
+            self.metrics.observe_slice_duration(time.perf_counter() - self.slice_start)
+
 
 class ConfigurationMapper:
     """ De-serializes JSON to a dictionary of feature flag or runtime config contexts. """
+    # Minimum length of content in characters, that is parsed by the parse executor, if any.
+    OFFLOAD_MIN_SIZE = 1 << 20
+    # Minimum length of content in characters, that is parsed one configuration at a time.
+    STREAM_MIN_SIZE = 16 << 20
+    # Size in characters of chunks read from streams.
+    STREAM_CHUNK_SIZE = 1 << 16
+
     def __init__(self, root: str, value_decoder_factory: ValueDecoderFactory,
                  skip_non_instantiable: bool,
-                 metrics: ConfigurationMapperMetrics):
+                 metrics: ConfigurationMapperMetrics,
+                 static_context: Dict[str, str] = None,
+                 tracer: RefreshTracer = NO_OP_TRACER,
+                 parse_executor: Executor = None,
+                 offload_min_size: int = OFFLOAD_MIN_SIZE,
+                 slice_seconds: float = None,
+                 stream_min_size: Optional[int] = STREAM_MIN_SIZE,
+                 spill_store: SpillStore = None):
+        """
+        Initialize mapper.
+        :param root: name of root node with configurations, i.e. 'feature-flags'
+        :param value_decoder_factory: factory of value decoders for configuration value objects
+        :param skip_non_instantiable: skip (True) or fail (False) on non-instantiable configurations
+        :param metrics: metrics for mapper
+        :param static_context: context values, that are fixed for the lifetime of the process, used for pruning
+        :param tracer: tracer for parse and instantiation phases
+        :param parse_executor: executor for parsing and validating large files without holding the GIL of this
+               process, i.e. a ProcessPoolExecutor, or None to parse all files in the calling thread
+        :param offload_min_size: minimum length of content in characters, that is parsed by the executor
+        :param slice_seconds: time budget in seconds of slices of instantiation, after which other threads are
+               given the GIL, or None to instantiate all configurations of a file without yielding
+        :param stream_min_size: minimum length of content in characters, that is parsed and instantiated one
+               configuration at a time instead of as a whole tree, or None to never stream fetched content
+        :param spill_store: store for contexts maps of modifiers with many entries, i.e. per-tenant overrides,
+               that are kept on disk instead of in memory, or None to keep all contexts maps in memory
+        """
         self.root = root
         self.value_decoder_factory = value_decoder_factory
         self.skip_non_instantiable = skip_non_instantiable
         self.metrics = metrics
+        self.static_context = static_context
+        self.tracer = tracer
+        self.parse_executor = parse_executor
+        self.offload_min_size = offload_min_size
+        self.slice_seconds = slice_seconds
+        self.stream_min_size = stream_min_size
+        self.spill_store = spill_store
+        # Compiled configurations by name, per file name of the latest applied read. */
+        self.compiled_files: Dict[Optional[str], Dict[str, _CompiledConfiguration]] = {}
+        # Compiled configurations of reads of an update, that is not applied yet, or None outside of updates. */
+        self.staged_files: Optional[Dict[Optional[str], Dict[str, _CompiledConfiguration]]] = None
+
+    def begin_update(self):
+        """
+        Stage compiled configurations of subsequent reads, until the update is committed. Forced refreshes only
+        instantiate configurations again, that were read by committed updates, i.e. applied to a store.
+        """
+        self.staged_files = {}
+
+    def commit_update(self):
+        """ Keep compiled configurations of reads since the update began. """
+        self.compiled_files.update(self.staged_files)
+        self.staged_files = None
 
-    def read_value(self, json_content: str) -> Dict:
+    def abort_update(self):
+        """ Discard compiled configurations of reads since the update began. """
+        self.staged_files = None
+
+    def read_value(self, json_content: str, file_name: str = None) -> Dict:
         """
         Parse JSON content to dictionary of feature flag or runtime config contexts
         :param json_content: JSON to be de-serialized
+        :param file_name: name of file with JSON content, used for metrics
         :return: dictionary of feature flag or runtime config contexts
         """
-        configurations: Dict[str, Context] = {}
-        json_tree: Dict[str, Dict] = json.loads(json_content, encoding="utf-8")
-        configuration_dict: Dict[str, object] = json_tree[self.root]
-        for configuration_name, configuration in configuration_dict.items():  # i.e. "configs.XJConfig"
-            try:
-                configuration_json: str = json.dumps(configuration)
+        return self.read_file(FetchedFile(file_name, json_content))
+
+    def read_file(self, fetched_file: FetchedFile) -> Dict:
+        """
+        Parse fetched file to dictionary of feature flag or runtime config contexts. The JSON content is
+        parsed only once per fetched file, even if several mappers read it.
+        :param fetched_file: fetched file with JSON content
+        :return: dictionary of feature flag or runtime config contexts
+        """
+        if self.__should_stream(fetched_file):
+            return self.read_stream(fetched_file.open_stream(), fetched_file.file_name)
+        file_name = fetched_file.file_name
+        # trees kept by the fetcher anyway are kept as well, so that configurations sharing them are not decoded again
+        keep_trees = fetched_file.has_provided_json_tree()
+        span_attributes = {'merci.root': self.root, 'merci.file': file_name or ''}
+        start = time.perf_counter()
+        slicer = _TimeSlicer(self.slice_seconds, self.metrics)
+        with self.tracer.span(RefreshPhases.PARSE, span_attributes):
+            configuration_dict: Dict[str, object] = self.__parse(fetched_file)
+        parsed = time.perf_counter()
+        self.metrics.observe_duration(RefreshPhases.PARSE, parsed - start, file_name)
+        with self.tracer.span(RefreshPhases.INSTANTIATE, span_attributes):
+            previous_file = self.compiled_files.get(file_name, {})
+            compiled_file: Dict[str, _CompiledConfiguration] = {}
+            for configuration_name, configuration in configuration_dict.items():  # i.e. "configs.XJConfig"
+                previous = previous_file.get(configuration_name)
+                if previous is not None and previous.tree is configuration and not previous.is_stale():
+                    # the same parsed tree, i.e. shared by a delta with the previous content, is not decoded again
+                    compiled_file[configuration_name] = previous
+                    continue
+                slicer.checkpoint()
                 value_decoder = self.value_decoder_factory.create_value_decoder(configuration_name)
-                configuration_context: Context = json.loads(configuration_json, encoding="utf-8", cls=ContextDecoder, value_decoder=value_decoder)
-                configurations[configuration_name] = configuration_context
-            except Exception as exception:
-                if self.skip_non_instantiable:
-                    self.metrics.increment_non_instantiable_skips()
-                else:
-                    raise exception
-        return configurations
+                compiled = _CompiledConfiguration(configuration, value_decoder)
+                self.__instantiate(configuration_name, compiled)
+                if not keep_trees:
+                    compiled.release_tree()
+                compiled_file[configuration_name] = compiled
+            self.__store_compiled_file(file_name, compiled_file)
+        slicer.finish()
+        self.metrics.observe_duration(RefreshPhases.INSTANTIATE, time.perf_counter() - parsed, file_name)
+        return _contexts(compiled_file)
+
+    def read_stream(self, stream: TextIO, file_name: str = None) -> Dict:
+        """
+        Parse JSON content from a text stream, i.e. an open file, to dictionary of feature flag or runtime config
+        contexts. Configurations are parsed and instantiated one at a time, so that, besides the resulting contexts,
+        memory is bounded by the largest single configuration instead of the size of the document. Parsed trees
+        are only kept for configurations, that forced refreshes may instantiate again.
+        :param stream: text stream with JSON content
+        :param file_name: name of file with JSON content, used for metrics
+        :return: dictionary of feature flag or runtime config contexts
+        """
+        span_attributes = {'merci.root': self.root, 'merci.file': file_name or ''}
+        start = time.perf_counter()
+        slicer = _TimeSlicer(self.slice_seconds, self.metrics)
+        instantiate_seconds = 0.0
+        # parsing and instantiation are interleaved, so the span covers both, while their durations are split
+        with self.tracer.span(RefreshPhases.PARSE, span_attributes):
+            compiled_file: Dict[str, _CompiledConfiguration] = {}
+            for configuration_name, configuration in _stream_root(stream, self.root, self.STREAM_CHUNK_SIZE):
+                slicer.checkpoint()
+                instantiate_start = time.perf_counter()
+                value_decoder = self.value_decoder_factory.create_value_decoder(configuration_name)
+                compiled = _CompiledConfiguration(configuration, value_decoder)
+                self.__instantiate(configuration_name, compiled)
+                compiled.release_tree()
+                compiled_file[configuration_name] = compiled
+                instantiate_seconds += time.perf_counter() - instantiate_start
+            self.__store_compiled_file(file_name, compiled_file)
+        slicer.finish()
+        self.metrics.observe_duration(RefreshPhases.PARSE, time.perf_counter() - start - instantiate_seconds, file_name)
+        self.metrics.observe_duration(RefreshPhases.INSTANTIATE, instantiate_seconds, file_name)
+        return _contexts(compiled_file)
+
+    def __store_compiled_file(self, file_name: Optional[str], compiled_file: Dict[str, _CompiledConfiguration]):
+        if self.staged_files is not None:
+            self.staged_files[file_name] = compiled_file
+        else:
+            self.compiled_files[file_name] = compiled_file
+
+    def __should_stream(self, fetched_file: FetchedFile) -> bool:
+        """
+        Return True for large or compressed content, unless it is parsed by the executor or its tree was parsed
+        already.
+        """
+        if self.stream_min_size is None or fetched_file.has_json_tree():
+            return False
+        if not fetched_file.is_decompressed():
+            # the size of compressed content is unknown without decompressing it first
+            return True
+        length = len(fetched_file.content)
+        return length >= self.stream_min_size and (self.parse_executor is None or length < self.offload_min_size)
+
+    def __parse(self, fetched_file: FetchedFile) -> Dict[str, object]:
+        """
+        Return parsed configurations under the root node, parsed by the executor in case of large content, unless
+        the content was parsed already, i.e. patched by a delta, whose unchanged configurations are reused.
+        """
+        if self.parse_executor is not None and not fetched_file.has_json_tree() and \
+                len(fetched_file.content) >= self.offload_min_size:
+            try:
+                future = self.parse_executor.submit(_parse_in_worker, fetched_file.content, self.root)
+                return marshal.loads(future.result())
+            except BrokenExecutor:
+                self.metrics.increment_parse_offload_failures()
+        return _validate_root(fetched_file.json_tree(), self.root)
+
+    def refresh_values(self, file_name: str = None) -> Optional[Dict]:
+        """
+        Instantiate configurations of the latest read of a file again, without parsing its JSON content, if
+        they are marked as volatile, their config class was reloaded or they could not be instantiated before.
+        :param file_name: name of previously read file
+        :return: dictionary of feature flag or runtime config contexts, or None if no configuration changed
+        """
+        compiled_file = self.compiled_files[file_name]
+        start = time.perf_counter()
+        slicer = _TimeSlicer(self.slice_seconds, self.metrics)
+        with self.tracer.span(RefreshPhases.INSTANTIATE, {'merci.root': self.root, 'merci.file': file_name or ''}):
+            changed = False
+            for configuration_name, compiled in compiled_file.items():
+                if compiled.is_stale():
+                    slicer.checkpoint()
+                    previous_context = compiled.context
+                    self.__instantiate(configuration_name, compiled)
+                    changed = changed or compiled.context is not previous_context
+        slicer.finish()
+        self.metrics.observe_duration(RefreshPhases.INSTANTIATE, time.perf_counter() - start, file_name)
+        return _contexts(compiled_file) if changed else None
+
+    def __instantiate(self, configuration_name: str, compiled: _CompiledConfiguration):
+        """ Decode configuration tree to feature flag or runtime config context. """
+        try:
+            decoder = ContextDecoder(value_decoder=compiled.value_decoder, seed=configuration_name,
+                                     spill_store=self.spill_store)
+            configuration_context: Context = decoder.decode_tree(compiled.tree)
+            if self.static_context:
+                configuration_context = configuration_context.partially_evaluate(self.static_context)
+            if isinstance(compiled.value_decoder, ObjectValueDecoder):
+                compiled.value_class = compiled.value_decoder.find_class()
+            compiled.context = configuration_context
+            if decoder.spilled:
+                # spilled contexts maps would otherwise still be kept in memory as part of the parsed tree
+                compiled.release_tree()
+        except Exception as exception:
+            compiled.context = None
+            compiled.value_class = None
+            if self.skip_non_instantiable:
+                self.metrics.increment_non_instantiable_skips()
+            else:
+                raise exception
+
+
+def _contexts(compiled_file: Dict[str, _CompiledConfiguration]) -> Dict[str, Context]:
+    """ Return instantiated contexts by configuration name. """
+    return {name: compiled.context for name, compiled in compiled_file.items() if compiled.context is not None}
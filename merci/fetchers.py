@@ -16,11 +16,23 @@
 """
 Classes for fetching feature flag and config JSON content locally or from remote servers.
 """
+import codecs
+import gzip
+import hashlib
+import io
+import json
 import os
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from concurrent.futures import Future
+from typing import Any, BinaryIO, List, Dict, Optional, TextIO, Tuple
 
-from merci.metrics import ConfigurationFetcherMetrics
+from merci.metrics import ConfigurationFetcherMetrics, RefreshPhases
 
 
 class ConfigurationFetcher(ABC):
@@ -34,6 +46,30 @@ class ConfigurationFetcher(ABC):
         :return: dictionary of JSON configuration content
         """
 
+    def fetch_raw_files(self, application: str, file_names: List[str]) -> Dict[str, 'FetchedFile']:
+        """
+        Fetch configuration files as they are stored, i.e. compressed, so that readers fingerprint the stored bytes
+        and decompress them only for parsing changed content.
+        :param application: application name
+        :param file_names: list of file names
+        :return: dictionary of fetched files by file name
+        """
+        return {file_name: FetchedFile(file_name, content)
+                for file_name, content in self.fetch_files(application, file_names).items()}
+
+
+class WatchableConfigurationFetcher(ConfigurationFetcher):
+    """ Fetcher, whose backend can be watched for changes of the files of an application, i.e. by long polling. """
+    @abstractmethod
+    def watch(self, application: str, index: Optional[str], wait_seconds: float) -> str:
+        """
+        Block until files of an application change after provided index, or until the wait time passed.
+        :param application: application name
+        :param index: index returned by the previous watch, or None to return the current index without waiting
+        :param wait_seconds: maximum time to wait for changes
+        :return: current index, that differs from provided index after changes
+        """
+
 
 class FilesystemConfigurationFetcher(ConfigurationFetcher):
     """ Fetches JSON configuration content from a local file system. """
@@ -51,18 +87,23 @@ class FilesystemConfigurationFetcher(ConfigurationFetcher):
         :param file_names: list of file names
         :return: dictionary of JSON configuration content
         """
-        contents: Dict[str, str] = {}
+        return {file_name: fetched_file.content
+                for file_name, fetched_file in self.fetch_raw_files(application, file_names).items()}
+
+    def fetch_raw_files(self, application: str, file_names: List[str]) -> Dict[str, 'FetchedFile']:
+        fetched_files: Dict[str, FetchedFile] = {}
         try:
             self.metrics.increment_requests()
             for file_name in file_names:
                 try:
-                    content = self.fetch_file(application, file_name)
-                    contents[file_name] = content
+                    file_start = time.perf_counter()
+                    fetched_files[file_name] = self.read_file(application, file_name)
+                    self.metrics.observe_duration(RefreshPhases.FETCH, time.perf_counter() - file_start, file_name)
                 except FileNotFoundError as exception:
                     self.metrics.increment_missing_files()
                     if not self.skip_missing_files:
                         raise exception
-            return contents
+            return fetched_files
         except IOError as exception:
             self.metrics.increment_failures()
             raise exception
@@ -74,6 +115,647 @@ class FilesystemConfigurationFetcher(ConfigurationFetcher):
         :param file_name: file name
         :return: JSON configuration content
         """
+        return self.read_file(application, file_name).content
+
+    def read_file(self, application: str, file_name: str) -> 'FetchedFile':
+        """
+        Read configuration file without decompressing it. Files compressed with gzip or zstd are recognized by
+        their extension, i.e. '.json.gz' or '.json.zst', or by their magic bytes.
+        :param application: application name
+        :param file_name: file name
+        :return: fetched file
+        """
         path = os.path.join(self.base_path, application + file_name)
-        with open(path, 'r', encoding="utf-8") as file:
-            return file.read()
+        with open(path, 'rb') as file:
+            data = file.read()
+        compression = _compression(path, data)
+        if compression is None:
+            return FetchedFile(file_name, data.decode('utf-8'))
+        return FetchedFile(file_name, compressed=data, compression=compression)
+
+    def open_file(self, application: str, file_name: str) -> TextIO:
+        """
+        Open JSON configuration file for reading, i.e. for streaming it into ConfigurationMapper.read_stream().
+        Compressed files are decompressed while reading.
+        :param application: application name
+        :param file_name: file name
+        :return: text stream of JSON configuration content, to be closed by the caller
+        """
+        path = os.path.join(self.base_path, application + file_name)
+        with open(path, 'rb') as file:
+            compression = _compression(path, file.read(4))
+        if compression is None:
+            return open(path, 'r', encoding='utf-8')
+        if compression == GZIP:
+            return gzip.open(path, 'rt', encoding='utf-8')
+        return _zstandard().open(path, 'rt', encoding='utf-8')
+
+
+class GitConfigurationFetcher(ConfigurationFetcher):
+    """
+    Fetches JSON configuration content from a local git repository at a ref, i.e. 'HEAD' or a branch, using the
+    git command line tool. The paths of files are like those of the filesystem fetcher, relative to the root of
+    the repository. Git object ids serve as fingerprints, so that files of an unchanged commit are neither read
+    nor hashed again, and only blobs, that changed between commits, are read.
+    """
+    def __init__(self, repository_path: str, skip_missing_files: bool,
+                 metrics: ConfigurationFetcherMetrics,
+                 ref: str = 'HEAD',
+                 git_executable: str = 'git'):
+        """
+        Initialize fetcher.
+        :param repository_path: path of the working tree or bare repository
+        :param skip_missing_files: skip (True) or fail (False) on files missing at the ref
+        :param metrics: metrics for fetcher
+        :param ref: commit, branch or tag to read files at, resolved again on each fetch
+        :param git_executable: path of the git command line tool
+        """
+        if ref.startswith('-'):
+            raise ValueError('Invalid git ref ' + ref + '.')
+        self.repository_path = repository_path
+        self.skip_missing_files = skip_missing_files
+        self.metrics = metrics
+        self.ref = ref
+        self.git_executable = git_executable
+        # Id of the commit, that the listed blob ids belong to. */
+        self.commit_id: Optional[str] = None
+        # Blob ids by path at the commit, or None for missing files. */
+        self.blob_ids: Dict[str, Optional[str]] = {}
+        # Latest read blob id and raw content by path, without decompressed content or parsed trees. */
+        self.blobs: Dict[str, Tuple[str, bytes]] = {}
+        self.lock = threading.Lock()
+
+    def fetch_files(self, application: str, file_names: List[str]) -> Dict[str, str]:
+        """
+        Fetch JSON configuration content based on provided application and file names.
+        :param application: application name
+        :param file_names: list of file names
+        :return: dictionary of JSON configuration content
+        """
+        return {file_name: fetched_file.content
+                for file_name, fetched_file in self.fetch_raw_files(application, file_names).items()}
+
+    def fetch_raw_files(self, application: str, file_names: List[str]) -> Dict[str, 'FetchedFile']:
+        try:
+            self.metrics.increment_requests()
+            start = time.perf_counter()
+            with self.lock:
+                fetched_files = self.__fetch_files(application, file_names)
+            self.metrics.observe_duration(RefreshPhases.FETCH, time.perf_counter() - start)
+            return fetched_files
+        except IOError as exception:
+            self.metrics.increment_failures()
+            raise exception
+
+    def __fetch_files(self, application: str, file_names: List[str]) -> Dict[str, 'FetchedFile']:
+        commit_id = self.__git('rev-parse', '--verify', '--quiet', self.ref + '^{commit}').decode('ascii').strip()
+        if commit_id != self.commit_id:
+            self.commit_id = commit_id
+            self.blob_ids = {}
+        paths = {file_name: (application + file_name).lstrip('/') for file_name in file_names}
+        unlisted_paths = [path for path in paths.values() if path not in self.blob_ids]
+        if unlisted_paths:
+            listed_blob_ids = self.__list_blobs(commit_id, unlisted_paths)
+            for path in unlisted_paths:
+                self.blob_ids[path] = listed_blob_ids.get(path)
+        changed_blob_ids = {self.blob_ids[path] for path in paths.values()
+                            if self.blob_ids[path] is not None and
+                            (path not in self.blobs or self.blobs[path][0] != self.blob_ids[path])}
+        blobs = self.__read_blobs(sorted(changed_blob_ids))
+        fetched_files: Dict[str, 'FetchedFile'] = {}
+        for file_name, path in paths.items():
+            blob_id = self.blob_ids[path]
+            if blob_id is None:
+                self.metrics.increment_missing_files()
+                if not self.skip_missing_files:
+                    raise FileNotFoundError('Missing file ' + path + ' at ' + self.ref + '.')
+                continue
+            if blob_id in blobs:
+                self.blobs[path] = (blob_id, blobs[blob_id])
+            # each fetch gets a file of its own, which readers release once applied, with the blob id as fingerprint
+            fetched_files[file_name] = self.__fetched_file(file_name, path, blob_id, self.blobs[path][1])
+        return fetched_files
+
+    @staticmethod
+    def __fetched_file(file_name: str, path: str, blob_id: str, data: bytes) -> 'FetchedFile':
+        fingerprint = bytes(file_name + '\0' + blob_id, 'UTF-8')
+        compression = _compression(path, data)
+        if compression is None:
+            return FetchedFile(file_name, data.decode('utf-8'), fingerprint=fingerprint)
+        return FetchedFile(file_name, compressed=data, compression=compression, fingerprint=fingerprint)
+
+    def __list_blobs(self, commit_id: str, paths: List[str]) -> Dict[str, str]:
+        """ Return blob ids by path of provided paths at a commit, without missing paths. """
+        output = self.__git('ls-tree', '-r', '-z', '--full-tree', commit_id, '--', *paths)
+        blob_ids: Dict[str, str] = {}
+        for entry in output.split(b'\0'):
+            if not entry:
+                continue
+            info, path = entry.split(b'\t', 1)
+            _, object_type, object_id = info.split(b' ')
+            if object_type == b'blob':
+                blob_ids[path.decode('utf-8')] = object_id.decode('ascii')
+        return blob_ids
+
+    def __read_blobs(self, blob_ids: List[str]) -> Dict[str, bytes]:
+        """ Return content of provided blobs by blob id, read with a single git process. """
+        if not blob_ids:
+            return {}
+        request = bytes(''.join(blob_id + '\n' for blob_id in blob_ids), 'ascii')
+        output = self.__git('cat-file', '--batch', stdin=request)
+        blobs: Dict[str, bytes] = {}
+        position = 0
+        for blob_id in blob_ids:
+            header_end = output.index(b'\n', position)
+            header = output[position:header_end].split(b' ')
+            if len(header) != 3:
+                raise IOError('Could not read git object ' + blob_id + '.')
+            size = int(header[2])
+            blobs[blob_id] = output[header_end + 1:header_end + 1 + size]
+            position = header_end + 1 + size + 1
+        return blobs
+
+    def __git(self, *args: str, stdin: bytes = None) -> bytes:
+        try:
+            command = [self.git_executable, '--literal-pathspecs', '-C', self.repository_path] + list(args)
+            process = subprocess.run(command, input=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+        except OSError as exception:
+            raise IOError('Could not run git: ' + str(exception)) from None
+        if process.returncode != 0:
+            message = process.stderr.decode('utf-8', 'replace').strip() or 'unknown ref ' + self.ref
+            raise IOError('git ' + args[0] + ' failed: ' + message)
+        return process.stdout
+
+
+class DeltaSyncConfigurationFetcher(ConfigurationFetcher):
+    """
+    Fetches JSON configuration content from a delta-sync server, that sends changes since the version held by
+    the fetcher instead of full documents. Each file is requested with GET <base url>/<application><file name>,
+    with parameter since=<version> once a version is held. The server responds with
+    - status 200 and {"version": v, "document": {...}} for full content,
+    - status 200 and {"version": v, "base": b, "patch": [...]} for changes since version b, as JSON patch
+      operations add, remove and replace (RFC 6902), applied to the held document,
+    - status 304 for unchanged content,
+    - status 410 if it cannot send changes since the requested version.
+    A version gap, a delta for another base version or a patch, that cannot be applied, triggers a full fetch.
+    Patches copy only the nodes on the paths of their operations, so configurations, that a delta did not
+    touch, keep their parsed trees, and mappers do not decode them again.
+    """
+    def __init__(self, base_url: str, skip_missing_files: bool,
+                 metrics: ConfigurationFetcherMetrics,
+                 timeout_seconds: float = 30):
+        """
+        Initialize fetcher.
+        :param base_url: URL of the server, i.e. 'https://config.example.com/merci'
+        :param skip_missing_files: skip (True) or fail (False) on missing files, i.e. status 404
+        :param metrics: metrics for fetcher
+        :param timeout_seconds: timeout of each request
+        """
+        self.base_url = base_url.rstrip('/')
+        self.skip_missing_files = skip_missing_files
+        self.metrics = metrics
+        self.timeout_seconds = timeout_seconds
+        # Held version and fetched file by URL of file. */
+        self.fetched_files: Dict[str, Tuple[str, FetchedFile]] = {}
+        self.lock = threading.Lock()
+
+    def fetch_files(self, application: str, file_names: List[str]) -> Dict[str, str]:
+        """
+        Fetch JSON configuration content based on provided application and file names.
+        :param application: application name
+        :param file_names: list of file names
+        :return: dictionary of JSON configuration content
+        """
+        return {file_name: fetched_file.content
+                for file_name, fetched_file in self.fetch_raw_files(application, file_names).items()}
+
+    def fetch_raw_files(self, application: str, file_names: List[str]) -> Dict[str, 'FetchedFile']:
+        fetched_files: Dict[str, FetchedFile] = {}
+        try:
+            self.metrics.increment_requests()
+            with self.lock:
+                for file_name in file_names:
+                    try:
+                        file_start = time.perf_counter()
+                        fetched_files[file_name] = self.__fetch_file(application, file_name)
+                        self.metrics.observe_duration(RefreshPhases.FETCH, time.perf_counter() - file_start,
+                                                      file_name)
+                    except FileNotFoundError as exception:
+                        self.metrics.increment_missing_files()
+                        if not self.skip_missing_files:
+                            raise exception
+            return fetched_files
+        except IOError as exception:
+            self.metrics.increment_failures()
+            raise exception
+
+    def __fetch_file(self, application: str, file_name: str) -> 'FetchedFile':
+        url = self.base_url + '/' + urllib.parse.quote(application + file_name)
+        held = self.fetched_files.get(url)
+        if held is None:
+            return self.__fetch_full(url, file_name)
+        version, fetched_file = held
+        status, response = self.__request(url + '?' + urllib.parse.urlencode({'since': version}))
+        if status == 304:
+            return fetched_file
+        if status == 200 and 'document' in response:
+            return self.__hold(url, file_name, response)
+        if status == 200 and response.get('base') == version:
+            try:
+                json_tree = _apply_patch(fetched_file.json_tree(), response['patch'])
+            except (KeyError, IndexError, TypeError, ValueError):
+                json_tree = None
+            if json_tree is not None:
+                self.metrics.increment_delta_updates()
+                return self.__hold(url, file_name, {'version': response['version'], 'document': json_tree})
+        self.metrics.increment_resyncs()
+        return self.__fetch_full(url, file_name)
+
+    def __fetch_full(self, url: str, file_name: str) -> 'FetchedFile':
+        status, response = self.__request(url)
+        if status != 200 or 'document' not in response:
+            raise IOError('Missing full content of ' + url + '.')
+        return self.__hold(url, file_name, response)
+
+    def __hold(self, url: str, file_name: str, response: Dict[str, Any]) -> 'FetchedFile':
+        version = str(response['version'])
+        fingerprint = bytes(file_name + '\0' + url + '\0' + version, 'UTF-8')
+        fetched_file = FetchedFile(file_name, fingerprint=fingerprint, json_tree=response['document'])
+        self.fetched_files[url] = (version, fetched_file)
+        return fetched_file
+
+    def __request(self, url: str) -> Tuple[int, Dict[str, Any]]:
+        """ Return status and parsed JSON body of a GET request. """
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout_seconds) as response:
+                body = json.loads(response.read().decode('utf-8'))
+                if not isinstance(body, dict) or 'version' not in body:
+                    raise IOError('Bad delta-sync response from ' + url + '.')
+                return response.status, body
+        except urllib.error.HTTPError as exception:
+            if exception.code == 404:
+                raise FileNotFoundError('Missing file ' + url + '.') from None
+            if exception.code in (304, 410):
+                return exception.code, {}
+            raise IOError('Request to ' + url + ' failed with status ' + str(exception.code) + '.') from None
+        except ValueError as exception:
+            raise IOError('Bad delta-sync response from ' + url + ': ' + str(exception)) from None
+
+
+class LongPollConfigurationFetcher(WatchableConfigurationFetcher):
+    """
+    Fetches JSON configuration content from a key-value store with blocking queries, like Consul. Each file is
+    requested with GET <base url>/<application><file name>. Changes are watched per application with a long poll
+    GET <base url>/<application>?index=<index>&wait=<seconds>s, that the server answers, once anything under the
+    application changed after the index or the wait time passed, with the current index in the index header.
+
+    Sample code for Consul, with files stored as keys like 'merci/myapp/feature-flags.json':
+
+    fetcher = LongPollConfigurationFetcher("http://localhost:8500/v1/kv/merci", False, metrics,
+                                           parameters={'raw': ''}, watch_parameters={'recurse': ''})
+    """
+    def __init__(self, base_url: str, skip_missing_files: bool,
+                 metrics: ConfigurationFetcherMetrics,
+                 timeout_seconds: float = 30,
+                 index_header: str = 'X-Consul-Index',
+                 parameters: Dict[str, str] = None,
+                 watch_parameters: Dict[str, str] = None):
+        """
+        Initialize fetcher.
+        :param base_url: URL of the key-value store, i.e. 'http://localhost:8500/v1/kv/merci'
+        :param skip_missing_files: skip (True) or fail (False) on missing files, i.e. status 404
+        :param metrics: metrics for fetcher
+        :param timeout_seconds: timeout of each request, in addition to the wait time of watches
+        :param index_header: name of response header with the current index
+        :param parameters: further query parameters of requests for files
+        :param watch_parameters: further query parameters of watches
+        """
+        self.base_url = base_url.rstrip('/')
+        self.skip_missing_files = skip_missing_files
+        self.metrics = metrics
+        self.timeout_seconds = timeout_seconds
+        self.index_header = index_header
+        self.parameters = parameters or {}
+        self.watch_parameters = watch_parameters or {}
+
+    def fetch_files(self, application: str, file_names: List[str]) -> Dict[str, str]:
+        """
+        Fetch JSON configuration content based on provided application and file names.
+        :param application: application name
+        :param file_names: list of file names
+        :return: dictionary of JSON configuration content
+        """
+        contents: Dict[str, str] = {}
+        try:
+            self.metrics.increment_requests()
+            for file_name in file_names:
+                try:
+                    file_start = time.perf_counter()
+                    url = self.__url(application + file_name, self.parameters)
+                    with urllib.request.urlopen(url, timeout=self.timeout_seconds) as response:
+                        contents[file_name] = response.read().decode('utf-8')
+                    self.metrics.observe_duration(RefreshPhases.FETCH, time.perf_counter() - file_start, file_name)
+                except urllib.error.HTTPError as exception:
+                    if exception.code != 404:
+                        raise IOError('Request for ' + file_name + ' failed with status ' + str(exception.code) + '.')
+                    self.metrics.increment_missing_files()
+                    if not self.skip_missing_files:
+                        raise FileNotFoundError('Missing file ' + file_name + '.') from None
+                except UnicodeDecodeError as exception:
+                    raise IOError('Bad content of ' + file_name + ': ' + str(exception)) from None
+            return contents
+        except IOError as exception:
+            self.metrics.increment_failures()
+            raise exception
+
+    def watch(self, application: str, index: Optional[str], wait_seconds: float) -> str:
+        parameters = dict(self.watch_parameters)
+        if index is not None:
+            parameters.update(index=index, wait='%gs' % wait_seconds)
+        timeout_seconds = self.timeout_seconds + (0 if index is None else wait_seconds)
+        try:
+            with urllib.request.urlopen(self.__url(application, parameters), timeout=timeout_seconds) as response:
+                headers = response.headers
+        except urllib.error.HTTPError as exception:
+            # key-value stores report the index of missing keys as well
+            if exception.code != 404:
+                raise IOError('Watch of ' + application + ' failed with status ' + str(exception.code) + '.')
+            headers = exception.headers
+        current_index = headers.get(self.index_header)
+        if current_index is None:
+            raise IOError('Missing index header ' + self.index_header + ' in watch of ' + application + '.')
+        return current_index
+
+    def __url(self, path: str, parameters: Dict[str, str]) -> str:
+        url = self.base_url + '/' + urllib.parse.quote(path.lstrip('/'))
+        return url + '?' + urllib.parse.urlencode(parameters) if parameters else url
+
+
+def _apply_patch(json_tree: Dict, operations: List[Dict[str, Any]]) -> Dict:
+    """
+    Return new JSON tree with JSON patch operations add, remove and replace applied. The provided tree is not
+    modified, and nodes, that are not on the path of any operation, are shared with it.
+    """
+    copies: Dict[int, object] = {}
+
+    def copy(node: object) -> object:
+        if id(node) in copies:
+            return node
+        node = dict(node) if isinstance(node, dict) else list(node)
+        copies[id(node)] = node  # keeps the copy alive, so that its id is not reused
+        return node
+
+    root = copy(json_tree)
+    for operation in operations:
+        op = operation['op']
+        if op not in ('add', 'remove', 'replace'):
+            raise ValueError('Unsupported patch operation ' + str(op) + '.')
+        tokens = [token.replace('~1', '/').replace('~0', '~') for token in operation['path'].split('/')[1:]]
+        if not tokens or not operation['path'].startswith('/'):
+            raise ValueError('Patches of the whole document are not supported.')
+        parent = root
+        for token in tokens[:-1]:
+            key = token if isinstance(parent, dict) else int(token)
+            child = parent[key]
+            if not isinstance(child, (dict, list)):
+                raise ValueError('Invalid path ' + operation['path'] + '.')
+            parent[key] = parent = copy(child)
+        name = tokens[-1]
+        if isinstance(parent, dict):
+            if op == 'add':
+                parent[name] = operation['value']
+            elif op == 'remove':
+                del parent[name]
+            elif name not in parent:
+                raise KeyError(name)
+            else:
+                parent[name] = operation['value']
+        else:
+            index = len(parent) if name == '-' and op == 'add' else int(name)
+            if op == 'add':
+                parent.insert(index, operation['value'])
+            elif op == 'remove':
+                del parent[index]
+            elif op == 'replace':
+                parent[index] = operation['value']
+    return root
+
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+_EXTENSIONS = {'.gz': GZIP, '.gzip': GZIP, '.zst': ZSTD, '.zstd': ZSTD}
+_MAGIC_BYTES = {b'\x1f\x8b': GZIP, b'\x28\xb5\x2f\xfd': ZSTD}
+
+
+def _compression(path: str, head: bytes) -> Optional[str]:
+    """ Return compression format of a file by its extension or its first bytes, or None for plain content. """
+    compression = _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if compression is not None:
+        return compression
+    for magic_bytes, compression in _MAGIC_BYTES.items():
+        if head.startswith(magic_bytes):
+            return compression
+    return None
+
+
+def _zstandard():
+    """ Return the optional zstandard module. """
+    try:
+        import zstandard
+    except ImportError as exception:
+        raise IOError('Reading zstd compressed files requires the zstandard package.') from exception
+    return zstandard
+
+
+def _decompressing_stream(compression: str, stream: BinaryIO) -> BinaryIO:
+    """ Return stream of decompressed bytes. zstd requires the zstandard package. """
+    if compression == GZIP:
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    return _zstandard().ZstdDecompressor().stream_reader(stream)
+
+
+class _DecompressedReader:
+    """
+    Text stream of decompressed content, that reports corrupt content as IOError, like failed fetches, since
+    errors of decompressors differ by format, i.e. EOFError for truncated gzip content.
+    """
+    __slots__ = ('stream', 'decoder')
+
+    def __init__(self, compression: str, compressed: bytes):
+        self.stream = _decompressing_stream(compression, io.BytesIO(compressed))
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def read(self, size: int = -1) -> str:
+        try:
+            while True:
+                data = self.stream.read(size)
+                text = self.decoder.decode(data, final=not data)
+                if text or not data:
+                    return text
+        except IOError:
+            raise
+        except Exception as exception:
+            raise IOError('Bad compressed content: ' + str(exception)) from exception
+
+
+class _StringReader:
+    """ Text stream over a string, that returns slices instead of copying the whole string like io.StringIO. """
+    __slots__ = ('content', 'position')
+
+    def __init__(self, content: str):
+        self.content = content
+        self.position = 0
+
+    def read(self, size: int = -1) -> str:
+        end = len(self.content) if size < 0 else self.position + size
+        chunk = self.content[self.position:end]
+        self.position += len(chunk)
+        return chunk
+
+
+class FetchedFile:
+    """
+    Fetched content of a configuration file, with a fingerprint and a parsed JSON tree, that are computed
+    once on first use. Readers, that share a fetched file, share its parsed JSON tree, which they must not modify.
+    Compressed files are fingerprinted by their compressed bytes, and decompressed only once their content is used.
+    """
+    __slots__ = ('file_name', '_content', 'compressed', 'compression', '_fingerprint', '_json_tree', '_provided_tree')
+
+    def __init__(self, file_name: str, content: str = None, compressed: bytes = None, compression: str = None,
+                 fingerprint: bytes = None, json_tree: Dict = None):
+        """
+        Initialize fetched file with either plain or compressed content.
+        :param file_name: file name
+        :param content: JSON content
+        :param compressed: compressed JSON content
+        :param compression: compression format of compressed content, i.e. 'gzip'
+        :param fingerprint: fingerprint, that is known without hashing the content, i.e. a git object id
+        :param json_tree: parsed JSON content, i.e. after applying a delta, that is serialized only on demand
+        """
+        self.file_name = file_name
+        self._content: Optional[str] = content
+        self.compressed: Optional[bytes] = compressed
+        self.compression: Optional[str] = compression
+        self._fingerprint: Optional[bytes] = fingerprint
+        self._json_tree: Optional[Dict] = json_tree
+        # True, if the parsed JSON content is kept by the fetcher, i.e. as the base of the next delta. */
+        self._provided_tree = json_tree is not None
+
+    @property
+    def content(self) -> str:
+        """ JSON content, decompressed or serialized from the parsed JSON content on first use. """
+        if self._content is None:
+            if self.compressed is None:
+                self._content = json.dumps(self._json_tree)
+            else:
+                self._content = self.open_stream().read()
+        return self._content
+
+    def is_decompressed(self) -> bool:
+        """ Return True, if the content is available without decompressing it. """
+        return self.compressed is None or self._content is not None
+
+    def open_stream(self) -> TextIO:
+        """
+        Return new text stream of the content, decompressing compressed content while reading. Content is not kept
+        for streams, so that streaming, i.e. to the content cache, does not pin decompressed or serialized content.
+        """
+        if self._content is not None:
+            return _StringReader(self._content)
+        if self.compressed is None:
+            return _StringReader(json.dumps(self._json_tree))
+        return _DecompressedReader(self.compression, self.compressed)
+
+    def fingerprint(self) -> bytes:
+        """ Return hash of file name and content, or of compressed content for compressed files. """
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            digest.update(bytes(self.file_name, 'UTF-8'))
+            if self.compressed is not None:
+                digest.update(self.compressed)
+            else:
+                digest.update(bytes(self.content, 'UTF-8'))
+            self._fingerprint = digest.digest()
+        return self._fingerprint
+
+    def has_json_tree(self) -> bool:
+        """ Return True, if the JSON content was parsed already. """
+        return self._json_tree is not None
+
+    def has_provided_json_tree(self) -> bool:
+        """ Return True, if the parsed JSON content was provided by the fetcher, instead of parsed from content. """
+        return self._provided_tree
+
+    def json_tree(self) -> Dict:
+        """ Return parsed JSON content. """
+        if self._json_tree is None:
+            self._json_tree = json.loads(self.content)
+        return self._json_tree
+
+
+class FetchCoalescer:
+    """
+    Coalesces fetches of the same files by several configuration readers, i.e. within one refresh cycle.
+    Each file is fetched once per fetcher and application, and all readers share its fetched content and
+    fingerprint. Failures are shared with readers, that requested all files of the failed fetch as well, so that
+    a failing source is not requested again in the same cycle. Other readers fetch their files of a failed fetch
+    themselves, since the failure may be caused by a file, that they did not request.
+    Safe for concurrent use, i.e. by readers executed in parallel threads.
+    """
+    def __init__(self):
+        self.fetches: Dict[Tuple[ConfigurationFetcher, str, str], Future] = {}
+        # Names of the files, that were fetched together, by future of each of their fetched files. */
+        self.batches: Dict[Future, List[str]] = {}
+        self.lock = threading.Lock()
+        # Number of files, that were requested by readers, but not fetched again. */
+        self.coalesced_files = 0
+
+    def fetch_files(self, fetcher: ConfigurationFetcher, application: str,
+                    file_names: List[str]) -> Dict[str, FetchedFile]:
+        """
+        Fetch files, that were not fetched yet, and return fetched content of all provided files.
+        :param fetcher: fetcher of files
+        :param application: application name
+        :param file_names: list of file names
+        :return: dictionary of fetched files by file name, in order of file names, without skipped missing files
+        """
+        futures: Dict[str, Future] = {}
+        own_file_names: List[str] = []
+        with self.lock:
+            for file_name in file_names:
+                key = (fetcher, application, file_name)
+                future = self.fetches.get(key)
+                if future is None:
+                    future = Future()
+                    self.fetches[key] = future
+                    self.batches[future] = own_file_names
+                    own_file_names.append(file_name)
+                else:
+                    self.coalesced_files += 1
+                futures[file_name] = future
+        if own_file_names:
+            try:
+                own_files: Dict[str, FetchedFile] = fetcher.fetch_raw_files(application, own_file_names)
+            except BaseException as exception:
+                for file_name in own_file_names:
+                    futures[file_name].set_exception(exception)
+            else:
+                for file_name in own_file_names:
+                    futures[file_name].set_result(own_files.get(file_name))
+        requested_file_names = set(file_names)
+        refetched_file_names: List[str] = []
+        for file_name, future in futures.items():
+            if future.exception() is not None:
+                if requested_file_names.issuperset(self.batches[future]):
+                    future.result()
+                refetched_file_names.append(file_name)
+        refetched_files: Dict[str, FetchedFile] = {}
+        if refetched_file_names:
+            refetched_files = fetcher.fetch_raw_files(application, refetched_file_names)
+        fetched_files: Dict[str, FetchedFile] = {}
+        for file_name, future in futures.items():
+            fetched_file: Optional[FetchedFile] = refetched_files.get(file_name) \
+                if file_name in refetched_file_names else future.result()
+            if fetched_file is not None:
+                fetched_files[file_name] = fetched_file
+        return fetched_files
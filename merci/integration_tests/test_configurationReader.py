@@ -17,7 +17,9 @@
 Integration tests for configuration reader.
 """
 import os
-from unittest import TestCase
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
 
 from configs import XJConfig
 from merci.deserialization import ConfigurationMapper, SingleValueDecoderFactory, ObjectValueDecoderFactory, InstantiationException
@@ -26,6 +28,11 @@ from merci.metrics import ConfigurationManagerMetrics, ConfigurationFetcherMetri
 from merci.readers import ConfigurationReader
 from merci.fetchers import FilesystemConfigurationFetcher
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 class TestConfigurationReader(TestCase):
     """ Unit tests for configuration reader. """
@@ -239,3 +246,92 @@ class TestConfigurationReader(TestCase):
         self.assertEqual(1, manager_metrics.non_instantiable_skips)
         self.assertEqual(0, fetcher_metrics.missing_files)
         self.assertEqual(0, fetcher_metrics.failures)
+
+    def test_execute_for_compressed_files(self):
+        fetched_files = []
+
+        class RecordingFetcher(FilesystemConfigurationFetcher):
+            def read_file(self, application, file_name):
+                fetched_file = super().read_file(application, file_name)
+                fetched_files.append(fetched_file)
+                return fetched_file
+
+        plain_fetcher = FilesystemConfigurationFetcher(self.resource_dir + "/configurations", False,
+                                                       ConfigurationFetcherMetrics())
+        for file_name in ["/featureflags.json.gz", "/featureflags-gzip.json"]:
+            manager_metrics = ConfigurationManagerMetrics()
+            fetcher = RecordingFetcher(self.resource_dir + "/configurations", False, ConfigurationFetcherMetrics())
+            mapper = ConfigurationMapper("feature-flags", SingleValueDecoderFactory(), False, manager_metrics)
+            manager = ConfigurationManager()
+            reader = ConfigurationReader("first-app", [file_name], fetcher, mapper, manager, manager_metrics, 2)
+
+            reader.execute()
+            reader.execute()
+
+            self.assertEqual(True, manager.get_object("enable-feature-all", self.empty_context, False))
+            self.assertEqual(False, manager.get_object("enable-feature-none", self.empty_context, True))
+            self.assertEqual(1, manager_metrics.same_content_skips)
+            self.assertEqual("gzip", fetched_files[-1].compression)
+            # unchanged compressed content is only fingerprinted, not decompressed
+            self.assertFalse(fetched_files[-1].is_decompressed())
+            self.assertEqual(plain_fetcher.fetch_file("first-app", "/featureflags.json"),
+                             fetcher.fetch_file("first-app", file_name))
+            with fetcher.open_file("first-app", file_name) as stream:
+                self.assertEqual(sorted(manager._configuration_store), sorted(mapper.read_stream(stream, file_name)))
+
+    def test_execute_for_truncated_compressed_file(self):
+        manager_metrics = ConfigurationManagerMetrics()
+        fetcher = FilesystemConfigurationFetcher(self.resource_dir + "/configurations", False,
+                                                 ConfigurationFetcherMetrics())
+        mapper = ConfigurationMapper("feature-flags", SingleValueDecoderFactory(), False, manager_metrics)
+        manager = ConfigurationManager()
+        reader = ConfigurationReader("first-app", ["/featureflags-truncated.json.gz"],
+                                     fetcher, mapper, manager, manager_metrics, 2)
+
+        self.assertRaises(IOError, reader.execute)
+        self.assertEqual(1, manager_metrics.content_failures)
+        self.assertEqual(0, manager_metrics.updates)
+
+    @skipIf(zstandard is None, 'requires the optional zstandard package')
+    def test_execute_for_zstd_file(self):
+        directory = self.write_zstd_file(zstandard.ZstdCompressor().compress)
+        try:
+            manager, manager_metrics, reader = self.create_zstd_reader(directory)
+
+            reader.execute()
+
+            self.assertEqual(True, manager.get_object("enable-feature-all", self.empty_context, False))
+            self.assertEqual(0, manager_metrics.content_failures)
+        finally:
+            shutil.rmtree(directory)
+
+    @skipIf(zstandard is not None, 'zstandard is installed')
+    def test_execute_for_zstd_file_without_zstandard(self):
+        directory = self.write_zstd_file(lambda content: b'\x28\xb5\x2f\xfd' + content)
+        try:
+            manager, manager_metrics, reader = self.create_zstd_reader(directory)
+
+            # zstd requires the optional zstandard package
+            self.assertRaises(IOError, reader.execute)
+        finally:
+            shutil.rmtree(directory)
+
+    def write_zstd_file(self, compress) -> str:
+        directory = tempfile.mkdtemp()
+        os.mkdir(directory + "/first-app")
+        with open(self.resource_dir + "/configurations/first-app/featureflags.json", 'rb') as file:
+            content = file.read()
+        with open(directory + "/first-app/featureflags.json.zst", 'wb') as file:
+            file.write(compress(content))
+        return directory
+
+    @staticmethod
+    def create_zstd_reader(directory: str):
+        manager_metrics = ConfigurationManagerMetrics()
+        fetcher = FilesystemConfigurationFetcher(directory, False, ConfigurationFetcherMetrics())
+        mapper = ConfigurationMapper("feature-flags", SingleValueDecoderFactory(), False, manager_metrics)
+        manager = ConfigurationManager()
+        reader = ConfigurationReader("first-app", ["/featureflags.json.zst"],
+                                     fetcher, mapper, manager, manager_metrics, 2)
+        return manager, manager_metrics, reader
+
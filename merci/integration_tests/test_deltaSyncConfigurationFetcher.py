@@ -0,0 +1,185 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Integration tests for delta-sync configuration fetcher.
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from urllib.parse import parse_qs, urlparse
+
+from merci.deserialization import ConfigurationMapper, SingleValueDecoderFactory
+from merci.fetchers import DeltaSyncConfigurationFetcher
+from merci.managers import ConfigurationManager
+from merci.metrics import ConfigurationManagerMetrics, ConfigurationFetcherMetrics
+from merci.readers import ConfigurationReader
+
+
+class DeltaSyncServer(ThreadingHTTPServer):
+    """ Stand-in delta-sync server, with the latest document and patches from previous versions per path. """
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), DeltaSyncHandler)
+        # Latest version and document by path. */
+        self.documents = {}
+        # New version and patch operations by base version, per path. */
+        self.patches = {}
+        # Requested paths with query. */
+        self.requests = []
+
+    def url(self) -> str:
+        return 'http://127.0.0.1:%d/merci' % self.server_address[1]
+
+    def publish(self, path, version, document, base=None, patch=None):
+        self.documents[path] = (version, document)
+        self.patches.setdefault(path, {})
+        if base is not None:
+            self.patches[path][base] = (version, patch)
+
+
+class DeltaSyncHandler(BaseHTTPRequestHandler):
+    """ Handler of the stand-in delta-sync server. """
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.requests.append(self.path)
+        path = url.path[len('/merci'):]
+        if path not in self.server.documents:
+            return self.respond(404)
+        version, document = self.server.documents[path]
+        since = parse_qs(url.query).get('since', [None])[0]
+        if since is None:
+            return self.respond(200, {'version': version, 'document': document})
+        if since == version:
+            return self.respond(304)
+        if since not in self.server.patches[path]:
+            return self.respond(410)
+        new_version, patch = self.server.patches[path][since]
+        return self.respond(200, {'version': new_version, 'base': since, 'patch': patch})
+
+    def respond(self, status, body=None):
+        self.send_response(status)
+        content = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDeltaSyncConfigurationFetcher(TestCase):
+    """ Integration tests for delta-sync configuration fetcher against a local stand-in server. """
+
+    qa_context = {"environment": "qa"}
+
+    def setUp(self):
+        self.server = DeltaSyncServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_delta_updates(self):
+        flags = {"enable-%d" % index: {"value": False, "modifiers": {"type": "environment", "contexts": {
+            "qa": {"value": index % 2 == 0}}}} for index in range(10)}
+        self.server.publish('/first-app/featureflags.json', '1', {"feature-flags": flags})
+        fetcher_metrics = ConfigurationFetcherMetrics()
+        manager_metrics = ConfigurationManagerMetrics()
+        fetcher = DeltaSyncConfigurationFetcher(self.server.url(), False, fetcher_metrics, timeout_seconds=5)
+        mapper = ConfigurationMapper("feature-flags", SingleValueDecoderFactory(), False, manager_metrics)
+        manager = ConfigurationManager()
+        reader = ConfigurationReader("first-app", ["/featureflags.json"], fetcher, mapper, manager, manager_metrics, 2)
+
+        reader.execute()
+        self.assertEqual(True, manager.get_object("enable-0", self.qa_context, False))
+        first_store = dict(manager._configuration_store)
+
+        # unchanged content
+        reader.execute()
+        self.assertEqual(1, manager_metrics.same_content_skips)
+
+        # a delta decodes only the configurations, that it changed or added
+        self.server.publish('/first-app/featureflags.json', '2', None, base='1', patch=[
+            {"op": "replace", "path": "/feature-flags/enable-0/modifiers/contexts/qa/value", "value": False},
+            {"op": "add", "path": "/feature-flags/enable~1new", "value": {"value": True}},
+            {"op": "remove", "path": "/feature-flags/enable-9"}])
+        reader.execute()
+        self.assertEqual(False, manager.get_object("enable-0", self.qa_context, True))
+        self.assertEqual(True, manager.get_object("enable/new", self.qa_context, False))
+        self.assertNotIn("enable-9", manager._configuration_store)
+        self.assertIsNot(first_store["enable-0"], manager._configuration_store["enable-0"])
+        for index in range(1, 9):
+            self.assertIs(first_store["enable-%d" % index], manager._configuration_store["enable-%d" % index])
+        self.assertEqual(1, fetcher_metrics.delta_updates)
+        self.assertEqual(['/merci/first-app/featureflags.json', '/merci/first-app/featureflags.json?since=1',
+                          '/merci/first-app/featureflags.json?since=1'], self.server.requests)
+
+        # version gap
+        self.server.publish('/first-app/featureflags.json', '4', {"feature-flags": {"enable-0": {"value": True}}})
+        reader.execute()
+        self.assertEqual(["enable-0"], list(manager._configuration_store))
+        self.assertEqual(1, fetcher_metrics.resyncs)
+        self.assertEqual(['/merci/first-app/featureflags.json?since=2', '/merci/first-app/featureflags.json'],
+                         self.server.requests[-2:])
+
+        # patch, that cannot be applied to the held document
+        self.server.publish('/first-app/featureflags.json', '5', {"feature-flags": {"enable-0": {"value": False}}},
+                            base='4', patch=[{"op": "remove", "path": "/feature-flags/enable-missing"}])
+        reader.execute()
+        self.assertEqual(False, manager.get_object("enable-0", self.qa_context, True))
+        self.assertEqual(2, fetcher_metrics.resyncs)
+        self.assertEqual(1, fetcher_metrics.delta_updates)
+        self.assertEqual(0, fetcher_metrics.failures)
+
+    def test_delta_updates_with_parse_executor(self):
+        flags = {"enable-%d" % index: {"value": False} for index in range(3)}
+        self.server.publish('/first-app/featureflags.json', '1', {"feature-flags": flags})
+        manager_metrics = ConfigurationManagerMetrics()
+        fetcher = DeltaSyncConfigurationFetcher(self.server.url(), False, ConfigurationFetcherMetrics(),
+                                                timeout_seconds=5)
+        manager = ConfigurationManager()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            mapper = ConfigurationMapper("feature-flags", SingleValueDecoderFactory(), False, manager_metrics,
+                                         parse_executor=executor, offload_min_size=0)
+            reader = ConfigurationReader("first-app", ["/featureflags.json"], fetcher, mapper, manager,
+                                         manager_metrics, 2)
+            reader.execute()
+            first_store = dict(manager._configuration_store)
+
+            # patched trees are not parsed again by the executor, so unchanged configurations are reused
+            self.server.publish('/first-app/featureflags.json', '2', None, base='1', patch=[
+                {"op": "replace", "path": "/feature-flags/enable-0/value", "value": True}])
+            reader.execute()
+
+        self.assertEqual(True, manager.get_object("enable-0", {}, False))
+        self.assertIsNot(first_store["enable-0"], manager._configuration_store["enable-0"])
+        self.assertIs(first_store["enable-1"], manager._configuration_store["enable-1"])
+        self.assertIs(first_store["enable-2"], manager._configuration_store["enable-2"])
+
+    def test_missing_file(self):
+        fetcher_metrics = ConfigurationFetcherMetrics()
+        fetcher = DeltaSyncConfigurationFetcher(self.server.url(), False, fetcher_metrics, timeout_seconds=5)
+
+        self.assertRaises(FileNotFoundError, fetcher.fetch_files, "first-app", ["/featureflags.json"])
+        self.assertEqual({}, DeltaSyncConfigurationFetcher(self.server.url(), True, fetcher_metrics)
+                         .fetch_files("first-app", ["/featureflags.json"]))
+        self.assertEqual(2, fetcher_metrics.missing_files)
+        self.assertEqual(1, fetcher_metrics.failures)
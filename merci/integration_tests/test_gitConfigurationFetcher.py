@@ -0,0 +1,141 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Integration tests for git configuration fetcher.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from merci.deserialization import ConfigurationMapper, SingleValueDecoderFactory
+from merci.fetchers import GitConfigurationFetcher
+from merci.managers import ConfigurationManager
+from merci.metrics import ConfigurationManagerMetrics, ConfigurationFetcherMetrics
+from merci.readers import ConfigurationReader
+
+
+class TestGitConfigurationFetcher(TestCase):
+    """ Integration tests for git configuration fetcher, with a repository created in a temporary directory. """
+
+    empty_context = {}
+
+    resource_dir = os.path.dirname(
+        os.path.realpath('__file__')) + "/resources"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.repository = self.directory + "/repository"
+        os.makedirs(self.repository + "/first-app")
+        self.git('init', '-q')
+        # git executable, that logs its sub-commands before running git
+        self.git_log = self.directory + "/git.log"
+        self.git_executable = self.directory + "/logging-git"
+        with open(self.git_executable, 'w') as file:
+            file.write('#!' + sys.executable + '\n'
+                       'import subprocess, sys\n'
+                       'with open(' + repr(self.git_log) + ', "a") as log:\n'
+                       '    log.write(sys.argv[4] + "\\n")\n'
+                       'sys.exit(subprocess.run(["git"] + sys.argv[1:]).returncode)\n')
+        os.chmod(self.git_executable, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def git(self, *args):
+        subprocess.run(['git', '-C', self.repository, '-c', 'user.name=merci', '-c', 'user.email=merci@example.com']
+                       + list(args), check=True, stdout=subprocess.DEVNULL)
+
+    def commit(self, files):
+        for file_name, content in files.items():
+            with open(self.repository + "/first-app" + file_name, 'w') as file:
+                file.write(content)
+        self.git('add', '-A')
+        self.git('commit', '-q', '-m', 'Update configurations.')
+
+    def logged_commands(self):
+        with open(self.git_log) as file:
+            commands = file.read().split()
+        os.remove(self.git_log)
+        return commands
+
+    def test_fetch_files(self):
+        with open(self.resource_dir + "/configurations/first-app/featureflags.json") as file:
+            features = file.read()
+        self.commit({"/featureflags.json": features, "/other.json": '{ "feature-flags": { } }'})
+        fetcher_metrics = ConfigurationFetcherMetrics()
+        manager_metrics = ConfigurationManagerMetrics()
+        fetcher = GitConfigurationFetcher(self.repository, False, fetcher_metrics, git_executable=self.git_executable)
+        mapper = ConfigurationMapper("feature-flags", SingleValueDecoderFactory(), False, manager_metrics)
+        manager = ConfigurationManager()
+        reader = ConfigurationReader("first-app", ["/featureflags.json", "/other.json"],
+                                     fetcher, mapper, manager, manager_metrics, 2)
+
+        reader.execute()
+        self.assertEqual(True, manager.get_object("enable-feature-all", self.empty_context, False))
+        self.assertEqual(['rev-parse', 'ls-tree', 'cat-file'], self.logged_commands())
+        first_fetch = fetcher.fetch_raw_files("first-app", ["/featureflags.json", "/other.json"])
+        self.logged_commands()
+
+        # an unchanged commit neither lists nor reads blobs, and returns files with the same fingerprints
+        reader.execute()
+        self.assertEqual(1, manager_metrics.same_content_skips)
+        self.assertEqual(['rev-parse'], self.logged_commands())
+        second_fetch = fetcher.fetch_raw_files("first-app", ["/featureflags.json", "/other.json"])
+        self.logged_commands()
+        first_features, second_features = first_fetch["/featureflags.json"], second_fetch["/featureflags.json"]
+        self.assertIsNot(first_features, second_features)
+        self.assertEqual(first_features.fingerprint(), second_features.fingerprint())
+        self.assertEqual(first_features.content, second_features.content)
+
+        # a commit, that does not change registered files, is skipped like same content
+        self.commit({"/unregistered.json": '{ }'})
+        reader.execute()
+        self.assertEqual(2, manager_metrics.same_content_skips)
+        self.assertEqual(['rev-parse', 'ls-tree'], self.logged_commands())
+
+        # only changed blobs are read
+        self.commit({"/other.json": '{ "feature-flags": { "enable-other": { "value": true } } }'})
+        reader.execute()
+        self.assertEqual(True, manager.get_object("enable-other", self.empty_context, False))
+        self.assertEqual(['rev-parse', 'ls-tree', 'cat-file'], self.logged_commands())
+        third_fetch = fetcher.fetch_raw_files("first-app", ["/featureflags.json", "/other.json"])
+        self.assertEqual(first_features.fingerprint(), third_fetch["/featureflags.json"].fingerprint())
+        self.assertNotEqual(first_fetch["/other.json"].fingerprint(), third_fetch["/other.json"].fingerprint())
+        self.assertEqual(1, manager_metrics.parse_cache_hits)
+        self.assertEqual(0, fetcher_metrics.failures)
+
+    def test_fetch_files_at_branch(self):
+        self.commit({"/featureflags.json": '{ "feature-flags": { "enable-welcome": { "value": false } } }'})
+        self.git('branch', 'release')
+        self.commit({"/featureflags.json": '{ "feature-flags": { "enable-welcome": { "value": true } } }'})
+        fetcher_metrics = ConfigurationFetcherMetrics()
+
+        release = GitConfigurationFetcher(self.repository, False, fetcher_metrics, ref='release')
+        head = GitConfigurationFetcher(self.repository, False, fetcher_metrics)
+
+        self.assertIn('false', release.fetch_files("first-app", ["/featureflags.json"])["/featureflags.json"])
+        self.assertIn('true', head.fetch_files("first-app", ["/featureflags.json"])["/featureflags.json"])
+        self.assertEqual({}, GitConfigurationFetcher(self.repository, True, fetcher_metrics, ref='release')
+                         .fetch_files("first-app", ["/missing.json"]))
+        self.assertEqual(1, fetcher_metrics.missing_files)
+        self.assertRaises(FileNotFoundError, release.fetch_files, "first-app", ["/missing.json"])
+        self.assertRaises(IOError, GitConfigurationFetcher(self.repository, False, fetcher_metrics, ref='unknown')
+                          .fetch_files, "first-app", ["/featureflags.json"])
+        self.assertRaises(ValueError, GitConfigurationFetcher, self.repository, False, fetcher_metrics, ref='--help')
+        self.assertEqual(2, fetcher_metrics.failures)
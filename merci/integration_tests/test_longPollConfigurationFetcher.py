@@ -0,0 +1,159 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Integration tests for long-poll configuration fetcher and watches of the configuration loader.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from urllib.parse import parse_qs, urlparse
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from merci.deserialization import ConfigurationMapper, SingleValueDecoderFactory
+from merci.fetchers import LongPollConfigurationFetcher
+from merci.loaders import ConfigurationLoader
+from merci.managers import ConfigurationManager
+from merci.metrics import ConfigurationManagerMetrics, ConfigurationFetcherMetrics, ConfigurationLoaderMetrics
+from merci.readers import ConfigurationReader
+
+
+class KeyValueServer(ThreadingHTTPServer):
+    """ Stand-in key-value store with Consul-style blocking queries. """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), KeyValueHandler)
+        self.values = {}
+        self.index = 1
+        self.changed = threading.Condition()
+        # Number of watches to fail with status 500. */
+        self.failing_watches = 0
+
+    def url(self) -> str:
+        return 'http://127.0.0.1:%d/v1/kv' % self.server_address[1]
+
+    def put(self, key, value):
+        with self.changed:
+            self.values[key] = value
+            self.index += 1
+            self.changed.notify_all()
+
+
+class KeyValueHandler(BaseHTTPRequestHandler):
+    """ Handler of the stand-in key-value store. """
+    def do_GET(self):
+        url = urlparse(self.path)
+        key = url.path[len('/v1/kv/'):]
+        query = parse_qs(url.query)
+        server = self.server
+        if 'index' in query:
+            if server.failing_watches > 0:
+                server.failing_watches -= 1
+                return self.respond(500, b'')
+            deadline = time.monotonic() + float(query['wait'][0].rstrip('s'))
+            with server.changed:
+                while server.index <= int(query['index'][0]) and time.monotonic() < deadline:
+                    server.changed.wait(deadline - time.monotonic())
+        if key in server.values:
+            return self.respond(200, server.values[key].encode('utf-8'))
+        return self.respond(404, b'')
+
+    def respond(self, status, content):
+        self.send_response(status)
+        self.send_header('X-Consul-Index', str(self.server.index))
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestLongPollConfigurationFetcher(TestCase):
+    """ Integration tests for watches of a long-poll configuration fetcher against a local stand-in server. """
+
+    empty_context = {}
+
+    def setUp(self):
+        self.server = KeyValueServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def await_value(self, manager, name, value):
+        deadline = time.monotonic() + 5
+        while manager.get_object(name, self.empty_context, None) != value and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(value, manager.get_object(name, self.empty_context, None))
+
+    def test_watch(self):
+        self.server.put('first-app/featureflags.json', '{ "feature-flags": { "enable-welcome": { "value": false } } }')
+        fetcher_metrics = ConfigurationFetcherMetrics()
+        manager_metrics = ConfigurationManagerMetrics()
+        loader_metrics = ConfigurationLoaderMetrics()
+        fetcher = LongPollConfigurationFetcher(self.server.url(), False, fetcher_metrics, timeout_seconds=5)
+        mapper = ConfigurationMapper("feature-flags", SingleValueDecoderFactory(), False, manager_metrics)
+        manager = ConfigurationManager()
+        reader = ConfigurationReader("first-app", ["/featureflags.json"], fetcher, mapper, manager, manager_metrics, 2)
+        loader = ConfigurationLoader([reader], BackgroundScheduler(), 3600, loader_metrics, watch_wait_seconds=0.5)
+        loader.WATCH_RETRY_SECONDS = 0.01
+        loader.WATCH_MIN_INTERVAL_SECONDS = 0.01
+
+        loader.start()
+        try:
+            self.assertEqual(False, manager.get_object("enable-welcome", self.empty_context, None))
+            self.assertEqual(1, len(loader.watch_threads))
+            time.sleep(0.1)
+
+            # changes are loaded without waiting for the refresh interval
+            self.server.put('first-app/featureflags.json', '{ "feature-flags": { "enable-welcome": { "value": true } } }')
+            self.await_value(manager, "enable-welcome", True)
+            self.assertEqual(1, loader_metrics.watch_triggers)
+            self.assertEqual(0, loader_metrics.watch_reconnects)
+
+            # changes, while watches fail, are loaded after reconnecting
+            self.server.failing_watches = 3
+            deadline = time.monotonic() + 5
+            while self.server.failing_watches == 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.server.put('first-app/featureflags.json', '{ "feature-flags": { "enable-welcome": { "value": false } } }')
+            self.await_value(manager, "enable-welcome", False)
+        finally:
+            loader.shutdown()
+        loader.watch_threads[0].join(5)
+        self.assertFalse(loader.watch_threads[0].is_alive())
+        self.assertEqual(0, self.server.failing_watches)
+        self.assertEqual(1, loader_metrics.watch_reconnects)
+        self.assertEqual(0, loader_metrics.configuration_failures)
+        self.assertEqual(0, fetcher_metrics.failures)
+
+    def test_fetch_files(self):
+        self.server.put('first-app/featureflags.json', '{ }')
+        fetcher_metrics = ConfigurationFetcherMetrics()
+        fetcher = LongPollConfigurationFetcher(self.server.url(), True, fetcher_metrics)
+
+        self.assertEqual({'/featureflags.json': '{ }'},
+                         fetcher.fetch_files('first-app', ['/featureflags.json', '/missing.json']))
+        self.assertEqual(str(self.server.index), fetcher.watch('first-app', None, 30))
+        self.assertEqual(1, fetcher_metrics.missing_files)
+        self.server.failing_watches = 1
+        self.assertRaises(IOError, fetcher.watch, 'first-app', '1', 30)
@@ -16,23 +16,109 @@
 """
 Classes for loading feature flags and configs.
 """
+import math
+import random
+import threading
 import time
-from typing import List
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from merci.deserialization import InstantiationException
-from merci.metrics import ConfigurationLoaderMetrics
+from merci.metrics import ConfigurationLoaderMetrics, RefreshPhases
+from merci.fetchers import FetchCoalescer, WatchableConfigurationFetcher
 from merci.readers import ConfigurationReader
+from merci.tracing import RefreshTracer, NO_OP_TRACER
+
+
+class RefreshPolicy:
+    """
+    Policy for adaptive scheduling of configuration readers. Each reader is executed at its own refresh
+    interval. Consecutive failures back the interval off exponentially, up to a maximum. Changed content
+    shortens the interval for a number of following executions, since changes often come in bursts.
+    Each delay is randomized by a jitter ratio, so that a fleet of processes started at the same time
+    spreads its requests over the interval instead of fetching in lockstep.
+    """
+    def __init__(self,
+                 maximum_backoff_seconds: float = 600,
+                 backoff_multiplier: float = 2.0,
+                 jitter_ratio: float = 0.2,
+                 fast_interval_seconds: float = None,
+                 fast_refreshes: int = 0,
+                 random_generator: random.Random = None):
+        """
+        Initialize refresh policy.
+        :param maximum_backoff_seconds: upper bound of delays after consecutive failures
+        :param backoff_multiplier: factor, that the refresh interval is multiplied with after each failure
+        :param jitter_ratio: maximum deviation of each delay, as a ratio of the delay, between 0 and 1
+        :param fast_interval_seconds: time in seconds between executions after changed content
+        :param fast_refreshes: number of executions at the fast interval after changed content
+        :param random_generator: source of jitter, i.e. a seeded generator for testing
+        """
+        if backoff_multiplier < 1:
+            raise ValueError("Backoff multiplier must not be less than 1.")
+        if not 0 <= jitter_ratio < 1:
+            raise ValueError("Jitter ratio must be between 0 and 1.")
+        if fast_refreshes > 0 and fast_interval_seconds is None:
+            raise ValueError("Fast refreshes require a fast interval.")
+        self.maximum_backoff_seconds = maximum_backoff_seconds
+        self.backoff_multiplier = backoff_multiplier
+        self.jitter_ratio = jitter_ratio
+        self.fast_interval_seconds = fast_interval_seconds
+        self.fast_refreshes = fast_refreshes
+        self.random_generator = random_generator or random.Random()
+
+    def jitter(self, delay_seconds: float) -> float:
+        """ Return delay randomized by the jitter ratio. """
+        if self.jitter_ratio == 0:
+            return delay_seconds
+        return delay_seconds * self.random_generator.uniform(1 - self.jitter_ratio, 1 + self.jitter_ratio)
+
+    def backoff(self, interval_seconds: float, failures: int) -> float:
+        """ Return delay after provided number of consecutive failures. """
+        limit_seconds = max(interval_seconds, self.maximum_backoff_seconds)
+        if interval_seconds <= 0:
+            return interval_seconds
+        # compared in log space, since the multiplier to the power of many failures overflows a float
+        if failures * math.log(self.backoff_multiplier) >= math.log(limit_seconds / interval_seconds):
+            return limit_seconds
+        return interval_seconds * self.backoff_multiplier ** failures
+
+
+class _ReaderSchedule:
+    """ Adaptive schedule state of a single configuration reader. """
+    def __init__(self, reader: ConfigurationReader, interval_seconds: float):
+        self.reader = reader
+        self.interval_seconds = interval_seconds
+        # Number of consecutive failed executions. */
+        self.failures = 0
+        # Number of executions left at the fast interval. */
+        self.fast_refreshes_left = 0
 
 
 class ConfigurationLoader:
     """
+    Loader, that periodically executes configuration readers. By default all readers are executed sequentially
+    at a fixed interval. With a refresh policy, each reader is scheduled on its own, adapting its interval to
+    failures and changes. Readers with watchable fetchers are additionally executed as soon as a watch reports
+    changes of the files of their application, so that their refresh interval only serves as a fallback.
     """
+    # Delay in seconds before the first attempt to establish a failed watch again, doubled for each failure.
+    WATCH_RETRY_SECONDS = 1.0
+    # Maximum number of times the retry delay is doubled, which bounds it long before it could overflow.
+    WATCH_MAX_RETRY_DOUBLINGS = 30
+    # Minimum time in seconds between the starts of consecutive watches, for backends, that answer right away.
+    WATCH_MIN_INTERVAL_SECONDS = 1.0
+
     def __init__(self, readers: List[ConfigurationReader],
                  execution_scheduler: BackgroundScheduler,
                  refresh_interval_seconds: time,
-                 metrics: ConfigurationLoaderMetrics):
+                 metrics: ConfigurationLoaderMetrics,
+                 tracer: RefreshTracer = NO_OP_TRACER,
+                 refresh_policy: RefreshPolicy = None,
+                 watch_wait_seconds: float = 30):
         """
         Initialize loader with a list of configuration readers and a background scheduler.
 
@@ -40,33 +126,216 @@ class ConfigurationLoader:
         :param execution_scheduler: scheduler, that periodically reads, parses and stores configurations
         :param refresh_interval_seconds: time in seconds between scheduled loading tasks
         :param metrics: metrics for loader
+        :param tracer: tracer for refresh cycles
+        :param refresh_policy: policy for adaptive scheduling of each reader, or None for a fixed interval
+        :param watch_wait_seconds: maximum time of each watch of a watchable fetcher, before it is renewed
         """
         self.readers: List[ConfigurationReader] = readers
         self.execution_scheduler: BackgroundScheduler = execution_scheduler
         self.refresh_interval_seconds: time = refresh_interval_seconds
         self.metrics = metrics
+        self.tracer = tracer
+        self.refresh_policy = refresh_policy
+        self.initial_load_timer: threading.Timer = None
+        self.watch_wait_seconds = watch_wait_seconds
+        # Set on shutdown, to end all watches. */
+        self.stopped = threading.Event()
+        self.watch_threads: List[threading.Thread] = []
 
     def start(self):
         """ Immediately execute configuration readers, then schedule next execution. """
         self.execute_readers()
-        self.execution_scheduler.add_job(
-            self.execute_readers,
-            trigger='interval',
-            seconds=self.refresh_interval_seconds)
+        self.__schedule_refreshes()
+        self.execution_scheduler.start()
+        self.__start_watches()
+
+    def start_in_background(self, initial_load_timeout_seconds: float = None) -> List[Future]:
+        """
+        Execute configuration readers in parallel background threads and schedule next execution, without
+        waiting for the initial loads. Managers tell whether their initial load finished with is_ready()
+        and wait_until_ready(). Readers with a content cache load their cached content before returning.
+
+        :param initial_load_timeout_seconds: time in seconds, after which managers without configurations
+               serve defaults, or None to wait for the initial loads indefinitely
+        :return: futures of the initial executions of the readers, in order of the readers
+        """
+        for reader in self.readers:
+            reader.load_cached_content()
+        coalescer = FetchCoalescer()
+        executor = ThreadPoolExecutor(max_workers=max(1, len(self.readers)),
+                                      thread_name_prefix='merci-initial-load')
+        futures = [executor.submit(self.__execute_initial_read, reader, coalescer) for reader in self.readers]
+        executor.shutdown(wait=False)
+        if initial_load_timeout_seconds is not None:
+            self.initial_load_timer = threading.Timer(initial_load_timeout_seconds, self.serve_defaults)
+            self.initial_load_timer.daemon = True
+            self.initial_load_timer.start()
+        self.__schedule_refreshes()
         self.execution_scheduler.start()
+        self.__start_watches()
+        return futures
+
+    def serve_defaults(self):
+        """ Let managers, that are not loaded yet, serve defaults instead of waiting for their initial load. """
+        for reader in self.readers:
+            if reader.configuration_store.serve_defaults():
+                self.metrics.increment_initial_load_timeouts()
+
+    def __execute_initial_read(self, reader: ConfigurationReader, coalescer: FetchCoalescer) -> bool:
+        self.metrics.increment_configuration_requests()
+        try:
+            return reader.execute(coalescer)
+        except Exception as exception:
+            self.metrics.increment_configuration_failures()
+            raise exception
+
+    def __schedule_refreshes(self):
+        if self.refresh_policy is None:
+            self.execution_scheduler.add_job(
+                self.execute_readers,
+                trigger='interval',
+                seconds=self.refresh_interval_seconds)
+        else:
+            for reader in self.readers:
+                interval_seconds = reader.refresh_interval_seconds or self.refresh_interval_seconds
+                schedule = _ReaderSchedule(reader, interval_seconds)
+                self.__schedule(schedule, self.refresh_policy.jitter(interval_seconds))
+
+    def execute_scheduled_reader(self, schedule: _ReaderSchedule):
+        """ Execute a single adaptively scheduled configuration reader, then schedule its next execution. """
+        self.metrics.increment_scheduled_refreshes()
+        changed = False
+        succeeded = False
+        try:
+            self.metrics.increment_configuration_requests()
+            changed = schedule.reader.execute()
+            succeeded = True
+        except (IOError, InstantiationException):
+            self.metrics.increment_configuration_failures()
+        except Exception as exception:
+            self.metrics.increment_configuration_failures()
+            raise exception
+        finally:
+            self.__schedule(schedule, self.__next_delay(schedule, succeeded, changed))
+
+    def __next_delay(self, schedule: _ReaderSchedule, succeeded: bool, changed: bool) -> float:
+        """ Return delay until next execution of reader, according to the outcome of its latest execution. """
+        policy = self.refresh_policy
+        if not succeeded:
+            schedule.failures += 1
+            schedule.fast_refreshes_left = 0
+            self.metrics.increment_backoff_refreshes()
+            return policy.jitter(policy.backoff(schedule.interval_seconds, schedule.failures))
+        schedule.failures = 0
+        if changed:
+            schedule.fast_refreshes_left = policy.fast_refreshes
+        if schedule.fast_refreshes_left > 0:
+            schedule.fast_refreshes_left -= 1
+            self.metrics.increment_fast_refreshes()
+            return policy.jitter(min(policy.fast_interval_seconds, schedule.interval_seconds))
+        return policy.jitter(schedule.interval_seconds)
+
+    def __schedule(self, schedule: _ReaderSchedule, delay_seconds: float):
+        self.metrics.observe_refresh_delay(delay_seconds)
+        # each execution schedules the next one, so a late job must still run instead of being dropped as misfired
+        self.execution_scheduler.add_job(
+            self.execute_scheduled_reader,
+            trigger='date',
+            run_date=datetime.now() + timedelta(seconds=delay_seconds),
+            args=[schedule],
+            misfire_grace_time=None,
+            coalesce=True)
 
     def execute_readers(self):
-        """ Sequentially execute configuration readers. """
+        """ Sequentially execute configuration readers, fetching files, that several readers use, only once. """
+        start = time.perf_counter()
+        try:
+            with self.tracer.span(RefreshPhases.CYCLE, {'merci.readers': str(len(self.readers))}):
+                self.__execute_readers()
+        finally:
+            self.metrics.observe_cycle_duration(time.perf_counter() - start)
+
+    def __execute_readers(self):
+        coalescer = FetchCoalescer()
+        try:
+            for reader in self.readers:
+                try:
+                    self.metrics.increment_configuration_requests()
+                    reader.execute(coalescer)
+                except (IOError, InstantiationException):
+                    self.metrics.increment_configuration_failures()
+                except Exception as exception:
+                    self.metrics.increment_configuration_failures()
+                    raise exception
+        finally:
+            self.metrics.increment_coalesced_fetches(coalescer.coalesced_files)
+
+    def __start_watches(self):
+        """ Start a thread per application of readers with a watchable fetcher, that holds one watch at a time. """
+        watched_readers: Dict[Tuple[WatchableConfigurationFetcher, str], List[ConfigurationReader]] = {}
         for reader in self.readers:
+            if isinstance(reader.fetcher, WatchableConfigurationFetcher):
+                watched_readers.setdefault((reader.fetcher, reader.application), []).append(reader)
+        for (fetcher, application), readers in watched_readers.items():
+            thread = threading.Thread(target=self.watch, args=[fetcher, application, readers],
+                                      name='merci-watch-' + application, daemon=True)
+            self.watch_threads.append(thread)
+            thread.start()
+
+    def watch(self, fetcher: WatchableConfigurationFetcher, application: str, readers: List[ConfigurationReader]):
+        """ Watch files of an application and execute its readers on each change, until shutdown. """
+        index: Optional[str] = None
+        failures = 0
+        while not self.stopped.is_set():
+            watch_start = time.monotonic()
             try:
-                self.metrics.increment_configuration_requests()
-                reader.execute()
-            except (IOError, InstantiationException):
-                self.metrics.increment_configuration_failures()
-            except Exception as exception:
+                current_index = fetcher.watch(application, index, self.watch_wait_seconds)
+            except Exception:
+                # any failure, not only of requests, is retried, so that the watch does not end silently
+                failures += 1
+                doublings = min(failures - 1, self.WATCH_MAX_RETRY_DOUBLINGS)
+                self.stopped.wait(min(self.WATCH_RETRY_SECONDS * 2 ** doublings, self.refresh_interval_seconds))
+                continue
+            if self.stopped.is_set():
+                return
+            if failures > 0:
+                self.metrics.increment_watch_reconnects()
+                failures = 0
+            if _index_went_backwards(index, current_index):
+                # i.e. after a restore of the backend, files may have changed, and watching starts over
+                self.__execute_watched_readers(readers)
+                index = None
+            else:
+                # watches are established again with the latest index, so that changes in between are not missed
+                if index is not None and current_index != index:
+                    self.__execute_watched_readers(readers)
+                index = current_index
+            # backends, that ignore the wait time or keep answering right away, are not watched in a tight loop
+            self.stopped.wait(self.WATCH_MIN_INTERVAL_SECONDS - (time.monotonic() - watch_start))
+
+    def __execute_watched_readers(self, readers: List[ConfigurationReader]):
+        coalescer = FetchCoalescer()
+        for reader in readers:
+            self.metrics.increment_watch_triggers()
+            self.metrics.increment_configuration_requests()
+            try:
+                reader.execute(coalescer)
+            except Exception:
+                # failures must not end the watch, and the reader is executed again on its schedule
                 self.metrics.increment_configuration_failures()
-                raise exception
+        self.metrics.increment_coalesced_fetches(coalescer.coalesced_files)
 
     def shutdown(self):
-        """ Stop scheduler. """
+        """ Stop scheduler and watches. """
+        self.stopped.set()
+        if self.initial_load_timer is not None:
+            self.initial_load_timer.cancel()
         self.execution_scheduler.shutdown()
+
+
+def _index_went_backwards(index: Optional[str], current_index: Optional[str]) -> bool:
+    """ Return True, if both indexes are numeric, like the indexes of Consul, and the current one is lower. """
+    try:
+        return index is not None and current_index is not None and int(current_index) < int(index)
+    except ValueError:
+        return False
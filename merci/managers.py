@@ -16,12 +16,60 @@
 """
 In-memory stores for feature flags and configs.
 """
+import bisect
+import contextvars
+import threading
 from abc import ABC, abstractmethod
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
+from merci.metrics import EvaluationStatistics
 from merci.structure import Configuration
 
 
+class RequestScope:
+    """
+    Ambient scope of a single request, i.e. of a web request handler. Inside the scope, configuration managers
+    evaluate each configuration at most once against the bound runtime context, and all lookups of a manager
+    use the configuration store, that was current at its first lookup in the scope, so that a refresh in the
+    middle of a request cannot mix values of two store generations.
+
+    The scope is kept in a context variable, so it follows the request into asyncio tasks created inside the
+    scope, and into threads started with contextvars.copy_context().run(...).
+
+    Sample code:
+
+    with RequestScope(runtime_context):
+        if feature_flag_manager.is_active("enable-hello-world", None, False):
+            ...
+    """
+    _current: contextvars.ContextVar = contextvars.ContextVar('merci_request_scope', default=None)
+
+    def __init__(self, runtime_context: Dict[str, str]):
+        """
+        Initialize request scope.
+        :param runtime_context: runtime context, that is bound to all evaluations inside the scope
+        """
+        self.runtime_context: Dict[str, str] = runtime_context
+        # Configuration store of each manager at its first lookup in the scope. */
+        self.configuration_stores: Dict['ConfigurationManager', Dict[str, Configuration]] = {}
+        # Evaluated values by manager and configuration name. */
+        self.values: Dict[Tuple['ConfigurationManager', str], object] = {}
+        self.token: Optional[contextvars.Token] = None
+
+    @classmethod
+    def current(cls) -> Optional['RequestScope']:
+        """ Return the request scope of the current thread or task, or None outside of any scope. """
+        return cls._current.get()
+
+    def __enter__(self) -> 'RequestScope':
+        self.token = self._current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._current.reset(self.token)
+        self.token = None
+
+
 class ConfigurationStoreUpdater(ABC):
     """ Base class for updating a configuration store. """
     def set_configuration_store(self,
@@ -32,6 +80,13 @@ class ConfigurationStoreUpdater(ABC):
         :return:
         """
 
+    def serve_defaults(self) -> bool:
+        """
+        Give up waiting for the initial configurations, i.e. after a timeout, and serve default values until then.
+        :return: True, if the store was not loaded yet and now serves defaults
+        """
+        return False
+
 
 class ConfigurationStoreReader(ABC):
     """ Base class for reading from configuration store. """
@@ -47,26 +102,146 @@ class ConfigurationStoreReader(ABC):
         :return: evaluated value object
         """
 
+    @abstractmethod
+    def get_objects(self, prefix: str, runtime_context: Dict[str, str]) -> Dict[str, object]:
+        """
+        Return evaluated value objects of all configurations, whose names start with provided prefix.
+        :param prefix: prefix of configuration names, i.e. 'billing.'
+        :param runtime_context: runtime context value to be used for evaluation
+        :return: evaluated value objects by configuration name, in order of names
+        """
+
+    def is_ready(self) -> bool:
+        """ Return True, if configurations were loaded or the store serves defaults after giving up waiting. """
+        return True
+
+    def wait_until_ready(self, timeout_seconds: float = None) -> bool:
+        """
+        Block until the store is ready.
+        :param timeout_seconds: maximum time to wait, or None to wait indefinitely
+        :return: True, if the store is ready
+        """
+        return True
+
+
+class _NameIndex:
+    """ Sorted names of the configurations of a configuration store, for prefix queries by binary search. """
+    def __init__(self, configuration_store: Dict[str, Configuration]):
+        self.configuration_store: Dict[str, Configuration] = configuration_store
+        self.names: List[str] = sorted(configuration_store)
+
+    def names_with_prefix(self, prefix: str) -> List[str]:
+        """ Return sorted names, that start with provided prefix. """
+        names = self.names
+        start = end = bisect.bisect_left(names, prefix)
+        while end < len(names) and names[end].startswith(prefix):
+            end += 1
+        return names[start:end]
+
 
 class ConfigurationManager(ConfigurationStoreUpdater,
                            ConfigurationStoreReader):
     """ Configuration manager used by feature flag and config manager. """
     def __init__(self):
         self._configuration_store: Dict[str, Configuration] = {}
+        # Index of names of the configuration store, rebuilt with each update of the store. */
+        self._name_index: _NameIndex = _NameIndex(self._configuration_store)
+        self.evaluation_statistics: Optional[EvaluationStatistics] = None
+        # Set once configurations were loaded, or defaults are served after giving up waiting. */
+        self.ready = threading.Event()
+        # True while defaults are served, because the initial load did not finish in time. */
+        self.serving_defaults = False
+        self.ready_lock = threading.Lock()
 
     def set_configuration_store(self,
                                 configuration_store: Dict[str, Configuration]):
+        name_index = _NameIndex(configuration_store)
         self._configuration_store = configuration_store
+        self._name_index = name_index
+        if not self.ready.is_set() or self.serving_defaults:
+            with self.ready_lock:
+                self.serving_defaults = False
+                self.ready.set()
+
+    def serve_defaults(self) -> bool:
+        with self.ready_lock:
+            if self.ready.is_set():
+                return False
+            self.serving_defaults = True
+            self.ready.set()
+            return True
+
+    def is_ready(self) -> bool:
+        return self.ready.is_set()
+
+    def wait_until_ready(self, timeout_seconds: float = None) -> bool:
+        return self.ready.wait(timeout_seconds)
+
+    def set_evaluation_statistics(self, evaluation_statistics: EvaluationStatistics):
+        """ Enable sampled statistics of all evaluations, or disable them with None. """
+        self.evaluation_statistics = evaluation_statistics
 
     def get_object(self, configuration_name: str,
                    runtime_context: Dict[str, str],
                    default_value: object) -> Optional:
-        configuration: Configuration = self._configuration_store.get(
+        scope: Optional[RequestScope] = RequestScope._current.get()
+        if scope is not None and (runtime_context is None or runtime_context is scope.runtime_context):
+            return self.__get_scoped_object(scope, configuration_name, default_value)
+        return self.__get_object(self._configuration_store, configuration_name, runtime_context, default_value)
+
+    def get_objects(self, prefix: str, runtime_context: Dict[str, str]) -> Dict[str, object]:
+        name_index = self._name_index
+        scope: Optional[RequestScope] = RequestScope._current.get()
+        if scope is not None and (runtime_context is None or runtime_context is scope.runtime_context):
+            configuration_store = scope.configuration_stores.setdefault(self, name_index.configuration_store)
+            if configuration_store is not name_index.configuration_store:
+                name_index = _NameIndex(configuration_store)
+            return {name: self.__get_scoped_object(scope, name, None)
+                    for name in name_index.names_with_prefix(prefix)}
+        return {name: self.__get_object(name_index.configuration_store, name, runtime_context, None)
+                for name in name_index.names_with_prefix(prefix)}
+
+    def configuration_names(self, prefix: str = '') -> List[str]:
+        """ Return sorted names of stored configurations, that start with provided prefix. """
+        return self._name_index.names_with_prefix(prefix)
+
+    def __get_scoped_object(self, scope: RequestScope, configuration_name: str, default_value: object) -> Optional:
+        """ Return value memoized in the request scope, evaluated against the store pinned to the scope. """
+        key = (self, configuration_name)
+        value = scope.values.get(key, _NOT_EVALUATED)
+        if value is not _NOT_EVALUATED:
+            return value
+        configuration_store = scope.configuration_stores.setdefault(self, self._configuration_store)
+        value = self.__get_object(configuration_store, configuration_name, scope.runtime_context, default_value)
+        if configuration_name in configuration_store:
+            # missing configurations are not memoized, since their default value may differ between lookups
+            value = scope.values.setdefault(key, value)
+        return value
+
+    def __get_object(self, configuration_store: Dict[str, Configuration], configuration_name: str,
+                     runtime_context: Dict[str, str], default_value: object) -> Optional:
+        configuration: Configuration = configuration_store.get(
             configuration_name, None)
+        evaluation_statistics = self.evaluation_statistics
+        if evaluation_statistics is not None:
+            if configuration is None:
+                evaluation_statistics.record_missing(configuration_name)
+                return default_value
+            return evaluation_statistics.evaluate(configuration_name, configuration, runtime_context)
         if configuration is None:
             return default_value
         return configuration.get_value(runtime_context)
 
+    def unused_configuration_names(self) -> List[str]:
+        """ Return sorted names of stored configurations, that were never evaluated since statistics were enabled. """
+        if self.evaluation_statistics is None:
+            raise ValueError('Evaluation statistics are not enabled.')
+        used_names = self.evaluation_statistics.snapshot().keys()
+        return [name for name in self._name_index.names if name not in used_names]
+
+
+_NOT_EVALUATED = object()
+
 
 class FeatureFlagManager:
     """ Manager for feature flags. """
@@ -79,13 +254,30 @@ class FeatureFlagManager:
         """
         Return True if feature flag is active for provided runtime context.
         :param feature_flag_name: name of feature flag to evaluate
-        :param runtime_context: runtime context values
+        :param runtime_context: runtime context values, or None for the runtime context of the request scope
         :param default_value: default boolean value if feature flag could not be found
         :return:
         """
         return self._configuration_store.get_object(
             feature_flag_name, runtime_context, default_value)
 
+    def get_flags(self, prefix: str, runtime_context: Dict[str, str]) -> Dict[str, bool]:
+        """
+        Return evaluated values of all feature flags, whose names start with provided prefix.
+        :param prefix: prefix of feature flag names, i.e. 'billing.'
+        :param runtime_context: runtime context values, or None for the runtime context of the request scope
+        :return: values by feature flag name, in order of names
+        """
+        return self._configuration_store.get_objects(prefix, runtime_context)
+
+    def is_ready(self) -> bool:
+        """ Return True, if feature flags were loaded or defaults are served after giving up waiting. """
+        return self._configuration_store.is_ready()
+
+    def wait_until_ready(self, timeout_seconds: float = None) -> bool:
+        """ Block until feature flags are ready, up to provided timeout in seconds. Return True, if ready. """
+        return self._configuration_store.wait_until_ready(timeout_seconds)
+
 
 class ConfigManager:
     """ Manager for runtime configs. """
@@ -97,7 +289,7 @@ class ConfigManager:
         """
         Return evaluated config value object for provided configuration name from store.
         :param config_class:
-        :param runtime_context:
+        :param runtime_context: runtime context values, or None for the runtime context of the request scope
         :return:
         """
         config_class_name: str = _ClassUtil.full_class_name(config_class)
@@ -107,6 +299,23 @@ class ConfigManager:
             return _ClassUtil.instantiate_with_defaults(config_class)
         return config
 
+    def get_configs(self, namespace: str, runtime_context: Dict[str, str]) -> Dict[str, object]:
+        """
+        Return evaluated config value objects of all config classes in provided namespace.
+        :param namespace: module or package of config classes, i.e. 'configs.db'
+        :param runtime_context: runtime context values, or None for the runtime context of the request scope
+        :return: config value objects by full class name, in order of names
+        """
+        return self._configuration_store.get_objects(namespace + '.', runtime_context)
+
+    def is_ready(self) -> bool:
+        """ Return True, if configs were loaded or defaults are served after giving up waiting. """
+        return self._configuration_store.is_ready()
+
+    def wait_until_ready(self, timeout_seconds: float = None) -> bool:
+        """ Block until configs are ready, up to provided timeout in seconds. Return True, if ready. """
+        return self._configuration_store.wait_until_ready(timeout_seconds)
+
 
 class _ClassUtil:
     """ Utility class for instantiating objects by class name. """
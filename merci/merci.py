@@ -43,16 +43,20 @@ loader.start()
 
 """
 import time
-from typing import List
+from concurrent.futures import Executor
+from typing import Dict, List
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from merci.loaders import ConfigurationLoader
+from merci.loaders import ConfigurationLoader, RefreshPolicy
 from merci.managers import ConfigurationManager, FeatureFlagManager, ConfigManager
 from merci.deserialization import SingleValueDecoderFactory, ObjectValueDecoderFactory, ValueDecoderFactory
-from merci.metrics import ConfigurationManagerMetrics, ConfigurationLoaderMetrics
+from merci.metrics import ConfigurationManagerMetrics, ConfigurationLoaderMetrics, EvaluationStatistics
 from merci.readers import ConfigurationMapper, ConfigurationReader
 from merci.fetchers import ConfigurationFetcher
+from merci.tracing import RefreshTracer, NO_OP_TRACER
+from merci.caches import ContentCache
+from merci.spillover import SpillStore
 
 
 class ConfigurationManagerBuilder:
@@ -61,7 +65,13 @@ class ConfigurationManagerBuilder:
                  root_node: str, application: str,
                  fetcher: ConfigurationFetcher,
                  readers: List[ConfigurationReader],
-                 skip_non_instantiable: bool, maximum_skips: int):
+                 skip_non_instantiable: bool, maximum_skips: int,
+                 static_context: Dict[str, str] = None,
+                 tracer: RefreshTracer = NO_OP_TRACER,
+                 content_cache: ContentCache = None,
+                 parse_executor: Executor = None,
+                 slice_seconds: float = None,
+                 spill_store: SpillStore = None):
         self.value_decoder_factory = value_decoder_factory
         self.application = application
         self.fetcher = fetcher
@@ -70,13 +80,31 @@ class ConfigurationManagerBuilder:
         self.maximum_skips = maximum_skips
         self.file_names = []
         self.root_node = root_node
+        self.static_context = static_context
+        self.tracer = tracer
+        self.content_cache = content_cache
+        self.parse_executor = parse_executor
+        self.slice_seconds = slice_seconds
+        self.spill_store = spill_store
+        self.refresh_interval_seconds: float = None
         self.metrics: ConfigurationManagerMetrics = None
+        self.evaluation_statistics: EvaluationStatistics = None
 
     def set_metrics(self, metrics: ConfigurationManagerMetrics):
         """ Set metrics collector for config manager. """
         self.metrics = metrics
         return self
 
+    def set_evaluation_statistics(self, evaluation_statistics: EvaluationStatistics):
+        """ Set collector of sampled evaluation statistics for config manager. """
+        self.evaluation_statistics = evaluation_statistics
+        return self
+
+    def set_refresh_interval(self, refresh_interval_seconds: float):
+        """ Set time in seconds between reads of this manager's files, in case of a loader with refresh policy. """
+        self.refresh_interval_seconds = refresh_interval_seconds
+        return self
+
     def register_file(self, file_name: str):
         """ Register name of file with configurations. """
         self.file_names.append(file_name)
@@ -84,14 +112,21 @@ class ConfigurationManagerBuilder:
 
     def build(self) -> ConfigurationManager:
         manager = ConfigurationManager()
+        manager.set_evaluation_statistics(self.evaluation_statistics)
         if self.metrics is None:
             self.metrics = ConfigurationManagerMetrics()
         mapper = ConfigurationMapper(self.root_node,
                                      self.value_decoder_factory,
-                                     self.skip_non_instantiable, self.metrics)
+                                     self.skip_non_instantiable, self.metrics,
+                                     self.static_context, self.tracer,
+                                     self.parse_executor,
+                                     slice_seconds=self.slice_seconds,
+                                     spill_store=self.spill_store)
         reader = ConfigurationReader(self.application, self.file_names,
                                      self.fetcher, mapper, manager,
-                                     self.metrics, self.maximum_skips)
+                                     self.metrics, self.maximum_skips,
+                                     self.tracer, self.refresh_interval_seconds,
+                                     self.content_cache)
         self.readers.append(reader)
         return manager
 
@@ -100,22 +135,39 @@ class FeatureFlagManagerBuilder:
     """ Builder for feature flag manager. """
     def __init__(self, application: str, fetcher: ConfigurationFetcher,
                  readers: List[ConfigurationReader], skip_non_instantiable: bool,
-                 maximum_skips: int):
+                 maximum_skips: int, static_context: Dict[str, str] = None,
+                 tracer: RefreshTracer = NO_OP_TRACER,
+                 content_cache: ContentCache = None,
+                 parse_executor: Executor = None,
+                 slice_seconds: float = None,
+                 spill_store: SpillStore = None):
         self.builder = ConfigurationManagerBuilder(SingleValueDecoderFactory(),
                                                    "feature-flags", application,
                                                    fetcher, readers,
-                                                   skip_non_instantiable, maximum_skips)
+                                                   skip_non_instantiable, maximum_skips,
+                                                   static_context, tracer, content_cache,
+                                                   parse_executor, slice_seconds, spill_store)
 
     def register_file(self, file_name: str):
         """ Register name of file with feature flags. """
         self.builder.register_file(file_name)
         return self
 
+    def set_refresh_interval(self, refresh_interval_seconds: float):
+        """ Set time in seconds between reads of feature flags, in case of a loader with refresh policy. """
+        self.builder.set_refresh_interval(refresh_interval_seconds)
+        return self
+
     def set_metrics(self, metrics: ConfigurationManagerMetrics):
         """ Set metrics collector for feature flags manager. """
         self.builder.set_metrics(metrics)
         return self
 
+    def set_evaluation_statistics(self, evaluation_statistics: EvaluationStatistics):
+        """ Set collector of sampled evaluation statistics for feature flags manager. """
+        self.builder.set_evaluation_statistics(evaluation_statistics)
+        return self
+
     def build(self) -> FeatureFlagManager:
         configuration_manager = self.builder.build()
         return FeatureFlagManager(configuration_manager)
@@ -125,22 +177,39 @@ class ConfigManagerBuilder:
     """ Builder for config manager. """
     def __init__(self, application: str, fetcher: ConfigurationFetcher,
                  readers: List[ConfigurationReader], skip_non_instantiable: bool,
-                 maximum_skips: int):
+                 maximum_skips: int, static_context: Dict[str, str] = None,
+                 tracer: RefreshTracer = NO_OP_TRACER,
+                 content_cache: ContentCache = None,
+                 parse_executor: Executor = None,
+                 slice_seconds: float = None,
+                 spill_store: SpillStore = None):
         self.builder = ConfigurationManagerBuilder(ObjectValueDecoderFactory(),
                                                    "configs", application,
                                                    fetcher, readers,
-                                                   skip_non_instantiable, maximum_skips)
+                                                   skip_non_instantiable, maximum_skips,
+                                                   static_context, tracer, content_cache,
+                                                   parse_executor, slice_seconds, spill_store)
 
     def register_file(self, file_name: str):
         """ Register name of file with configs. """
         self.builder.register_file(file_name)
         return self
 
+    def set_refresh_interval(self, refresh_interval_seconds: float):
+        """ Set time in seconds between reads of configs, in case of a loader with refresh policy. """
+        self.builder.set_refresh_interval(refresh_interval_seconds)
+        return self
+
     def set_metrics(self, metrics: ConfigurationManagerMetrics):
         """ Set metrics collector for config manager. """
         self.builder.set_metrics(metrics)
         return self
 
+    def set_evaluation_statistics(self, evaluation_statistics: EvaluationStatistics):
+        """ Set collector of sampled evaluation statistics for config manager. """
+        self.builder.set_evaluation_statistics(evaluation_statistics)
+        return self
+
     def build(self) -> ConfigManager:
         configuration_manager: ConfigurationManager = self.builder.build()
         return ConfigManager(configuration_manager)
@@ -161,7 +230,14 @@ class Merci:
         self.readers: List[ConfigurationReader] = []
         self.skip_non_instantiable = True
         self.maximum_skips = 0
+        self.static_context: Dict[str, str] = None
         self.loader_metrics: ConfigurationLoaderMetrics = None
+        self.tracer: RefreshTracer = NO_OP_TRACER
+        self.content_cache: ContentCache = None
+        self.parse_executor: Executor = None
+        self.slice_seconds: float = None
+        self.spill_store: SpillStore = None
+        self.refresh_policy: RefreshPolicy = None
 
     def set_metrics(self, metrics: ConfigurationLoaderMetrics):
         """ Set metrics collector for configuration loader. """
@@ -171,6 +247,54 @@ class Merci:
         """ Set maximum number of times the in-memory configuration store will not be updated in case of same content. """
         self.maximum_skips = maximum_skips
 
+    def set_static_context(self, static_context: Dict[str, str]):
+        """
+        Set context values, i.e. 'environment' or 'region', that are fixed for the lifetime of the process.
+        Configurations of managers added afterwards are pruned against these values at load time, so that
+        runtime evaluation only walks the remaining (dynamic) context types. Runtime context values for
+        static context types are ignored for the pruned levels.
+        """
+        self.static_context = dict(static_context)
+
+    def set_tracer(self, tracer: RefreshTracer):
+        """ Set tracer for refresh phases of configuration loader and managers added afterwards. """
+        self.tracer = tracer
+
+    def set_refresh_policy(self, refresh_policy: RefreshPolicy):
+        """
+        Set policy for adaptive scheduling of configuration readers, with backoff after failures, jitter and
+        faster refreshes after changes. The refresh interval of the loader applies to managers without their own.
+        """
+        self.refresh_policy = refresh_policy
+
+    def set_content_cache(self, content_cache: ContentCache):
+        """
+        Set local cache of last-known-good content for managers added afterwards. Managers are loaded from it,
+        if their initial fetch fails, and right away when the loader is started in background.
+        """
+        self.content_cache = content_cache
+
+    def set_parse_executor(self, parse_executor: Executor):
+        """
+        Set executor for parsing large configuration files of managers added afterwards, i.e. a
+        ProcessPoolExecutor, so that refreshes do not hold the GIL of request serving threads while parsing.
+        """
+        self.parse_executor = parse_executor
+
+    def set_slice_budget(self, slice_seconds: float):
+        """
+        Set time budget in seconds for slices of instantiating configurations of managers added afterwards.
+        Between slices, refreshes yield the GIL to request serving threads. None disables slicing.
+        """
+        self.slice_seconds = slice_seconds
+
+    def set_spill_store(self, spill_store: SpillStore):
+        """
+        Set store for huge contexts maps of modifiers of managers added afterwards, i.e. per-tenant overrides,
+        that are kept in an on-disk index with an in-memory cache of hot entries instead of fully in memory.
+        """
+        self.spill_store = spill_store
+
     def skip_non_instantiable_configurations(self):
         """ Continue loading configurations, just skip each non-instantiable configuration. """
         self.skip_non_instantiable = True
@@ -182,12 +306,16 @@ class Merci:
     def add_feature_flag_manager(self, application: str):
         """ Create builder with new feature flag manager for provided application. """
         return FeatureFlagManagerBuilder(application, self.fetcher, self.readers,
-                                         self.skip_non_instantiable, self.maximum_skips)
+                                         self.skip_non_instantiable, self.maximum_skips,
+                                         self.static_context, self.tracer, self.content_cache,
+                                         self.parse_executor, self.slice_seconds, self.spill_store)
 
     def add_config_manager(self, application: str):
         """ Create builder with new config manager for provided application. """
         return ConfigManagerBuilder(application, self.fetcher, self.readers,
-                                    self.skip_non_instantiable, self.maximum_skips)
+                                    self.skip_non_instantiable, self.maximum_skips,
+                                    self.static_context, self.tracer, self.content_cache,
+                                    self.parse_executor, self.slice_seconds, self.spill_store)
 
     def create_and_start_loader(self, refresh_interval_seconds: time) -> ConfigurationLoader:
         """ Create new configuration loader with provided refresh interval and immediately start it. """
@@ -195,13 +323,24 @@ class Merci:
         loader.start()
         return loader
 
+    def create_and_start_loader_in_background(self, refresh_interval_seconds: time,
+                                              initial_load_timeout_seconds: float = None) -> ConfigurationLoader:
+        """
+        Create new configuration loader with provided refresh interval and start it without waiting for the
+        initial loads. Managers serve defaults after the optional timeout, if their initial load did not finish.
+        """
+        loader = self.create_loader(refresh_interval_seconds)
+        loader.start_in_background(initial_load_timeout_seconds)
+        return loader
+
     def create_loader(self, refresh_interval_seconds: int) -> ConfigurationLoader:
         """ Creates new configuration loader with provided refresh interval. """
         if self.loader_metrics is None:
             self.loader_metrics = ConfigurationLoaderMetrics()
         loader = ConfigurationLoader(self.readers, self.scheduler,
                                      refresh_interval_seconds,
-                                     self.loader_metrics)
+                                     self.loader_metrics, self.tracer,
+                                     self.refresh_policy)
         # clear readers list
         self.readers = []
         return loader
@@ -14,8 +14,379 @@
 # limitations under the License.
 #
 """
+Metrics collectors for configuration fetchers, readers, mappers and loaders.
 """
+import bisect
+import collections
+import threading
+import time
+import weakref
 from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class LatencyHistogram:
+    """
+    Histogram of durations in seconds with fixed bucket bounds. Each bucket counts the observations, that are
+    less than or equal to its bound, but greater than the previous bound. Observing a duration is a binary
+    search and a few additions, so that it is cheap enough for every refresh phase.
+    """
+    DEFAULT_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                      0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, bounds: Iterable[float] = DEFAULT_BOUNDS):
+        """
+        Initialize histogram.
+        :param bounds: ascending upper bounds of buckets in seconds, without the implicit infinite bound
+        """
+        self.bounds: Tuple[float, ...] = tuple(bounds)
+        # one count per bound and one for durations above the highest bound
+        self.bucket_counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        """ Add duration in seconds. """
+        self.bucket_counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, histogram: 'LatencyHistogram'):
+        """ Add all observations of provided histogram with the same bounds. """
+        for index, bucket_count in enumerate(histogram.bucket_counts):
+            self.bucket_counts[index] += bucket_count
+        self.count += histogram.count
+        self.sum += histogram.sum
+        if histogram.max > self.max:
+            self.max = histogram.max
+
+    def quantile(self, quantile: float) -> float:
+        """
+        Return estimated duration for provided quantile, i.e. 0.99, as the upper bound of the bucket, that
+        contains the quantile. Returns the maximum observed duration for the highest bucket.
+        :param quantile: quantile between 0 and 1
+        :return: estimated duration in seconds, or 0 without observations
+        """
+        if self.count == 0:
+            return 0.0
+        rank = quantile * self.count
+        cumulative_count = 0
+        for index, bucket_count in enumerate(self.bucket_counts[:-1]):
+            cumulative_count += bucket_count
+            if cumulative_count >= rank:
+                return min(self.bounds[index], self.max)
+        return self.max
+
+
+class _ThreadSentinel:
+    """ Thread-local object, that is released when its thread ends, so that values of the thread are retired. """
+    __slots__ = ('__weakref__',)
+
+
+def _on_thread_exit(local: threading.local, retired: collections.deque, thread_values: object):
+    """
+    Queue provided per-thread values for retirement, once the current thread ends. The finalizer only appends
+    to a deque, since it may run while a lock of the collector is held, i.e. during garbage collection.
+    """
+    sentinel = _ThreadSentinel()
+    local.sentinel = sentinel
+    weakref.finalize(sentinel, retired.append, thread_values)
+
+
+class _CounterStripe:
+    """ Counter values, that are only incremented by a single thread. """
+    def __init__(self, size: int):
+        self.lock = threading.Lock()
+        self.values = [0] * size
+
+
+class StripedCounters:
+    """
+    Named counters, that are safe to increment from many threads. Each thread increments its own stripe of
+    values under its own, practically uncontended lock, so that no increments get lost. A snapshot locks all
+    stripes at once, so that it is atomic across all counters. Stripes of ended threads are folded into
+    retired values, so that thread-per-request servers do not accumulate stripes.
+    """
+    def __init__(self, names: Iterable[str]):
+        """
+        Initialize counters with zero values.
+        :param names: names of counters
+        """
+        self.names: Tuple[str, ...] = tuple(names)
+        self.indexes: Dict[str, int] = {name: index for index, name in enumerate(self.names)}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stripes: List[_CounterStripe] = []
+        # Totals of stripes of ended threads, guarded by the lock. */
+        self._retired_values = [0] * len(self.names)
+        # Stripes of ended threads, that are not folded into retired values yet. */
+        self._ended_stripes = collections.deque()
+
+    def __stripe(self) -> _CounterStripe:
+        try:
+            return self._local.stripe
+        except AttributeError:
+            stripe = _CounterStripe(len(self.names))
+            with self._lock:
+                self.__retire_ended_stripes()
+                self._stripes.append(stripe)
+            self._local.stripe = stripe
+            _on_thread_exit(self._local, self._ended_stripes, stripe)
+            return stripe
+
+    def __retire_ended_stripes(self):
+        """ Fold stripes of ended threads into retired values, with the lock held. """
+        while self._ended_stripes:
+            stripe = self._ended_stripes.popleft()
+            with stripe.lock:
+                for index, value in enumerate(stripe.values):
+                    self._retired_values[index] += value
+            self._stripes.remove(stripe)
+
+    def increment(self, name: str, count: int = 1):
+        """ Increment counter with provided name. """
+        stripe = self.__stripe()
+        with stripe.lock:
+            stripe.values[self.indexes[name]] += count
+
+    def value(self, name: str) -> int:
+        """ Return current value of counter with provided name. """
+        index = self.indexes[name]
+        with self._lock:
+            self.__retire_ended_stripes()
+            stripes = list(self._stripes)
+            total = self._retired_values[index]
+        for stripe in stripes:
+            with stripe.lock:
+                total += stripe.values[index]
+        return total
+
+    def snapshot(self) -> Dict[str, int]:
+        """ Return values of all counters, as of a single point in time. """
+        with self._lock:
+            self.__retire_ended_stripes()
+            stripes = list(self._stripes)
+            for stripe in stripes:
+                stripe.lock.acquire()
+            try:
+                totals = list(self._retired_values)
+                for stripe in stripes:
+                    for index, value in enumerate(stripe.values):
+                        totals[index] += value
+            finally:
+                for stripe in stripes:
+                    stripe.lock.release()
+        return dict(zip(self.names, totals))
+
+    def set(self, name: str, value: int):
+        """ Set counter with provided name to provided value, i.e. to reset it. """
+        index = self.indexes[name]
+        with self._lock:
+            self.__retire_ended_stripes()
+            for stripe in self._stripes:
+                with stripe.lock:
+                    stripe.values[index] = 0
+            self._retired_values[index] = value
+
+
+class _CounterValue:
+    """
+    Attribute with the current value of the counter with the same name in the striped counters of a metrics
+    collector. Assigning a value, i.e. 0 to reset the counter, sets the counter across all threads.
+    """
+    def __init__(self):
+        self.name: str = None
+
+    def __set_name__(self, owner: type, name: str):
+        self.name = name
+
+    def __get__(self, instance, owner: type):
+        if instance is None:
+            return self
+        return instance.counters.value(self.name)
+
+    def __set__(self, instance, value: int):
+        instance.counters.set(self.name, value)
+
+
+class ConfigurationStatistics:
+    """ Evaluation statistics of a single configuration. """
+    LATENCY_BOUNDS = (0.0000005, 0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005,
+                      0.0001, 0.00025, 0.0005, 0.001)
+
+    def __init__(self):
+        # number of all evaluations, sampled or not
+        self.calls = 0
+        # number of evaluations, that returned the default value of the caller, because the configuration is missing
+        self.missing = 0
+        # number of sampled evaluations, and of those, that returned a value from modifiers
+        self.samples = 0
+        self.overrides = 0
+        # total and maximum number of modifiers levels walked by sampled evaluations
+        self.depth_sum = 0
+        self.max_depth = 0
+        self.latencies = LatencyHistogram(self.LATENCY_BOUNDS)
+
+    def override_ratio(self) -> float:
+        """ Return ratio of sampled evaluations, that returned a value from modifiers instead of the default value. """
+        return self.overrides / self.samples if self.samples > 0 else 0.0
+
+    def mean_depth(self) -> float:
+        """ Return mean number of modifiers levels walked by sampled evaluations. """
+        return self.depth_sum / self.samples if self.samples > 0 else 0.0
+
+    def merge(self, statistics: 'ConfigurationStatistics'):
+        """ Add counts of provided statistics. """
+        self.calls += statistics.calls
+        self.missing += statistics.missing
+        self.samples += statistics.samples
+        self.overrides += statistics.overrides
+        self.depth_sum += statistics.depth_sum
+        self.max_depth = max(self.max_depth, statistics.max_depth)
+        self.latencies.merge(statistics.latencies)
+
+
+class _ThreadEvaluationStatistics:
+    """ Evaluation statistics, that are only updated by a single thread. """
+    def __init__(self, sample_interval: int):
+        self.sample_interval = sample_interval
+        self.countdown = sample_interval
+        self.configurations: Dict[str, ConfigurationStatistics] = {}
+
+    def get(self, configuration_name: str) -> ConfigurationStatistics:
+        statistics = self.configurations.get(configuration_name, None)
+        if statistics is None:
+            statistics = ConfigurationStatistics()
+            self.configurations[configuration_name] = statistics
+        return statistics
+
+    def sample(self) -> bool:
+        self.countdown -= 1
+        if self.countdown > 0:
+            return False
+        self.countdown = self.sample_interval
+        return True
+
+
+class EvaluationStatistics:
+    """
+    Opt-in statistics of configuration evaluations, i.e. to find hot and dead feature flags. Every evaluation is
+    counted, every n-th evaluation per thread is sampled for latency, evaluation depth and whether it returned
+    the default value or an override. Each thread updates its own counters without locking, counters of all
+    threads are merged on read. Counters of ended threads are merged into retired statistics.
+    """
+    def __init__(self, sample_interval: int = 100):
+        """
+        Initialize statistics.
+        :param sample_interval: sample one out of this number of evaluations per thread
+        """
+        self.sample_interval = sample_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threads: List[_ThreadEvaluationStatistics] = []
+        # Merged statistics of ended threads by configuration name, guarded by the lock. */
+        self._retired: Dict[str, ConfigurationStatistics] = {}
+        # Statistics of ended threads, that are not merged into retired statistics yet. */
+        self._ended_threads = collections.deque()
+
+    def for_current_thread(self) -> _ThreadEvaluationStatistics:
+        """ Return statistics, that are only updated by the current thread. """
+        try:
+            return self._local.statistics
+        except AttributeError:
+            statistics = _ThreadEvaluationStatistics(self.sample_interval)
+            with self._lock:
+                self.__retire_ended_threads()
+                self._threads.append(statistics)
+            self._local.statistics = statistics
+            _on_thread_exit(self._local, self._ended_threads, statistics)
+            return statistics
+
+    def __retire_ended_threads(self):
+        """ Merge statistics of ended threads into retired statistics, with the lock held. """
+        while self._ended_threads:
+            thread_statistics = self._ended_threads.popleft()
+            for configuration_name, statistics in thread_statistics.configurations.items():
+                self._retired.setdefault(configuration_name, ConfigurationStatistics()).merge(statistics)
+            self._threads.remove(thread_statistics)
+
+    def evaluate(self, configuration_name: str, configuration, runtime_context: Dict[str, str]) -> object:
+        """
+        Evaluate configuration for provided runtime context and record statistics.
+        :param configuration_name: name of configuration
+        :param configuration: configuration to be evaluated
+        :param runtime_context: runtime context values
+        :return: evaluated value object
+        """
+        thread_statistics = self.for_current_thread()
+        statistics = thread_statistics.get(configuration_name)
+        statistics.calls += 1
+        if not thread_statistics.sample():
+            return configuration.get_value(runtime_context)
+        start = time.perf_counter()
+        value, depth, overridden = configuration.trace_value(runtime_context)
+        statistics.latencies.observe(time.perf_counter() - start)
+        statistics.samples += 1
+        if overridden:
+            statistics.overrides += 1
+        statistics.depth_sum += depth
+        if depth > statistics.max_depth:
+            statistics.max_depth = depth
+        return value
+
+    def record_missing(self, configuration_name: str):
+        """ Record evaluation of a missing configuration. """
+        statistics = self.for_current_thread().get(configuration_name)
+        statistics.calls += 1
+        statistics.missing += 1
+
+    def snapshot(self) -> Dict[str, ConfigurationStatistics]:
+        """ Return statistics per configuration name, merged from all threads. """
+        merged: Dict[str, ConfigurationStatistics] = {}
+        with self._lock:
+            self.__retire_ended_threads()
+            threads = list(self._threads)
+            for configuration_name, statistics in self._retired.items():
+                merged.setdefault(configuration_name, ConfigurationStatistics()).merge(statistics)
+        for thread_statistics in threads:
+            for configuration_name, statistics in list(thread_statistics.configurations.items()):
+                merged.setdefault(configuration_name, ConfigurationStatistics()).merge(statistics)
+        return merged
+
+
+class RefreshPhases:
+    """ Names of the timed phases of a configuration refresh. """
+    CYCLE = 'cycle'
+    READ = 'read'
+    FETCH = 'fetch'
+    HASH = 'hash'
+    PARSE = 'parse'
+    INSTANTIATE = 'instantiate'
+    STORE = 'store'
+
+
+class _DurationHistograms:
+    """ Histograms of durations per phase, and per phase and file. """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations: Dict[str, LatencyHistogram] = {}
+        self.file_durations: Dict[Tuple[str, str], LatencyHistogram] = {}
+
+    def observe(self, phase: str, seconds: float, file_name: Optional[str]):
+        with self.lock:
+            histogram = self.durations.get(phase, None)
+            if histogram is None:
+                histogram = self.durations.setdefault(phase, LatencyHistogram())
+            histogram.observe(seconds)
+            if file_name is not None:
+                key = (phase, file_name)
+                histogram = self.file_durations.get(key, None)
+                if histogram is None:
+                    histogram = self.file_durations.setdefault(key, LatencyHistogram())
+                histogram.observe(seconds)
 
 
 class ConfigurationMapperMetrics(ABC):
@@ -24,6 +395,20 @@ class ConfigurationMapperMetrics(ABC):
     def increment_non_instantiable_skips(self, count: int = 1):
         """ Increment counter for skipped updates of configs due to instantiation problems with Python classes for configs. """
 
+    def increment_parse_offload_failures(self, count: int = 1):
+        """ Increment counter for files parsed in process, because the parse executor was broken. Ignored unless overridden. """
+
+    def observe_slice_duration(self, seconds: float):
+        """ Add duration of a slice of cooperative parsing and instantiation. Ignored unless overridden. """
+
+    def observe_duration(self, phase: str, seconds: float, file_name: str = None):
+        """
+        Add duration of a refresh phase, i.e. RefreshPhases.PARSE. Ignored unless overridden.
+        :param phase: name of refresh phase
+        :param seconds: duration in seconds
+        :param file_name: name of file the duration applies to, or None for all files
+        """
+
 
 class ConfigurationReaderMetrics(ABC):
     """ Metrics for configuration reader. """
@@ -47,73 +432,245 @@ class ConfigurationReaderMetrics(ABC):
     def increment_name_duplicates(self, count: int = 1):
         """ Increment counter for duplicate configuration name detections. """
 
+    def observe_duration(self, phase: str, seconds: float, file_name: str = None):
+        """
+        Add duration of a refresh phase, i.e. RefreshPhases.FETCH. Ignored unless overridden.
+        :param phase: name of refresh phase
+        :param seconds: duration in seconds
+        :param file_name: name of file the duration applies to, or None for all files
+        """
+
+    def increment_forced_refreshes(self, count: int = 1):
+        """ Increment number of update cycles forced for same textual contents. Ignored unless overridden. """
+
+    def increment_parse_cache_hits(self, count: int = 1):
+        """ Increment counter for unchanged files, that were not parsed again. Ignored unless overridden. """
+
+    def increment_cache_loads(self, count: int = 1):
+        """ Increment counter for updates of configurations from the content cache. Ignored unless overridden. """
+
+    def increment_cache_failures(self, count: int = 1):
+        """ Increment counter for failed reads or writes of the content cache. Ignored unless overridden. """
+
 
 class ConfigurationManagerMetrics(ConfigurationMapperMetrics,
                                   ConfigurationReaderMetrics):
     """ Metrics for configuration manager. """
+    updates = _CounterValue()
+    content_failures = _CounterValue()
+    same_content_skips = _CounterValue()
+    new_content_updates = _CounterValue()
+    name_duplicates = _CounterValue()
+    non_instantiable_skips = _CounterValue()
+    parse_offload_failures = _CounterValue()
+    forced_refreshes = _CounterValue()
+    parse_cache_hits = _CounterValue()
+    cache_loads = _CounterValue()
+    cache_failures = _CounterValue()
+
     def __init__(self):
-        self.updates = 0
-        self.content_failures = 0
-        self.same_content_skips = 0
-        self.new_content_updates = 0
-        self.name_duplicates = 0
-        self.non_instantiable_skips = 0
+        self.counters = StripedCounters(['updates', 'content_failures', 'same_content_skips',
+                                         'new_content_updates', 'name_duplicates', 'non_instantiable_skips',
+                                         'parse_offload_failures', 'forced_refreshes', 'parse_cache_hits',
+                                         'cache_loads', 'cache_failures'])
+        self.histograms = _DurationHistograms()
+        self.slice_durations = LatencyHistogram()
+        self.slice_durations_lock = threading.Lock()
+
+    @property
+    def durations(self) -> Dict[str, LatencyHistogram]:
+        """ Histograms of refresh durations per phase. """
+        return self.histograms.durations
+
+    @property
+    def file_durations(self) -> Dict[Tuple[str, str], LatencyHistogram]:
+        """ Histograms of refresh durations per phase and file name. """
+        return self.histograms.file_durations
+
+    @property
+    def maximum_slice_seconds(self) -> float:
+        """ Longest slice of cooperative parsing and instantiation in seconds. """
+        return self.slice_durations.max
+
+    def snapshot(self) -> Dict[str, int]:
+        """ Return values of all counters by attribute name, as of a single point in time. """
+        return self.counters.snapshot()
 
     def increment_updates(self, count: int = 1):
         """ Increment counter for successful updates of configurations. """
-        self.updates += count
+        self.counters.increment('updates', count)
 
     def increment_content_failures(self, count: int = 1):
         """ Increment counter for failed updates of configurations due to deserialization problems with textual content. """
-        self.content_failures += count
+        self.counters.increment('content_failures', count)
 
     def increment_same_content_skips(self, count: int = 1):
         """ Increment number of skipped update cycles of configurations due to same textual contents. """
-        self.same_content_skips += count
+        self.counters.increment('same_content_skips', count)
 
     def increment_new_content_updates(self, count: int = 1):
         """ Increment number of successful update cycles of configurations due to new textual contents. """
-        self.new_content_updates += count
+        self.counters.increment('new_content_updates', count)
 
     def increment_name_duplicates(self, count: int = 1):
         """ Increment counter for duplicate configuration name detections. """
-        self.name_duplicates += count
+        self.counters.increment('name_duplicates', count)
 
     def increment_non_instantiable_skips(self, count: int = 1):
         """ Increment counter for skipped updates of configs due to instantiation problems with Python classes for configs. """
-        self.non_instantiable_skips += count
+        self.counters.increment('non_instantiable_skips', count)
+
+    def increment_parse_offload_failures(self, count: int = 1):
+        """ Increment counter for files parsed in process, because the parse executor was broken. """
+        self.counters.increment('parse_offload_failures', count)
+
+    def observe_slice_duration(self, seconds: float):
+        """ Add duration of a slice of cooperative parsing and instantiation. """
+        with self.slice_durations_lock:
+            self.slice_durations.observe(seconds)
+
+    def increment_forced_refreshes(self, count: int = 1):
+        """ Increment number of update cycles forced for same textual contents, after maximum skips. """
+        self.counters.increment('forced_refreshes', count)
+
+    def increment_parse_cache_hits(self, count: int = 1):
+        """ Increment counter for unchanged files, that were not parsed again in update cycles due to new content. """
+        self.counters.increment('parse_cache_hits', count)
+
+    def increment_cache_loads(self, count: int = 1):
+        """ Increment counter for updates of configurations from the content cache. """
+        self.counters.increment('cache_loads', count)
+
+    def increment_cache_failures(self, count: int = 1):
+        """ Increment counter for failed reads or writes of the content cache. """
+        self.counters.increment('cache_failures', count)
+
+    def observe_duration(self, phase: str, seconds: float, file_name: str = None):
+        """ Add duration of a refresh phase to the histogram of the phase and, if provided, of the file. """
+        self.histograms.observe(phase, seconds, file_name)
 
 
 class ConfigurationFetcherMetrics:
     """ Metrics for configuration fetcher. """
+    requests = _CounterValue()
+    failures = _CounterValue()
+    missing_files = _CounterValue()
+    delta_updates = _CounterValue()
+    resyncs = _CounterValue()
+
     def __init__(self):
-        self.requests = 0
-        self.failures = 0
-        self.missing_files = 0
+        self.counters = StripedCounters(['requests', 'failures', 'missing_files', 'delta_updates', 'resyncs'])
+        self.histograms = _DurationHistograms()
+
+    @property
+    def durations(self) -> Dict[str, LatencyHistogram]:
+        """ Histograms of fetch durations. """
+        return self.histograms.durations
+
+    @property
+    def file_durations(self) -> Dict[Tuple[str, str], LatencyHistogram]:
+        """ Histograms of fetch durations per file name. """
+        return self.histograms.file_durations
+
+    def snapshot(self) -> Dict[str, int]:
+        """ Return values of all counters by attribute name, as of a single point in time. """
+        return self.counters.snapshot()
 
     def increment_requests(self, count: int = 1):
         """ Increment counter for all requests, failed and successful. """
-        self.requests += count
+        self.counters.increment('requests', count)
 
     def increment_failures(self, count: int = 1):
         """ Increment counter for failed requests. """
-        self.failures += count
+        self.counters.increment('failures', count)
 
     def increment_missing_files(self, count: int = 1):
         """ Increment counter for missing files. """
-        self.missing_files += count
+        self.counters.increment('missing_files', count)
+
+    def increment_delta_updates(self, count: int = 1):
+        """ Increment counter for files updated by applying deltas instead of fetching full content. """
+        self.counters.increment('delta_updates', count)
+
+    def increment_resyncs(self, count: int = 1):
+        """ Increment counter for full fetches after version gaps or deltas, that could not be applied. """
+        self.counters.increment('resyncs', count)
+
+    def observe_duration(self, phase: str, seconds: float, file_name: str = None):
+        """ Add duration of fetching, i.e. RefreshPhases.FETCH, to the histogram of the phase and, if provided, of the file. """
+        self.histograms.observe(phase, seconds, file_name)
 
 
 class ConfigurationLoaderMetrics:
     """ Metrics for configuration loader. """
+    configuration_requests = _CounterValue()
+    configuration_failures = _CounterValue()
+    scheduled_refreshes = _CounterValue()
+    backoff_refreshes = _CounterValue()
+    fast_refreshes = _CounterValue()
+    initial_load_timeouts = _CounterValue()
+    coalesced_fetches = _CounterValue()
+    watch_triggers = _CounterValue()
+    watch_reconnects = _CounterValue()
+
+    # Bucket bounds in seconds for delays between adaptively scheduled refreshes.
+    DELAY_BOUNDS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
     def __init__(self):
-        self.configuration_requests = 0
-        self.configuration_failures = 0
+        self.counters = StripedCounters(['configuration_requests', 'configuration_failures', 'scheduled_refreshes',
+                                         'backoff_refreshes', 'fast_refreshes', 'initial_load_timeouts',
+                                         'coalesced_fetches', 'watch_triggers', 'watch_reconnects'])
+        self.cycle_durations = LatencyHistogram()
+        self.cycle_durations_lock = threading.Lock()
+        self.refresh_delays = LatencyHistogram(self.DELAY_BOUNDS)
+        self.refresh_delays_lock = threading.Lock()
+
+    def snapshot(self) -> Dict[str, int]:
+        """ Return values of all counters by attribute name, as of a single point in time. """
+        return self.counters.snapshot()
 
     def increment_configuration_requests(self, count: int = 1):
         """ Increment counter for all requests, failed and successful. """
-        self.configuration_requests += count
+        self.counters.increment('configuration_requests', count)
 
     def increment_configuration_failures(self, count: int = 1):
         """ Increment counter for failed requests. """
-        self.configuration_failures += count
+        self.counters.increment('configuration_failures', count)
+
+    def increment_scheduled_refreshes(self, count: int = 1):
+        """ Increment counter for adaptively scheduled executions of configuration readers. """
+        self.counters.increment('scheduled_refreshes', count)
+
+    def increment_backoff_refreshes(self, count: int = 1):
+        """ Increment counter for executions, that are delayed by backoff after failures. """
+        self.counters.increment('backoff_refreshes', count)
+
+    def increment_fast_refreshes(self, count: int = 1):
+        """ Increment counter for executions, that are brought forward after changed content. """
+        self.counters.increment('fast_refreshes', count)
+
+    def increment_initial_load_timeouts(self, count: int = 1):
+        """ Increment counter for managers, that serve defaults, because their initial load timed out. """
+        self.counters.increment('initial_load_timeouts', count)
+
+    def increment_coalesced_fetches(self, count: int = 1):
+        """ Increment counter for files, that readers shared with other readers instead of fetching them again. """
+        self.counters.increment('coalesced_fetches', count)
+
+    def increment_watch_triggers(self, count: int = 1):
+        """ Increment counter for reader executions triggered by watches, that reported changes. """
+        self.counters.increment('watch_triggers', count)
+
+    def increment_watch_reconnects(self, count: int = 1):
+        """ Increment counter for watches, that were established again after failures. """
+        self.counters.increment('watch_reconnects', count)
+
+    def observe_cycle_duration(self, seconds: float):
+        """ Add duration of a refresh cycle of all configuration readers. """
+        with self.cycle_durations_lock:
+            self.cycle_durations.observe(seconds)
+
+    def observe_refresh_delay(self, seconds: float):
+        """ Add delay until the next adaptively scheduled execution of a configuration reader. """
+        with self.refresh_delays_lock:
+            self.refresh_delays.observe(seconds)
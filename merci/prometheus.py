@@ -0,0 +1,180 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Adapter for exposing Merci metrics in the Prometheus text exposition format.
+
+Sample code on how to expose metrics:
+
+exposition = PrometheusExposition()
+exposition.add_manager_metrics(feature_metrics, {"application": "myapp", "manager": "feature-flags"})
+exposition.add_fetcher_metrics(fetcher_metrics)
+exposition.add_loader_metrics(loader_metrics)
+
+# Return text from the metrics endpoint of the application, with content type PrometheusExposition.CONTENT_TYPE.
+text = exposition.generate()
+"""
+from typing import Dict, List, Tuple
+
+from merci.metrics import ConfigurationManagerMetrics, ConfigurationFetcherMetrics, ConfigurationLoaderMetrics, \
+    LatencyHistogram
+
+
+class _Family:
+    """ Samples of a single metric family. """
+    def __init__(self, name: str, metric_type: str, description: str):
+        self.name = name
+        self.metric_type = metric_type
+        self.description = description
+        self.samples: List[str] = []
+
+    def add_sample(self, suffix: str, labels: Dict[str, str], value: float):
+        self.samples.append(self.name + suffix + _format_labels(labels) + ' ' + _format_value(value))
+
+    def add_histogram(self, labels: Dict[str, str], histogram: LatencyHistogram):
+        cumulative_count = 0
+        for bound, bucket_count in zip(histogram.bounds, histogram.bucket_counts):
+            cumulative_count += bucket_count
+            self.add_sample('_bucket', dict(labels, le=_format_value(bound)), cumulative_count)
+        self.add_sample('_bucket', dict(labels, le='+Inf'), histogram.count)
+        self.add_sample('_sum', labels, histogram.sum)
+        self.add_sample('_count', labels, histogram.count)
+
+    def render(self) -> str:
+        return ('# HELP ' + self.name + ' ' + self.description + '\n' +
+                '# TYPE ' + self.name + ' ' + self.metric_type + '\n' +
+                ''.join(sample + '\n' for sample in self.samples))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(name + '="' + _escape(str(value)) + '"' for name, value in labels.items()) + '}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class PrometheusExposition:
+    """ Renders registered metrics collectors in the Prometheus text exposition format (version 0.0.4). """
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    MANAGER_COUNTERS = [
+        ('updates', 'configuration_updates_total', 'Successful updates of configurations.'),
+        ('content_failures', 'configuration_content_failures_total', 'Failed updates due to bad textual content.'),
+        ('same_content_skips', 'configuration_same_content_skips_total', 'Skipped update cycles due to same content.'),
+        ('new_content_updates', 'configuration_new_content_updates_total', 'Update cycles due to new content.'),
+        ('name_duplicates', 'configuration_name_duplicates_total', 'Duplicate configuration names.'),
+        ('non_instantiable_skips', 'configuration_non_instantiable_skips_total', 'Skipped non-instantiable configs.'),
+        ('parse_offload_failures', 'configuration_parse_offload_failures_total', 'Files parsed in process instead.'),
+        ('forced_refreshes', 'configuration_forced_refreshes_total', 'Update cycles forced for same content.'),
+        ('parse_cache_hits', 'configuration_parse_cache_hits_total', 'Unchanged files, that were not parsed again.'),
+        ('cache_loads', 'configuration_cache_loads_total', 'Updates from the last-known-good content cache.'),
+        ('cache_failures', 'configuration_cache_failures_total', 'Failed reads or writes of the content cache.'),
+    ]
+    FETCHER_COUNTERS = [
+        ('requests', 'fetch_requests_total', 'Fetch requests, failed and successful.'),
+        ('failures', 'fetch_failures_total', 'Failed fetch requests.'),
+        ('missing_files', 'fetch_missing_files_total', 'Missing configuration files.'),
+        ('delta_updates', 'fetch_delta_updates_total', 'Files updated by applying deltas.'),
+        ('resyncs', 'fetch_resyncs_total', 'Full fetches after version gaps or failed deltas.'),
+    ]
+    LOADER_COUNTERS = [
+        ('configuration_requests', 'loader_configuration_requests_total', 'Executions of configuration readers.'),
+        ('configuration_failures', 'loader_configuration_failures_total', 'Failed executions of configuration readers.'),
+        ('scheduled_refreshes', 'loader_scheduled_refreshes_total', 'Adaptively scheduled reader executions.'),
+        ('backoff_refreshes', 'loader_backoff_refreshes_total', 'Reader executions delayed by backoff.'),
+        ('fast_refreshes', 'loader_fast_refreshes_total', 'Reader executions brought forward after changes.'),
+        ('coalesced_fetches', 'loader_coalesced_fetches_total', 'Files shared by readers instead of fetched again.'),
+        ('initial_load_timeouts', 'loader_initial_load_timeouts_total', 'Managers serving defaults after timeouts.'),
+        ('watch_triggers', 'loader_watch_triggers_total', 'Reader executions triggered by watched changes.'),
+        ('watch_reconnects', 'loader_watch_reconnects_total', 'Watches established again after failures.'),
+    ]
+
+    def __init__(self, namespace: str = 'merci'):
+        """
+        Initialize exposition.
+        :param namespace: prefix of all metric names
+        """
+        self.namespace = namespace
+        self.manager_metrics: List[Tuple[ConfigurationManagerMetrics, Dict[str, str]]] = []
+        self.fetcher_metrics: List[Tuple[ConfigurationFetcherMetrics, Dict[str, str]]] = []
+        self.loader_metrics: List[Tuple[ConfigurationLoaderMetrics, Dict[str, str]]] = []
+
+    def add_manager_metrics(self, metrics: ConfigurationManagerMetrics, labels: Dict[str, str] = None):
+        """ Register metrics of a configuration manager, with labels to tell it apart, i.e. application name. """
+        self.manager_metrics.append((metrics, dict(labels or {})))
+        return self
+
+    def add_fetcher_metrics(self, metrics: ConfigurationFetcherMetrics, labels: Dict[str, str] = None):
+        """ Register metrics of a configuration fetcher. """
+        self.fetcher_metrics.append((metrics, dict(labels or {})))
+        return self
+
+    def add_loader_metrics(self, metrics: ConfigurationLoaderMetrics, labels: Dict[str, str] = None):
+        """ Register metrics of a configuration loader. """
+        self.loader_metrics.append((metrics, dict(labels or {})))
+        return self
+
+    def generate(self) -> str:
+        """ Return current values of all registered metrics in the Prometheus text exposition format. """
+        families: Dict[str, _Family] = {}
+
+        def family(name: str, metric_type: str, description: str) -> _Family:
+            name = self.namespace + '_' + name
+            if name not in families:
+                families[name] = _Family(name, metric_type, description)
+            return families[name]
+
+        for metrics_list, counters in [(self.manager_metrics, self.MANAGER_COUNTERS),
+                                       (self.fetcher_metrics, self.FETCHER_COUNTERS),
+                                       (self.loader_metrics, self.LOADER_COUNTERS)]:
+            for metrics, labels in metrics_list:
+                values = metrics.snapshot()
+                for attribute, name, description in counters:
+                    family(name, 'counter', description).add_sample('', labels, values[attribute])
+        for metrics, labels in self.manager_metrics:
+            for phase, histogram in sorted(metrics.durations.items()):
+                family('refresh_phase_duration_seconds', 'histogram', 'Durations of refresh phases.')\
+                    .add_histogram(dict(labels, phase=phase), histogram)
+            for (phase, file_name), histogram in sorted(metrics.file_durations.items()):
+                family('refresh_file_phase_duration_seconds', 'histogram', 'Durations of refresh phases per file.')\
+                    .add_histogram(dict(labels, phase=phase, file=file_name), histogram)
+            if metrics.slice_durations.count > 0:
+                family('refresh_slice_duration_seconds', 'histogram', 'Durations of cooperative refresh slices.')\
+                    .add_histogram(labels, metrics.slice_durations)
+                family('refresh_maximum_slice_duration_seconds', 'gauge', 'Longest cooperative refresh slice.')\
+                    .add_sample('', labels, metrics.maximum_slice_seconds)
+        for metrics, labels in self.fetcher_metrics:
+            for phase, histogram in sorted(metrics.durations.items()):
+                family('fetch_duration_seconds', 'histogram', 'Durations of fetch requests.')\
+                    .add_histogram(dict(labels, phase=phase), histogram)
+            for (phase, file_name), histogram in sorted(metrics.file_durations.items()):
+                family('fetch_file_duration_seconds', 'histogram', 'Durations of fetching single files.')\
+                    .add_histogram(dict(labels, phase=phase, file=file_name), histogram)
+        for metrics, labels in self.loader_metrics:
+            family('loader_cycle_duration_seconds', 'histogram', 'Durations of refresh cycles of all readers.')\
+                .add_histogram(labels, metrics.cycle_durations)
+            if metrics.refresh_delays.count > 0:
+                family('loader_refresh_delay_seconds', 'histogram', 'Delays until adaptively scheduled refreshes.')\
+                    .add_histogram(labels, metrics.refresh_delays)
+        return ''.join(metric_family.render() for metric_family in families.values())
@@ -16,16 +16,20 @@
 """
 Classes for reading and storing feature flags and configs.
 """
-import collections
 import hashlib
+import threading
+import time
 from json import JSONDecodeError
-from typing import Dict, List
+from typing import Dict, Iterable, List, TextIO
 
-from merci.fetchers import ConfigurationFetcher
-from merci.metrics import ConfigurationReaderMetrics
+from merci.caches import ContentCache
+
+from merci.fetchers import ConfigurationFetcher, FetchCoalescer, FetchedFile
+from merci.metrics import ConfigurationReaderMetrics, RefreshPhases
 from merci.structure import Configuration, Context
 from merci.managers import ConfigurationStoreUpdater
-from merci.deserialization import ConfigurationMapper
+from merci.deserialization import ConfigurationMapper, InstantiationException
+from merci.tracing import RefreshTracer, NO_OP_TRACER
 
 
 class ConfigurationReader:
@@ -39,7 +43,10 @@ class ConfigurationReader:
                  mapper: ConfigurationMapper,
                  configuration_store: ConfigurationStoreUpdater,
                  metrics: ConfigurationReaderMetrics,
-                 maximum_skips: int):
+                 maximum_skips: int,
+                 tracer: RefreshTracer = NO_OP_TRACER,
+                 refresh_interval_seconds: float = None,
+                 content_cache: ContentCache = None):
         self.application: str = application
         self.file_names: List[str] = file_names
         self.fetcher: ConfigurationFetcher = fetcher
@@ -52,43 +59,169 @@ class ConfigurationReader:
         self.maximum_skips = maximum_skips
         # Number of same-content skips left before updating the injected configuration store. */
         self.skips_left = maximum_skips
+        self.tracer: RefreshTracer = tracer
+        # Attributes of all traced phases of this reader. */
+        self.span_attributes: Dict[str, str] = {'merci.application': application}
+        # Time in seconds between executions of this reader, or None for the refresh interval of the loader. */
+        self.refresh_interval_seconds = refresh_interval_seconds
+        # Serializes executions, i.e. of a slow initial load in the background and a scheduled refresh. */
+        self.execution_lock = threading.Lock()
+        # Cache of last-known-good content, or None. */
+        self.content_cache: ContentCache = content_cache
+        # True once the configuration store was updated, from fetched or cached content. */
+        self.store_loaded = False
+        # Configurations by name, per file name of the content in the configuration store. */
+        self.file_configurations: Dict[str, Dict[str, Configuration]] = {}
+        # Fingerprints of files, that configurations in the configuration store were parsed from, by file name. */
+        self.file_fingerprints: Dict[str, bytes] = {}
 
-    def execute(self):
-        """ Execute fetch, parse and store of configurations. """
-        digest = hashlib.sha256()
-        content_map: Dict[str, str] = self.fetcher.fetch_files(
-            self.application, self.file_names)
-        ordered_content_map: Dict[str, str] = collections.OrderedDict(
-            sorted(content_map.items()))
-        for file_name, content in ordered_content_map.items():
-            digest.update(bytes(file_name, 'UTF-8'))
-            digest.update(bytes(content, 'UTF-8'))
-        latest_hash: bytes = digest.digest()
-        if self.skips_left > 0 and self.previous_hash == latest_hash:
+    def execute(self, coalescer: FetchCoalescer = None) -> bool:
+        """
+        Execute fetch, parse and store of configurations. In case of failure, configurations are loaded from
+        the content cache, unless the configuration store was already loaded.
+        :param coalescer: coalescer of fetches shared with other readers, or None to fetch on its own
+        :return: True, if the fetched content differs from the content of the previous execution
+        """
+        with self.execution_lock, self.tracer.span(RefreshPhases.READ, self.span_attributes):
+            try:
+                return self.__execute(coalescer or FetchCoalescer())
+            except (IOError, InstantiationException):
+                if not self.store_loaded:
+                    self.__load_cached_content()
+                raise
+
+    def load_cached_content(self) -> bool:
+        """
+        Update configuration store with content from the content cache, unless the store was already loaded.
+        :return: True, if cached content was loaded
+        """
+        with self.execution_lock:
+            if self.store_loaded:
+                return False
+            return self.__load_cached_content()
+
+    def __execute(self, coalescer: FetchCoalescer) -> bool:
+        start = time.perf_counter()
+        with self.tracer.span(RefreshPhases.FETCH, self.span_attributes):
+            fetched_files: Dict[str, FetchedFile] = coalescer.fetch_files(
+                self.fetcher, self.application, self.file_names)
+        self.metrics.observe_duration(RefreshPhases.FETCH, time.perf_counter() - start)
+        latest_hash: bytes = self.__content_hash(fetched_files.values())
+        changed = self.previous_hash != latest_hash
+        if self.skips_left > 0 and not changed:
             self.skips_left -= 1
             self.metrics.increment_same_content_skips()
+        elif not changed:
+            self.metrics.increment_forced_refreshes()
+            self.__refresh_configuration_store()
+            self.skips_left = self.maximum_skips
         else:
             self.metrics.increment_new_content_updates()
-            self.__update_configuration_store(content_map)
+            self.__update_configuration_store(fetched_files)
             self.previous_hash = latest_hash
             self.skips_left = self.maximum_skips
+            if self.content_cache is not None:
+                self.__store_cached_content({file_name: fetched_file.open_stream()
+                                             for file_name, fetched_file in fetched_files.items()})
+        return changed
+
+    def __content_hash(self, fetched_files: Iterable[FetchedFile]) -> bytes:
+        """ Return hash of the fingerprints of all files, independent of the order of files. """
+        digest = hashlib.sha256()
+        with self.tracer.span(RefreshPhases.HASH, self.span_attributes):
+            for fetched_file in sorted(fetched_files, key=lambda fetched: fetched.file_name):
+                file_start = time.perf_counter()
+                digest.update(fetched_file.fingerprint())
+                self.metrics.observe_duration(RefreshPhases.HASH, time.perf_counter() - file_start,
+                                              fetched_file.file_name)
+        return digest.digest()
 
-    def __update_configuration_store(self, content_map: Dict[str, str]):
-        """ Parse configuration content and Update configuration store with latest values. """
+    def __store_cached_content(self, content_map: Dict[str, TextIO]):
+        """ Persist successfully applied content. Failures only cost the fallback, so they are just counted. """
+        try:
+            self.content_cache.store(self.application, self.mapper.root, self.file_names, content_map)
+        except OSError:
+            self.metrics.increment_cache_failures()
+
+    def __load_cached_content(self) -> bool:
+        """ Update configuration store with cached content, if there is valid cached content. """
+        if self.content_cache is None:
+            return False
+        try:
+            content_map = self.content_cache.load(self.application, self.mapper.root, self.file_names)
+            if content_map is None:
+                return False
+            fetched_files = {file_name: FetchedFile(file_name, content) for file_name, content in content_map.items()}
+            self.__update_configuration_store(fetched_files)
+        except (IOError, InstantiationException):
+            self.metrics.increment_cache_failures()
+            return False
+        self.previous_hash = self.__content_hash(fetched_files.values())
+        self.metrics.increment_cache_loads()
+        return True
+
+    def __update_configuration_store(self, fetched_files: Dict[str, FetchedFile]):
+        """
+        Parse configuration content and Update configuration store with latest values. Only files, that changed
+        since the latest update, are parsed. Configurations of unchanged files are reused.
+        """
+        file_configurations: Dict[str, Dict[str, Configuration]] = {}
+        file_fingerprints: Dict[str, bytes] = {}
+        num_content_failures = 0
+        num_parse_cache_hits = 0
+        # compiled files are only kept for forced refreshes, once all files were applied to the store
+        self.mapper.begin_update()
+        try:
+            for file_name, fetched_file in fetched_files.items():
+                fingerprint = fetched_file.fingerprint()
+                file_fingerprints[file_name] = fingerprint
+                if self.file_fingerprints.get(file_name) == fingerprint and file_name in self.file_configurations:
+                    file_configurations[file_name] = self.file_configurations[file_name]
+                    num_parse_cache_hits += 1
+                    continue
+                try:
+                    file_configurations[file_name] = self.mapper.read_file(fetched_file)
+                except (JSONDecodeError, IOError):
+                    num_content_failures += 1
+            self.metrics.increment_content_failures(num_content_failures)
+            if num_content_failures > 0:
+                raise IOError("Bad configuration content.")
+            self.metrics.increment_parse_cache_hits(num_parse_cache_hits)
+            self.__set_configuration_store(file_configurations)
+        except BaseException:
+            self.mapper.abort_update()
+            raise
+        self.mapper.commit_update()
+        self.file_fingerprints = file_fingerprints
+
+    def __refresh_configuration_store(self):
+        """
+        Update configuration store for same content, re-instantiating only volatile configurations and
+        configurations of reloaded classes. Keeps the configuration store, if no configuration changed.
+        """
+        file_configurations: Dict[str, Dict[str, Configuration]] = dict(self.file_configurations)
+        changed = False
+        for file_name in self.file_configurations:
+            configurations = self.mapper.refresh_values(file_name)
+            if configurations is not None:
+                file_configurations[file_name] = configurations
+                changed = True
+        if changed:
+            self.__set_configuration_store(file_configurations)
+
+    def __set_configuration_store(self, file_configurations: Dict[str, Dict[str, Configuration]]):
+        """ Merge configurations of all files, in order of files, and update configuration store. """
         configuration_cache: Dict[str, Configuration] = {}
         num_configurations = 0
-        num_content_failures = 0
-        for content in content_map.values():
-            try:
-                configurations: Dict[str, Context] = self.mapper.read_value(content)
-                num_configurations += len(configurations)
-                configuration_cache.update(configurations)
-            except (JSONDecodeError, IOError):
-                num_content_failures += 1
-        self.metrics.increment_content_failures(num_content_failures)
-        if num_content_failures > 0:
-            raise IOError("Bad configuration content.")
+        for configurations in file_configurations.values():
+            num_configurations += len(configurations)
+            configuration_cache.update(configurations)
         self.metrics.increment_name_duplicates(num_configurations -
                                                len(configuration_cache))
         self.metrics.increment_updates(len(configuration_cache))
-        self.configuration_store.set_configuration_store(configuration_cache)
+        start = time.perf_counter()
+        with self.tracer.span(RefreshPhases.STORE, self.span_attributes):
+            self.configuration_store.set_configuration_store(configuration_cache)
+        self.file_configurations = file_configurations
+        self.store_loaded = True
+        self.metrics.observe_duration(RefreshPhases.STORE, time.perf_counter() - start)
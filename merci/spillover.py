@@ -0,0 +1,191 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Disk-backed spillover of huge contexts maps of modifiers, i.e. of feature flags, that override values for many
+individual tenants or users.
+
+Sample code on how to use a spill store:
+
+merci: Merci = Merci(fetcher)
+merci.set_spill_store(SpillStore("/var/tmp/myapp", min_contexts=10000, cache_size=4096))
+"""
+import collections
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import weakref
+from typing import Callable, Dict, Iterator, List, Optional
+
+from merci.structure import LazyContexts, RuntimeEvaluator
+
+# Marks context values, that are not in the in-memory cache of spilled contexts.
+_NOT_CACHED = object()
+
+
+class SpillStore:
+    """
+    On-disk key-value index of sub-contexts, for contexts maps of modifiers with at least a minimum number of
+    entries. Maps are written at load time as the JSON trees of their sub-contexts, which are decoded on first
+    use and kept in a bounded in-memory LRU cache of hot entries. The index is a temporary SQLite database, that
+    is only valid for the lifetime of the process. Its file is unlinked right after it was opened, where the
+    platform allows it, so that it is removed, once the process ends. Rows of maps, that are no longer
+    referenced, i.e. after a refresh, are deleted with the next spilled map.
+    """
+    def __init__(self, directory: str = None, min_contexts: int = 10000, cache_size: int = 1024):
+        """
+        Initialize spill store.
+        :param directory: directory of the temporary index file, or None for the default temporary directory
+        :param min_contexts: minimum number of entries of contexts maps, that are spilled to disk
+        :param cache_size: maximum number of decoded sub-contexts kept in memory per spilled contexts map
+        """
+        self.min_contexts = min_contexts
+        self.cache_size = cache_size
+        # Path of the index file, or None once it was unlinked. */
+        self.path: Optional[str] = None
+        file_descriptor, self.path = tempfile.mkstemp(prefix='merci-spill-', suffix='.sqlite', dir=directory)
+        os.close(file_descriptor)
+        # the index is rebuilt at load time, so it does not need to survive crashes
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode = OFF')
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.execute('CREATE TABLE contexts (map_id INTEGER, context_value TEXT, tree TEXT,'
+                                ' PRIMARY KEY (map_id, context_value)) WITHOUT ROWID')
+        try:
+            # without a journal, the open connection is the only user of the file
+            os.unlink(self.path)
+            self.path = None
+        except OSError:
+            # i.e. on Windows, the file is deleted on close
+            pass
+        self.lock = threading.Lock()
+        self.next_map_id = 0
+        # Ids of maps, that are no longer referenced, appended by finalizers without taking the lock. */
+        self.released_map_ids = collections.deque()
+
+    def spill(self, trees: Dict[str, object], decode: Callable[[object], RuntimeEvaluator]) -> 'SpilledContexts':
+        """
+        Write contexts map to disk.
+        :param trees: JSON trees of sub-contexts by context value
+        :param decode: function, that decodes the JSON tree of a sub-context
+        :return: spilled contexts, that load sub-contexts on demand
+        """
+        with self.lock:
+            self.__delete_released()
+            map_id = self.next_map_id
+            self.next_map_id += 1
+            self.connection.execute('BEGIN')
+            try:
+                self.connection.executemany('INSERT INTO contexts VALUES (?, ?, ?)',
+                                            ((map_id, context_value, json.dumps(tree))
+                                             for context_value, tree in trees.items()))
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+        return SpilledContexts(_SpilledMap(self, map_id, len(trees)), decode, self.cache_size)
+
+    def load(self, map_id: int, context_value: str) -> Optional[str]:
+        """ Return JSON text of sub-context of provided map and context value, or None if there is none. """
+        with self.lock:
+            row = self.connection.execute('SELECT tree FROM contexts WHERE map_id = ? AND context_value = ?',
+                                          (map_id, context_value)).fetchone()
+        return None if row is None else row[0]
+
+    def context_values(self, map_id: int) -> List[str]:
+        """ Return context values of provided map. """
+        with self.lock:
+            rows = self.connection.execute('SELECT context_value FROM contexts WHERE map_id = ?',
+                                           (map_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def release(self, map_id: int):
+        """ Mark provided map as no longer referenced, so that its rows are deleted. """
+        self.released_map_ids.append(map_id)
+
+    def close(self):
+        """ Close and delete the index. Spilled contexts must not be used afterwards. """
+        with self.lock:
+            self.connection.close()
+        if self.path is not None:
+            os.unlink(self.path)
+            self.path = None
+
+    def __delete_released(self):
+        while self.released_map_ids:
+            self.connection.execute('DELETE FROM contexts WHERE map_id = ?', (self.released_map_ids.popleft(),))
+
+
+class _SpilledMap:
+    """ Rows of a contexts map in a spill store, that are released, once no spilled contexts refer to them. """
+    def __init__(self, store: SpillStore, map_id: int, size: int):
+        self.store = store
+        self.map_id = map_id
+        self.size = size
+        weakref.finalize(self, store.release, map_id)
+
+
+class SpilledContexts(LazyContexts):
+    """
+    Contexts map of modifiers, that is stored in a spill store and loads sub-contexts on demand. Lookups, like
+    those of a dict, return the same sub-context objects while they are cached, and None for missing context
+    values, which are cached as well, since most runtime context values are usually not overridden.
+    """
+    def __init__(self, spilled_map: _SpilledMap, decode: Callable[[object], RuntimeEvaluator], cache_size: int):
+        self.spilled_map = spilled_map
+        self.decode = decode
+        self.cache_size = cache_size
+        # Decoded sub-contexts, or None for missing ones, by context value, in order of last use. */
+        self.cache: Dict[str, Optional[RuntimeEvaluator]] = collections.OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    def get(self, context_value: str, default: object = None) -> object:
+        if not isinstance(context_value, str):
+            # keys of JSON objects are always strings
+            return default
+        with self.cache_lock:
+            context = self.cache.get(context_value, _NOT_CACHED)
+            if context is not _NOT_CACHED:
+                self.cache.move_to_end(context_value)
+                return default if context is None else context
+        tree = self.spilled_map.store.load(self.spilled_map.map_id, context_value)
+        context = None if tree is None else self.decode(json.loads(tree))
+        with self.cache_lock:
+            # a concurrent load of the same context value is replaced, both are equivalent
+            self.cache[context_value] = context
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return default if context is None else context
+
+    def __getitem__(self, context_value: str) -> RuntimeEvaluator:
+        context = self.get(context_value)
+        if context is None:
+            raise KeyError(context_value)
+        return context
+
+    def __contains__(self, context_value: object) -> bool:
+        return self.get(context_value) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.spilled_map.store.context_values(self.spilled_map.map_id))
+
+    def __len__(self) -> int:
+        return self.spilled_map.size
+
+    def map_contexts(self, function: Callable[[RuntimeEvaluator], RuntimeEvaluator]) -> 'SpilledContexts':
+        decode = self.decode
+        return SpilledContexts(self.spilled_map, lambda tree: function(decode(tree)), self.cache_size)
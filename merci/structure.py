@@ -16,8 +16,80 @@
 """
 Core classes for feature flag and config evaluation.
 """
+import bisect
+import math
+import sys
+import zlib
 from abc import abstractmethod, ABC
-from typing import Dict, Optional
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class RuntimeContext(Mapping):
+    """
+    Immutable runtime context, that can be used instead of a dictionary of context values in all evaluations.
+    Build it once per request, or once per set of context values, and reuse it for all lookups: context types are
+    interned like the context types of modifiers, get() is the lookup of the underlying dictionary without any
+    Python-level call, and the hash is precomputed, so that caches of evaluations can use it as key in O(1).
+    """
+    __slots__ = ('_values', '_signature', '_hash', 'get')
+
+    def __init__(self, values: Optional[Dict[str, str]] = None, **kwargs: str):
+        """
+        Initialize runtime context.
+        :param values: dictionary with context values, i.e. {'environment': 'qa'}
+        :param kwargs: further context values
+        """
+        items = dict(values or {}, **kwargs)
+        values = MappingProxyType({sys.intern(context_type): value for context_type, value in items.items()})
+        signature = tuple(sorted(values.items()))
+        # attributes are only set here, so that the precomputed signature and hash always match the values
+        object.__setattr__(self, '_values', values)
+        # bound lookup of the read-only view, as fast as for a plain dictionary of context values
+        object.__setattr__(self, 'get', values.get)
+        object.__setattr__(self, '_signature', signature)
+        object.__setattr__(self, '_hash', hash(signature))
+
+    def __setattr__(self, name: str, value: object):
+        raise AttributeError('RuntimeContext is immutable.')
+
+    def __delattr__(self, name: str):
+        raise AttributeError('RuntimeContext is immutable.')
+
+    @property
+    def signature(self) -> Tuple[Tuple[str, str], ...]:
+        """ Context values as a tuple of (context type, context value) pairs, sorted by context type. """
+        return self._signature
+
+    def with_values(self, values: Dict[str, str]) -> 'RuntimeContext':
+        """ Return new runtime context with provided context values added or replaced. """
+        return RuntimeContext(dict(self._values, **values))
+
+    def __getitem__(self, context_type: str) -> str:
+        return self._values[context_type]
+
+    def __contains__(self, context_type: object) -> bool:
+        return context_type in self._values
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, RuntimeContext):
+            return self._hash == other._hash and self._signature == other._signature
+        if isinstance(other, Mapping):
+            return self._values == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return 'RuntimeContext(' + repr(dict(self._values)) + ')'
 
 
 class RuntimeEvaluator(ABC):
@@ -30,6 +102,23 @@ class RuntimeEvaluator(ABC):
         :return: config value object
         """
 
+    def partially_evaluate(self, static_context: Dict[str, str]) -> Optional['RuntimeEvaluator']:
+        """
+        Evaluate hierarchy of configuration objects against context values, that are fixed for the lifetime of
+        the process, and return an equivalent hierarchy, that only depends on the remaining (dynamic) context types.
+        :param static_context: dictionary with static context values
+        :return: pruned runtime evaluator, or None if the hierarchy can never provide a value
+        """
+        return self
+
+    def trace_value(self, runtime_context: Dict[str, str]) -> Tuple[object, int, bool]:
+        """
+        Evaluate hierarchy like get_value, and also return how the value was found, i.e. for statistics.
+        :param runtime_context:  dictionary with context values
+        :return: config value object, number of modifiers levels walked, and True if the value is an override
+        """
+        return self.get_value(runtime_context), 0, False
+
 
 class Context(RuntimeEvaluator):
     """
@@ -68,8 +157,94 @@ class Context(RuntimeEvaluator):
                 return modifiers_value
         return self.value
 
+    def trace_value(self, runtime_context: Dict[str, str]) -> Tuple[object, int, bool]:
+        if self.modifiers is None:
+            return self.value, 0, False
+        modifiers_value, depth, _ = self.modifiers.trace_value(runtime_context)
+        if modifiers_value is not None:
+            return modifiers_value, depth, True
+        return self.value, depth, False
 
-class Modifiers(RuntimeEvaluator):
+    def partially_evaluate(self, static_context: Dict[str, str]) -> RuntimeEvaluator:
+        if self.modifiers is None:
+            return self
+        modifiers = self.modifiers.partially_evaluate(static_context)
+        if modifiers is None:
+            return Context(self.value)
+        if isinstance(modifiers, Context) and modifiers.value is not None:
+            # a static level always resolves to the same sub-context, which always overrides this value
+            return modifiers
+        return Context(self.value, modifiers)
+
+
+class MatchingModifiers(RuntimeEvaluator):
+    """
+    Base class for override hierarchies, that select at most one sub-context by matching the runtime
+    context value of a single context type, i.e. 'environment' or 'user'.
+    """
+    def __init__(self, context_type: str):
+        self.context_type: str = sys.intern(context_type)
+
+    @abstractmethod
+    def find_context(self, context_value: str) -> Optional[RuntimeEvaluator]:
+        """
+        Return sub-context matching provided context value.
+        :param context_value: runtime context value for the context type of this modifiers
+        :return: matching sub-context or None
+        """
+
+    @abstractmethod
+    def map_contexts(self, function: Callable[[RuntimeEvaluator], RuntimeEvaluator]) -> 'MatchingModifiers':
+        """
+        Return new modifiers of the same kind, with each sub-context replaced by the result of provided function.
+        :param function: function to be applied to each sub-context
+        :return: new modifiers
+        """
+
+    def get_value(self, runtime_context: Dict[str, str]) -> object:
+        runtime_context_value = runtime_context.get(self.context_type)
+        if runtime_context_value is None:
+            return None
+        context = self.find_context(runtime_context_value)
+        if context is None:
+            return None
+        return context.get_value(runtime_context)
+
+    def trace_value(self, runtime_context: Dict[str, str]) -> Tuple[object, int, bool]:
+        runtime_context_value = runtime_context.get(self.context_type)
+        if runtime_context_value is None:
+            return None, 1, False
+        context = self.find_context(runtime_context_value)
+        if context is None:
+            return None, 1, False
+        value, depth, _ = context.trace_value(runtime_context)
+        return value, depth + 1, False
+
+    def partially_evaluate(self, static_context: Dict[str, str]) -> Optional[RuntimeEvaluator]:
+        if self.context_type in static_context:
+            # collapse level, only the sub-context of the static context value can ever be reached
+            context = self.find_context(static_context[self.context_type])
+            if context is None:
+                return None
+            return context.partially_evaluate(static_context)
+        return self.map_contexts(lambda context: context.partially_evaluate(static_context))
+
+
+class LazyContexts(Mapping):
+    """
+    Sub-contexts of modifiers by context value, that are loaded on demand instead of being kept in memory, i.e.
+    from a disk-backed index for contexts maps of many individual tenants or users.
+    """
+    @abstractmethod
+    def map_contexts(self, function: Callable[[RuntimeEvaluator], RuntimeEvaluator]) -> 'LazyContexts':
+        """
+        Return lazy contexts, that apply the provided function to each sub-context when it is loaded.
+        :param function: function, that maps a sub-context, i.e. partial evaluation against static context values
+        :return: lazy contexts with mapped sub-contexts
+        """
+
+
+class Modifiers(MatchingModifiers):
     """
     A configuration modifiers is an override hierarchy in the definition of a configuration.
 
@@ -92,9 +267,10 @@ class Modifiers(RuntimeEvaluator):
         }
     }
     """
-    def __init__(self, context_type, contexts: Dict[str, RuntimeEvaluator]):
-        self.context_type: str = context_type  # i.e. 'environment'
-        self.contexts: Dict[str, RuntimeEvaluator] = contexts
+    def __init__(self, context_type, contexts: Mapping):
+        super().__init__(context_type)  # i.e. 'environment'
+        # Sub-contexts by context value, a dict or lazy contexts. */
+        self.contexts: Mapping = contexts
 
     def get_value(self, runtime_context: Dict[str, str]) -> object:
         runtime_context_value = runtime_context.get(self.context_type)
@@ -105,6 +281,329 @@ class Modifiers(RuntimeEvaluator):
             return None
         return context.get_value(runtime_context)
 
+    def find_context(self, context_value: str) -> Optional[RuntimeEvaluator]:
+        return self.contexts.get(context_value, None)
+
+    def map_contexts(self, function: Callable[[RuntimeEvaluator], RuntimeEvaluator]) -> 'Modifiers':
+        if isinstance(self.contexts, LazyContexts):
+            # sub-contexts are mapped on load, so that lazy contexts are not all loaded into memory at once
+            return Modifiers(self.context_type, self.contexts.map_contexts(function))
+        contexts: Dict[str, RuntimeEvaluator] = {}
+        for context_value, context in self.contexts.items():
+            contexts[context_value] = function(context)
+        return Modifiers(self.context_type, contexts)
+
+
+class PercentageModifiers(MatchingModifiers):
+    """
+    A configuration percentage modifiers is an override hierarchy for gradual rollouts. Instead of listing
+    each runtime context value, it assigns each value to one of 10000 buckets with a stable hash, and
+    maps ranges of buckets, given as cumulative upper percentage bounds, to sub-contexts.
+
+    I.e., in the following JSON representation of a feature flag configuration, the default value (object)
+    'false' is overridden with 'true' for 10 percent of all users. Another 15 percent of users are
+    only enabled in environment 'qa'. The hash of each user is seeded with the name of the configuration,
+    unless another seed is provided, so that different rollouts select different users.
+
+    "enable-feature-one": {
+        "value": false,
+        "modifiers": {
+            "type": "user",
+            "percentages": {
+                "10": {
+                    "value": true
+                },
+                "25": {
+                    "value": false,
+                    "modifiers": {
+                        "type": "environment",
+                        "contexts": {
+                            "qa": {
+                                "value": true
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+    """
+    BUCKETS = 10000
+
+    def __init__(self, context_type: str, percentages: Dict[str, RuntimeEvaluator], seed: str = ''):
+        super().__init__(context_type)  # i.e. 'user'
+        self.percentages: Dict[str, RuntimeEvaluator] = percentages
+        self.seed: str = seed
+        # precomputed crc of seed, continued with the bytes of each runtime context value
+        self.seed_crc: int = zlib.crc32(seed.encode('utf-8'))
+        # ascending (exclusive) upper bucket bounds and the sub-contexts for the ranges below them
+        bounds = sorted(((self.__to_bucket_bound(percentage), context) for percentage, context in percentages.items()),
+                        key=lambda bound: bound[0])
+        self.bucket_bounds: List[int] = [bound for bound, _ in bounds]
+        self.bucket_contexts: List[RuntimeEvaluator] = [context for _, context in bounds]
+        if len(set(self.bucket_bounds)) != len(self.bucket_bounds):
+            raise ValueError('Duplicate percentage in percentage modifiers for type ' + context_type + '.')
+
+    @classmethod
+    def __to_bucket_bound(cls, percentage: str) -> int:
+        bound = round(float(percentage) * cls.BUCKETS / 100)
+        if bound <= 0 or bound > cls.BUCKETS:
+            raise ValueError('Percentage ' + percentage + ' is not within (0, 100].')
+        return bound
+
+    def bucket(self, context_value: str) -> int:
+        """
+        Return stable bucket in [0, 10000) for provided context value. The hash is a CRC-32 of seed and value,
+        finalized with the MurmurHash3 mixing steps, so that it is identical across processes and hosts.
+        :param context_value: runtime context value, i.e. name of user
+        :return: bucket of context value
+        """
+        hash_value = zlib.crc32(context_value.encode('utf-8'), self.seed_crc)
+        hash_value ^= hash_value >> 16
+        hash_value = (hash_value * 0x85ebca6b) & 0xffffffff
+        hash_value ^= hash_value >> 13
+        hash_value = (hash_value * 0xc2b2ae35) & 0xffffffff
+        hash_value ^= hash_value >> 16
+        return hash_value % self.BUCKETS
+
+    def find_context(self, context_value: str) -> Optional[RuntimeEvaluator]:
+        index = bisect.bisect_right(self.bucket_bounds, self.bucket(context_value))
+        if index < len(self.bucket_contexts):
+            return self.bucket_contexts[index]
+        return None
+
+    def map_contexts(self, function: Callable[[RuntimeEvaluator], RuntimeEvaluator]) -> 'PercentageModifiers':
+        percentages: Dict[str, RuntimeEvaluator] = {}
+        for percentage, context in self.percentages.items():
+            percentages[percentage] = function(context)
+        return PercentageModifiers(self.context_type, percentages, self.seed)
+
+
+class SetModifiers(MatchingModifiers):
+    """
+    A configuration set modifiers is an override hierarchy, that maps sets of runtime context values to
+    sub-contexts. Members are indexed in a single dictionary, the first set containing the value wins.
+
+    I.e., in the following JSON representation of a feature flag configuration, the default value (object)
+    'false' is overridden with 'true' for all listed tenants.
+
+    "enable-feature-one": {
+        "value": false,
+        "modifiers": {
+            "type": "tenant",
+            "sets": [
+                {
+                    "members": ["acme", "globex", "initech"],
+                    "context": {
+                        "value": true
+                    }
+                }
+            ]
+        }
+    }
+    """
+    def __init__(self, context_type: str, sets: List[Tuple[Iterable[str], RuntimeEvaluator]]):
+        super().__init__(context_type)  # i.e. 'tenant'
+        # Sub-context of the first set containing each member, by member. Sets are not kept besides. */
+        self.member_contexts: Dict[str, RuntimeEvaluator] = {}
+        for members, context in sets:
+            for member in members:
+                self.member_contexts.setdefault(member, context)
+
+    def find_context(self, context_value: str) -> Optional[RuntimeEvaluator]:
+        return self.member_contexts.get(context_value, None)
+
+    def map_contexts(self, function: Callable[[RuntimeEvaluator], RuntimeEvaluator]) -> 'SetModifiers':
+        # members are grouped by their sub-context, which keeps the first set winning for each member
+        members_by_context: Dict[int, Tuple[RuntimeEvaluator, List[str]]] = {}
+        for member, context in self.member_contexts.items():
+            members_by_context.setdefault(id(context), (context, []))[1].append(member)
+        return SetModifiers(self.context_type, [(members, function(context))
+                                                for context, members in members_by_context.values()])
+
+
+class RangeModifiers(MatchingModifiers):
+    """
+    A configuration range modifiers is an override hierarchy, that maps non-overlapping ranges of numeric or
+    semantic version context values to sub-contexts. Each range includes its lower bound 'from' and excludes
+    its upper bound 'to', both are optional. Ranges are looked up with a binary search over their lower bounds.
+
+    I.e., in the following JSON representation of a feature flag configuration, the default value (object)
+    'false' is overridden with 'true' for all client versions from 3.2 up to, but excluding 4.0. Version
+    comparison ignores pre-release and build suffixes, and trailing zeros, so that '3.2' equals '3.2.0'.
+
+    "enable-feature-one": {
+        "value": false,
+        "modifiers": {
+            "type": "client-version",
+            "comparison": "semver",
+            "ranges": [
+                {
+                    "from": "3.2",
+                    "to": "4.0",
+                    "context": {
+                        "value": true
+                    }
+                }
+            ]
+        }
+    }
+    """
+    NUMERIC = 'numeric'
+    SEMVER = 'semver'
+
+    def __init__(self, context_type: str, ranges: List[Tuple[Optional[str], Optional[str], RuntimeEvaluator]],
+                 comparison: str = NUMERIC):
+        super().__init__(context_type)  # i.e. 'client-version'
+        if comparison == self.NUMERIC:
+            self.to_key: Callable[[str], object] = RangeModifiers.numeric_key
+            lowest = float('-inf')
+        elif comparison == self.SEMVER:
+            self.to_key = RangeModifiers.semver_key
+            lowest = ()
+        else:
+            raise ValueError('Unknown comparison ' + str(comparison) + ' in range modifiers for type ' + context_type + '.')
+        self.comparison: str = comparison
+        self.ranges: List[Tuple[Optional[str], Optional[str], RuntimeEvaluator]] = list(ranges)
+        bounds = sorted(((lowest if start is None else self.to_key(str(start)),
+                          None if end is None else self.to_key(str(end)),
+                          context) for start, end, context in self.ranges),
+                        key=lambda bound: bound[0])
+        # ascending lower bounds, and upper bounds (None if unbounded) and sub-contexts of the same ranges
+        self.starts: List[object] = [start for start, _, _ in bounds]
+        self.ends: List[object] = [end for _, end, _ in bounds]
+        self.contexts: List[RuntimeEvaluator] = [context for _, _, context in bounds]
+        for index, (start, end) in enumerate(zip(self.starts, self.ends)):
+            if end is not None and not start < end:
+                raise ValueError('Empty range in range modifiers for type ' + context_type + '.')
+            if index + 1 < len(self.starts) and (end is None or self.starts[index + 1] < end):
+                raise ValueError('Overlapping ranges in range modifiers for type ' + context_type + '.')
+
+    @staticmethod
+    def numeric_key(number: str) -> float:
+        """
+        Return comparable key of a finite number, i.e. 0.5 for '0.5'.
+        :param number: number
+        :return: number as float
+        :raises ValueError: for numbers, that are not finite, like 'nan' or 'inf', which no range can contain
+        """
+        key = float(number)
+        if not math.isfinite(key):
+            raise ValueError('Not a finite number: ' + number)
+        return key
+
+    @staticmethod
+    def semver_key(version: str) -> Tuple[int, ...]:
+        """
+        Return comparable key of semantic version, i.e. (3, 2, 1) for '3.2.1-beta'.
+        :param version: semantic version
+        :return: tuple of version numbers without trailing zeros
+        """
+        numbers = [int(number) for number in version.split('-', 1)[0].split('+', 1)[0].split('.')]
+        while numbers and numbers[-1] == 0:
+            numbers.pop()
+        return tuple(numbers)
+
+    def find_context(self, context_value: str) -> Optional[RuntimeEvaluator]:
+        try:
+            key = self.to_key(context_value)
+        except ValueError:
+            return None
+        index = bisect.bisect_right(self.starts, key) - 1
+        if index < 0:
+            return None
+        end = self.ends[index]
+        if end is not None and not key < end:
+            return None
+        return self.contexts[index]
+
+    def map_contexts(self, function: Callable[[RuntimeEvaluator], RuntimeEvaluator]) -> 'RangeModifiers':
+        return RangeModifiers(self.context_type, [(start, end, function(context)) for start, end, context in self.ranges],
+                              self.comparison)
+
+
+class PrefixModifiers(MatchingModifiers):
+    """
+    A configuration prefix modifiers is an override hierarchy, that maps prefixes of runtime context values
+    to sub-contexts. Prefixes are stored in a trie, the longest matching prefix wins.
+
+    I.e., in the following JSON representation of a feature flag configuration, the default value (object)
+    'false' is overridden with 'true' for all hosts starting with 'db-', except for hosts starting with 'db-eu-'.
+
+    "enable-feature-one": {
+        "value": false,
+        "modifiers": {
+            "type": "host",
+            "prefixes": {
+                "db-": {
+                    "value": true
+                },
+                "db-eu-": {
+                    "value": false
+                }
+            }
+        }
+    }
+    """
+    # key of the sub-context in a trie node, which cannot collide with the single-character keys of child nodes
+    TERMINAL = ''
+
+    def __init__(self, context_type: str, prefixes: Dict[str, RuntimeEvaluator]):
+        super().__init__(context_type)  # i.e. 'host'
+        self.prefixes: Dict[str, RuntimeEvaluator] = prefixes
+        self.trie: Dict[str, object] = {}
+        for prefix, context in prefixes.items():
+            node = self.trie
+            for character in self._characters(prefix):
+                node = node.setdefault(character, {})
+            node[self.TERMINAL] = context
+
+    # noinspection PyMethodMayBeStatic
+    def _characters(self, context_value: str) -> Iterable[str]:
+        """ Return characters of context value in the order they are stored in the trie. """
+        return context_value
+
+    def find_context(self, context_value: str) -> Optional[RuntimeEvaluator]:
+        node = self.trie
+        context = node.get(self.TERMINAL, None)
+        for character in self._characters(context_value):
+            node = node.get(character, None)
+            if node is None:
+                break
+            context = node.get(self.TERMINAL, context)
+        return context
+
+    def map_contexts(self, function: Callable[[RuntimeEvaluator], RuntimeEvaluator]) -> 'PrefixModifiers':
+        prefixes: Dict[str, RuntimeEvaluator] = {}
+        for prefix, context in self.prefixes.items():
+            prefixes[prefix] = function(context)
+        return type(self)(self.context_type, prefixes)
+
+
+class SuffixModifiers(PrefixModifiers):
+    """
+    A configuration suffix modifiers is an override hierarchy, that maps suffixes of runtime context values
+    to sub-contexts. Suffixes are stored reversed in a trie, the longest matching suffix wins.
+
+    I.e., in the following JSON representation of a feature flag configuration, the default value (object)
+    'false' is overridden with 'true' for all hosts in domain 'qa.example.com'.
+
+    "enable-feature-one": {
+        "value": false,
+        "modifiers": {
+            "type": "host",
+            "suffixes": {
+                ".qa.example.com": {
+                    "value": true
+                }
+            }
+        }
+    }
+    """
+    # noinspection PyMethodMayBeStatic
+    def _characters(self, context_value: str) -> Iterable[str]:
+        return reversed(context_value)
+
 
 class Configuration(RuntimeEvaluator):
     """
@@ -127,3 +626,9 @@ class Configuration(RuntimeEvaluator):
 
     def get_value(self, runtime_context: Dict[str, str]) -> object:
         return self.context.get_value(runtime_context)
+
+    def trace_value(self, runtime_context: Dict[str, str]) -> Tuple[object, int, bool]:
+        return self.context.trace_value(runtime_context)
+
+    def partially_evaluate(self, static_context: Dict[str, str]) -> RuntimeEvaluator:
+        return Configuration(self.name, self.context.partially_evaluate(static_context))
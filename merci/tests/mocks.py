@@ -0,0 +1,29 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Mocks shared by unit tests.
+"""
+from mockito import mock, when
+
+from merci.fetchers import ConfigurationFetcher
+
+
+def mock_fetcher() -> ConfigurationFetcher:
+    """ Return mock of a configuration fetcher, whose fetch_raw_files wraps the stubbed fetch_files. """
+    fetcher = mock(ConfigurationFetcher)
+    when(fetcher).fetch_raw_files(...).thenAnswer(
+        lambda application, file_names: ConfigurationFetcher.fetch_raw_files(fetcher, application, file_names))
+    return fetcher
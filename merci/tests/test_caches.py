@@ -0,0 +1,135 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Unit tests for content cache.
+"""
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from mockito import when
+
+from merci.caches import ContentCache
+from merci.deserialization import ConfigurationMapper, SingleValueDecoderFactory
+from merci.fetchers import ConfigurationFetcher, FetchedFile
+from merci.managers import ConfigurationManager, FeatureFlagManager
+from merci.metrics import ConfigurationManagerMetrics
+from merci.readers import ConfigurationReader
+from merci.tests.mocks import mock_fetcher
+
+
+class TestContentCache(unittest.TestCase):
+    """ Unit tests for content cache. """
+
+    features = '/features.json'
+    enable_all = '{ "feature-flags": { "enable-all": { "value": true } } }'
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ContentCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_store_and_load(self):
+        self.assertIsNone(self.cache.load('mini-app', 'feature-flags', [self.features]))
+
+        self.cache.store('../mini-app', 'feature-flags', [self.features], {self.features: self.enable_all})
+        self.cache.store('../mini-app', 'feature-flags', [self.features], {self.features: '{}'})
+
+        self.assertEqual({self.features: '{}'}, self.cache.load('../mini-app', 'feature-flags', [self.features]))
+        path = self.cache.path('../mini-app', 'feature-flags', [self.features])
+        self.assertEqual(self.directory.name, os.path.dirname(os.path.dirname(path)))
+        self.assertEqual([os.path.basename(path)], os.listdir(os.path.dirname(path)))
+        self.assertTrue(os.path.basename(path).startswith('feature-flags-'))
+
+    def test_snapshot_per_file_set(self):
+        self.cache.store('mini-app', 'feature-flags', [self.features], {self.features: self.enable_all})
+        self.cache.store('mini-app', 'feature-flags', ['/other.json', self.features],
+                         {self.features: '{}', '/other.json': '{}'})
+
+        self.assertEqual({self.features: self.enable_all},
+                         self.cache.load('mini-app', 'feature-flags', [self.features]))
+        self.assertEqual({self.features: '{}', '/other.json': '{}'},
+                         self.cache.load('mini-app', 'feature-flags', [self.features, '/other.json']))
+
+    def test_store_streams_in_chunks(self):
+        self.cache.CHUNK_SIZE = 4
+        compressed = FetchedFile(self.features, compressed=gzip.compress(self.enable_all.encode('utf-8')),
+                                 compression='gzip')
+        parsed = FetchedFile('/other.json', json_tree={'configs': {'welcome': {'value': 'h\u00e9llo "\U0001F600"'}}})
+        self.cache.store('mini-app', 'feature-flags', [self.features, '/other.json'],
+                         {self.features: compressed.open_stream(), '/other.json': parsed.open_stream()})
+
+        content_map = self.cache.load('mini-app', 'feature-flags', [self.features, '/other.json'])
+        self.assertEqual(self.enable_all, content_map[self.features])
+        self.assertEqual(parsed.json_tree(), json.loads(content_map['/other.json']))
+        self.assertFalse(compressed.is_decompressed())
+        self.assertIsNone(parsed._content)
+
+    def test_corrupt_cache(self):
+        self.cache.store('mini-app', 'feature-flags', [self.features], {self.features: self.enable_all})
+        path = self.cache.path('mini-app', 'feature-flags', [self.features])
+        for corrupt_snapshot in ['{ "version": 1, "fil', '{ "version": 1 }',
+                                 '{ "version": 1, "file_names": ["/features.json"], "files": [] }',
+                                 '{ "version": 1, "file_names": ["/features.json"], "files": { "/other.json": "{}" } }',
+                                 '{ "version": 1, "file_names": ["/other.json"], "files": { } }']:
+            with open(path, 'w') as file:
+                file.write(corrupt_snapshot)
+
+            self.assertRaises(IOError, self.cache.load, 'mini-app', 'feature-flags', [self.features])
+
+    def test_reader_falls_back_to_cache(self):
+        fetcher: ConfigurationFetcher = mock_fetcher()
+        when(fetcher).fetch_files('mini-app', [self.features])\
+            .thenReturn({self.features: self.enable_all})\
+            .thenRaise(IOError('unreachable'))
+        self.create_reader(fetcher)[0].execute()
+
+        reader, feature_manager, metrics = self.create_reader(fetcher)
+        self.assertRaises(IOError, reader.execute)
+
+        self.assertEqual(True, feature_manager.is_active('enable-all', {}, False))
+        self.assertEqual(1, metrics.cache_loads)
+        self.assertEqual(0, metrics.cache_failures)
+
+    def test_reader_loads_cache_at_startup(self):
+        self.cache.store('mini-app', 'feature-flags', [self.features], {self.features: self.enable_all})
+        fetcher: ConfigurationFetcher = mock_fetcher()
+        when(fetcher).fetch_files('mini-app', [self.features]).thenReturn({self.features: self.enable_all})
+        reader, feature_manager, metrics = self.create_reader(fetcher)
+
+        self.assertTrue(reader.load_cached_content())
+        self.assertTrue(feature_manager.is_ready())
+        self.assertEqual(True, feature_manager.is_active('enable-all', {}, False))
+        self.assertFalse(reader.load_cached_content())
+
+        self.assertFalse(reader.execute())
+        self.assertEqual(1, metrics.cache_loads)
+
+    def create_reader(self, fetcher: ConfigurationFetcher):
+        metrics = ConfigurationManagerMetrics()
+        mapper = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False, metrics)
+        configuration_manager = ConfigurationManager()
+        reader = ConfigurationReader('mini-app', [self.features], fetcher, mapper, configuration_manager, metrics, 0,
+                                     content_cache=self.cache)
+        return reader, FeatureFlagManager(configuration_manager), metrics
+
+
+if __name__ == '__main__':
+    unittest.main()
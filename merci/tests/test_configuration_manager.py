@@ -16,12 +16,28 @@
 """
 Unit tests for configuration manager.
 """
+import asyncio
+import contextvars
+import gc
+import threading
 import unittest
 
-from merci.managers import ConfigurationManager, FeatureFlagManager
+from merci.managers import ConfigurationManager, ConfigManager, FeatureFlagManager, RequestScope
+from merci.metrics import EvaluationStatistics
 from merci.structure import Context, Modifiers, Configuration
 
 
+class CountingContext(Context):
+    """ Context, that counts its evaluations. """
+    def __init__(self, value, modifiers=None):
+        super().__init__(value, modifiers)
+        self.evaluations = 0
+
+    def get_value(self, runtime_context):
+        self.evaluations += 1
+        return super().get_value(runtime_context)
+
+
 class TestConfigurationManager(unittest.TestCase):
     """ Unit tests for configuration manager. """
 
@@ -62,3 +78,139 @@ class TestConfigurationManager(unittest.TestCase):
         is_welcome_enabled = feature_flag_manager.is_active("enable-welcome", self.joe_in_prod, False)
 
         self.assertFalse(is_welcome_enabled)
+
+    def test_evaluation_statistics(self):
+        configuration_manager = ConfigurationManager()
+        configuration_manager.set_configuration_store({
+            "enable-welcome": Configuration("enable-welcome", Context(False, Modifiers('environment', {'qa': Context(True)}))),
+            "enable-nothing": Configuration("enable-nothing", Context(False))})
+        statistics = EvaluationStatistics(sample_interval=3)
+        configuration_manager.set_evaluation_statistics(statistics)
+        feature_flag_manager = FeatureFlagManager(configuration_manager)
+
+        def evaluate():
+            for _ in range(60):
+                self.assertTrue(feature_flag_manager.is_active("enable-welcome", self.joe_in_qa, False))
+                self.assertFalse(feature_flag_manager.is_active("enable-welcome", self.joe_in_prod, True))
+                self.assertTrue(feature_flag_manager.is_active("enable-missing", self.joe_in_qa, True))
+
+        threads = [threading.Thread(target=evaluate) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        gc.collect()
+
+        snapshot = statistics.snapshot()
+        # statistics of ended threads are merged into retired statistics
+        self.assertEqual([], statistics._threads)
+        self.assertEqual({"enable-welcome", "enable-missing"}, set(snapshot.keys()))
+        welcome = snapshot["enable-welcome"]
+        self.assertEqual(480, welcome.calls)
+        self.assertEqual(0, welcome.missing)
+        self.assertEqual(160, welcome.samples)
+        self.assertEqual(160, welcome.latencies.count)
+        self.assertEqual(1, welcome.max_depth)
+        self.assertEqual(0.5, welcome.override_ratio())
+        self.assertEqual(1.0, welcome.mean_depth())
+        self.assertEqual(240, snapshot["enable-missing"].missing)
+        self.assertEqual(["enable-nothing"], configuration_manager.unused_configuration_names())
+
+    def test_request_scope(self):
+        configuration_manager = ConfigurationManager()
+        context = CountingContext(False, Modifiers('environment', {'qa': Context(True)}))
+        configuration_manager.set_configuration_store({"enable-welcome": Configuration("enable-welcome", context)})
+        feature_flag_manager = FeatureFlagManager(configuration_manager)
+
+        self.assertIsNone(RequestScope.current())
+        with RequestScope(self.joe_in_qa) as scope:
+            self.assertIs(scope, RequestScope.current())
+            for _ in range(10):
+                self.assertTrue(feature_flag_manager.is_active("enable-welcome", None, False))
+                self.assertTrue(feature_flag_manager.is_active("enable-welcome", self.joe_in_qa, False))
+            self.assertEqual(1, context.evaluations)
+            # other runtime contexts are evaluated as usual
+            self.assertFalse(feature_flag_manager.is_active("enable-welcome", self.joe_in_prod, True))
+            self.assertEqual(2, context.evaluations)
+            # missing configurations are not memoized
+            self.assertTrue(feature_flag_manager.is_active("enable-missing", None, True))
+            self.assertFalse(feature_flag_manager.is_active("enable-missing", None, False))
+            # the store is pinned to the generation of the first lookup
+            configuration_manager.set_configuration_store({
+                "enable-welcome": Configuration("enable-welcome", Context(False)),
+                "enable-missing": Configuration("enable-missing", Context(True))})
+            self.assertTrue(feature_flag_manager.is_active("enable-welcome", None, False))
+            self.assertFalse(feature_flag_manager.is_active("enable-missing", None, False))
+        self.assertIsNone(RequestScope.current())
+        self.assertFalse(feature_flag_manager.is_active("enable-welcome", self.joe_in_qa, True))
+        self.assertTrue(feature_flag_manager.is_active("enable-missing", self.joe_in_qa, False))
+
+    def test_request_scope_in_threads_and_tasks(self):
+        configuration_manager = ConfigurationManager()
+        for_joe = CountingContext(True)
+        for_jack = CountingContext(False)
+        context = CountingContext(False, Modifiers('user', {'joe': for_joe, 'jack': for_jack}))
+        configuration_manager.set_configuration_store({"enable-welcome": Configuration("enable-welcome", context)})
+        feature_flag_manager = FeatureFlagManager(configuration_manager)
+        results = []
+
+        def evaluate():
+            results.append(feature_flag_manager.is_active("enable-welcome", None, False))
+
+        with RequestScope(self.joe_in_qa):
+            # threads run one after another, so that only the first one evaluates
+            for _ in range(4):
+                thread = threading.Thread(target=contextvars.copy_context().run, args=[evaluate])
+                thread.start()
+                thread.join()
+        self.assertEqual([True] * 4, results)
+        self.assertEqual(1, context.evaluations)
+        self.assertEqual(1, for_joe.evaluations)
+
+        async def evaluate_in_tasks(user):
+            with RequestScope({"user": user}):
+                await asyncio.sleep(0)
+                values = []
+                for _ in range(3):
+                    values.append(await asyncio.to_thread(feature_flag_manager.is_active, "enable-welcome", None, False))
+                return values + [feature_flag_manager.is_active("enable-welcome", None, False)]
+
+        async def evaluate_requests():
+            return await asyncio.gather(evaluate_in_tasks("joe"), evaluate_in_tasks("jack"))
+
+        self.assertEqual([[True] * 4, [False] * 4], asyncio.run(evaluate_requests()))
+        # each task evaluates once in its own scope
+        self.assertEqual(2, for_joe.evaluations)
+        self.assertEqual(1, for_jack.evaluations)
+        self.assertEqual(3, context.evaluations)
+
+    def test_prefix_queries(self):
+        configuration_manager = ConfigurationManager()
+        names = ["billing", "billing.invoices", "billing.invoices.pdf", "billing.taxes", "billingx", "search.fuzzy",
+                 "configs.db.PoolConfig", "configs.db.TimeoutConfig", "configs.dbx.Other"]
+        configuration_manager.set_configuration_store({
+            name: Configuration(name, Context(False, Modifiers('environment', {'qa': Context(name.endswith('x'))})))
+            for name in reversed(names)})
+        feature_flag_manager = FeatureFlagManager(configuration_manager)
+        config_manager = ConfigManager(configuration_manager)
+
+        self.assertEqual(sorted(names), configuration_manager.configuration_names())
+        self.assertEqual(["billing.invoices", "billing.invoices.pdf", "billing.taxes"],
+                         configuration_manager.configuration_names("billing."))
+        self.assertEqual([], configuration_manager.configuration_names("zzz"))
+        self.assertEqual({"billing.invoices": False, "billing.invoices.pdf": False, "billing.taxes": False},
+                         feature_flag_manager.get_flags("billing.", self.joe_in_qa))
+        self.assertEqual({"billing": False, "billing.invoices": False, "billing.invoices.pdf": False,
+                          "billing.taxes": False, "billingx": True},
+                         feature_flag_manager.get_flags("billing", self.joe_in_qa))
+        self.assertEqual(["configs.db.PoolConfig", "configs.db.TimeoutConfig"],
+                         list(config_manager.get_configs("configs.db", self.joe_in_qa)))
+
+        configuration_manager.set_configuration_store({"search.fuzzy": Configuration("search.fuzzy", Context(True))})
+        self.assertEqual({}, feature_flag_manager.get_flags("billing.", self.joe_in_qa))
+        self.assertEqual({"search.fuzzy": True}, feature_flag_manager.get_flags("", self.joe_in_qa))
+        with RequestScope(self.joe_in_prod):
+            self.assertEqual({"search.fuzzy": True}, feature_flag_manager.get_flags("search.", None))
+            configuration_manager.set_configuration_store({})
+            self.assertEqual({"search.fuzzy": True}, feature_flag_manager.get_flags("search.", None))
+        self.assertEqual({}, feature_flag_manager.get_flags("search.", self.joe_in_prod))
@@ -0,0 +1,208 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Unit tests for configuration mapper.
+"""
+import io
+import json
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from merci.deserialization import ConfigurationMapper, ContextDecoder, ObjectValueDecoderFactory, \
+    SingleValueDecoder, SingleValueDecoderFactory
+from merci.metrics import ConfigurationManagerMetrics, RefreshPhases
+
+
+class TestConfigurationMapper(unittest.TestCase):
+    """ Unit tests for configuration mapper. """
+
+    features = '{ "feature-flags": { "enable-qa": { "value": false, "modifiers": { "type": "environment",' \
+               ' "contexts": { "qa": { "value": true } } } },' \
+               ' "rollout": { "value": false, "modifiers": { "type": "user", "percentages": {' \
+               ' "50": { "value": true } } } } } }'
+
+    def test_decode_tree(self):
+        tree = json.loads(self.features)['feature-flags']['enable-qa']
+        copy = json.loads(json.dumps(tree))
+
+        context = ContextDecoder(value_decoder=SingleValueDecoder()).decode_tree(tree)
+
+        self.assertEqual(True, context.get_value({'environment': 'qa'}))
+        self.assertEqual(False, context.get_value({'environment': 'prod'}))
+        self.assertEqual(copy, tree)
+
+    def test_release_trees(self):
+        document = '{ "feature-flags": { "enable-qa": { "value": false }, "volatile": { "value": 1, "volatile": true } } }'
+        mapper = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False, ConfigurationManagerMetrics())
+
+        mapper.read_value(document, '/features.json')
+
+        # only trees of configurations, that forced refreshes instantiate again, are kept
+        compiled_file = mapper.compiled_files['/features.json']
+        self.assertEqual(['volatile'], [name for name, compiled in compiled_file.items() if compiled.tree is not None])
+
+    def test_parse_executor(self):
+        in_process = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False,
+                                         ConfigurationManagerMetrics())
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            offloaded = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False,
+                                            ConfigurationManagerMetrics(), parse_executor=executor,
+                                            offload_min_size=0)
+
+            expected = in_process.read_value(self.features, '/features.json')
+            configurations = offloaded.read_value(self.features, '/features.json')
+
+            self.assertRaises(IOError, offloaded.read_value, '{ "feature-flags": ', '/features.json')
+            self.assertRaises(IOError, offloaded.read_value, '{ "configs": { } }', '/features.json')
+        self.assertEqual(sorted(expected), sorted(configurations))
+        for user in ['joe', 'jane', 'jim', 'jill']:
+            self.assertEqual(expected['rollout'].get_value({'user': user}),
+                             configurations['rollout'].get_value({'user': user}))
+        self.assertEqual(True, configurations['enable-qa'].get_value({'environment': 'qa'}))
+
+    def test_broken_parse_executor(self):
+        metrics = ConfigurationManagerMetrics()
+        mapper = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False, metrics,
+                                     parse_executor=BrokenPoolExecutor(), offload_min_size=0)
+
+        configurations = mapper.read_value(self.features, '/features.json')
+
+        self.assertEqual(True, configurations['enable-qa'].get_value({'environment': 'qa'}))
+        self.assertEqual(1, metrics.parse_offload_failures)
+
+    def test_time_slices(self):
+        flags = ', '.join('"flag-%d": { "value": true, "modifiers": { "type": "user", "percentages":'
+                          ' { "%d": { "value": false } } } }' % (index, index % 100 + 1) for index in range(2000))
+        document = '{ "feature-flags": { ' + flags + ' } }'
+        for slice_seconds in [None, 0.001]:
+            metrics = ConfigurationManagerMetrics()
+            mapper = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False, metrics,
+                                         slice_seconds=slice_seconds)
+            progress = []
+            stop = threading.Event()
+
+            def serve():
+                while not stop.is_set():
+                    progress.append(1)
+                    time.sleep(0)
+
+            # without a forced switch of threads during the build, the serving thread only runs, if the build yields
+            switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(60)
+            thread = threading.Thread(target=serve)
+            thread.start()
+            try:
+                progress_before_build = len(progress)
+                configurations = mapper.read_value(document, '/features.json')
+                progress_during_build = len(progress) - progress_before_build
+            finally:
+                stop.set()
+                sys.setswitchinterval(switch_interval)
+                thread.join()
+
+            self.assertEqual(2000, len(configurations))
+            if slice_seconds is None:
+                self.assertEqual(0, progress_during_build)
+                self.assertEqual(0, metrics.slice_durations.count)
+            else:
+                self.assertGreater(progress_during_build, 0)
+                self.assertGreater(metrics.slice_durations.count, 1)
+                self.assertGreaterEqual(metrics.maximum_slice_seconds, 0.001)
+
+    def test_read_stream(self):
+        document = '{ "version": [1, {"a": "}"}], "feature-flags": {' \
+                   ' "quoted \\" name}": { "value": 12345678, "modifiers": { "type": "environment",' \
+                   ' "contexts": { "qa": { "value": -0.5e3 } } } },' \
+                   ' "unicode": { "value": "gr\\u00fc\u00dfe" }, "volatile": { "value": null, "volatile": true },' \
+                   ' "enable-qa": { "value": false } }, "trailer": 1.5 }\n'
+        expected = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False,
+                                       ConfigurationManagerMetrics()).read_value(document, '/features.json')
+        for chunk_size in [1, 2, 7, 64, 1 << 16]:
+            metrics = ConfigurationManagerMetrics()
+            mapper = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False, metrics)
+            mapper.STREAM_CHUNK_SIZE = chunk_size
+
+            configurations = mapper.read_stream(io.StringIO(document), '/features.json')
+
+            self.assertEqual(list(expected), list(configurations))
+            for name, context in expected.items():
+                for environment in ['qa', 'prod']:
+                    self.assertEqual(context.get_value({'environment': environment}),
+                                     configurations[name].get_value({'environment': environment}))
+            self.assertEqual(1, metrics.file_durations[(RefreshPhases.PARSE, '/features.json')].count)
+        # only trees of configurations, that forced refreshes instantiate again, are kept
+        compiled_file = mapper.compiled_files['/features.json']
+        self.assertEqual(['volatile'], [name for name, compiled in compiled_file.items() if compiled.tree is not None])
+        refreshed = mapper.refresh_values('/features.json')
+        self.assertIsNone(refreshed['volatile'].get_value({}))
+        self.assertIs(configurations['enable-qa'], refreshed['enable-qa'])
+
+        for bad_document in ['', '{ "feature-flags": { "a": { "value": 1 } }', '{ "feature-flags": { "a" 1 } }',
+                             '{ "feature-flags": { "a": { "value": 1 } } } }', '[]']:
+            self.assertRaises(ValueError, mapper.read_stream, io.StringIO(bad_document), '/features.json')
+        for missing_root in ['{ }', '{ "configs": { } }', '{ "feature-flags": [] }']:
+            self.assertRaises(IOError, mapper.read_stream, io.StringIO(missing_root), '/features.json')
+
+    def test_read_stream_split_numbers(self):
+        document = '{ "version": 12.5, "feature-flags": { "ratio": { "value": 12.5 } }, "size": -1e+3,' \
+                   ' "trailer": 0.25E-1 }'
+        mapper = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False,
+                                     ConfigurationManagerMetrics())
+        # every position splits the document once, i.e. after '12.' or '-1e' of numbers outside the root
+        for position in range(1, len(document)):
+            configurations = mapper.read_stream(SplitStream(document, position), '/features.json')
+
+            self.assertEqual(12.5, configurations['ratio'].get_value({}))
+
+    def test_stream_large_content(self):
+        configs = '{ "configs": { "merci.tests.configs.MessageConfig": { "value": { "message": "Hello" },' \
+                  ' "modifiers": { "type": "environment", "contexts": { "qa": { "value": { "message": "Hi" } } } } } } }'
+        mapper = ConfigurationMapper('configs', ObjectValueDecoderFactory(), False, ConfigurationManagerMetrics(),
+                                     stream_min_size=0)
+
+        configurations = mapper.read_value(configs, '/configs.json')
+
+        self.assertEqual("Hi", configurations['merci.tests.configs.MessageConfig'].get_value(
+            {'environment': 'qa'}).message)
+        # trees of config objects are kept for re-instantiation of reloaded config classes
+        self.assertIsNotNone(mapper.compiled_files['/configs.json']['merci.tests.configs.MessageConfig'].tree)
+
+
+class SplitStream:
+    """
+    Text stream, that returns the content before and after a split position in separate chunks.
+    """
+    def __init__(self, content: str, position: int):
+        self.chunks = [content[:position], content[position:]]
+
+    def read(self, size: int = -1) -> str:
+        return self.chunks.pop(0) if self.chunks else ''
+
+
+class BrokenPoolExecutor(Executor):
+    """
+    Executor, that behaves like a process pool with a terminated worker.
+    """
+    def submit(self, fn, *args, **kwargs):
+        raise BrokenProcessPool('A child process terminated abruptly.')
+
+
+if __name__ == '__main__':
+    unittest.main()
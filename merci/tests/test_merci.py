@@ -16,16 +16,24 @@
 """
 Unit tests for Merci class.
 """
+import random
+import sys
+import threading
+import time
 import unittest
+from datetime import datetime
 from typing import List
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from mockito import mock, when, verify
 from mockito.matchers import Matcher
 
-from merci.metrics import ConfigurationLoaderMetrics
+from merci.loaders import RefreshPolicy
+from merci.metrics import ConfigurationLoaderMetrics, RefreshPhases
+from merci.fetchers import WatchableConfigurationFetcher
 from merci.readers import ConfigurationFetcher
 from merci.merci import Merci, ConfigurationManagerMetrics
+from merci.tests.mocks import mock_fetcher
 
 
 class TestMerci(unittest.TestCase):
@@ -41,7 +49,7 @@ class TestMerci(unittest.TestCase):
         feature_contents_1 = {first_features: enable_one, second_features: enable_empty}
         feature_contents_2 = {first_features: enable_one, second_features: enable_all}
 
-        configuration_fetcher: ConfigurationFetcher = mock()
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
         when(configuration_fetcher).fetch_files(app, [first_features, second_features])\
             .thenReturn(feature_contents_1)\
             .thenReturn(feature_contents_2)
@@ -108,7 +116,7 @@ class TestMerci(unittest.TestCase):
             second_configs: one_name_config
         }
 
-        configuration_fetcher: ConfigurationFetcher = mock()
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
         when(configuration_fetcher).fetch_files(app, [first_configs, second_configs]) \
             .thenReturn(config_contents_1) \
             .thenReturn(config_contents_2)
@@ -165,6 +173,69 @@ class TestMerci(unittest.TestCase):
         self.assertEqual(0, config_metrics.name_duplicates)
         self.assertEqual(0, config_metrics.non_instantiable_skips)
 
+    def test_static_context(self):
+        app = 'mini-app'
+        features = '/features.json'
+        enable_in_qa = '{ "feature-flags": { "enable-qa": { "value": false, "modifiers": { "type": "environment", "contexts": { "qa": { "value": false, "modifiers": { "type": "user", "contexts": { "joe": { "value": true } } } } } } } } }'
+
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
+        when(configuration_fetcher).fetch_files(app, [features]).thenReturn({features: enable_in_qa})
+
+        scheduler: BackgroundScheduler = mock()
+
+        merci = Merci(configuration_fetcher, scheduler)
+        merci.set_static_context({"environment": "qa"})
+        feature_manager = merci.add_feature_flag_manager(app).register_file(features).build()
+        merci.create_and_start_loader(10)
+
+        self.assertEqual(True, feature_manager.is_active("enable-qa", {"user": "joe"}, False))
+        self.assertEqual(False, feature_manager.is_active("enable-qa", {"user": "jack"}, False))
+
+    def test_percentage_rollout(self):
+        app = 'mini-app'
+        features = '/features.json'
+        rollout = '{ "feature-flags": { "enable-rollout": { "value": false, "modifiers": { "type": "user", "percentages": { "20": { "value": true } } } } } }'
+
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
+        when(configuration_fetcher).fetch_files(app, [features]).thenReturn({features: rollout})
+
+        scheduler: BackgroundScheduler = mock()
+
+        merci = Merci(configuration_fetcher, scheduler)
+        feature_manager = merci.add_feature_flag_manager(app).register_file(features).build()
+        merci.create_and_start_loader(10)
+
+        enabled = [feature_manager.is_active("enable-rollout", {"user": str(user)}, False) for user in range(5000)]
+        self.assertAlmostEqual(0.2, enabled.count(True) / len(enabled), delta=0.02)
+        self.assertEqual(False, feature_manager.is_active("enable-rollout", {}, True))
+
+    def test_indexed_modifiers(self):
+        app = 'mini-app'
+        features = '/features.json'
+        targeted = '{ "feature-flags": { ' \
+                   '"enable-tenants": { "value": false, "modifiers": { "type": "tenant", "sets": [ { "members": [ "acme", "globex" ], "context": { "value": true } } ] } }, ' \
+                   '"enable-versions": { "value": false, "modifiers": { "type": "version", "comparison": "semver", "ranges": [ { "from": "3.2", "context": { "value": true } } ] } }, ' \
+                   '"enable-hosts": { "value": false, "modifiers": { "type": "host", "prefixes": { "db-": { "value": true } } } }, ' \
+                   '"enable-domains": { "value": false, "modifiers": { "type": "host", "suffixes": { ".qa": { "value": true } } } } } }'
+
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
+        when(configuration_fetcher).fetch_files(app, [features]).thenReturn({features: targeted})
+
+        scheduler: BackgroundScheduler = mock()
+
+        merci = Merci(configuration_fetcher, scheduler)
+        feature_manager = merci.add_feature_flag_manager(app).register_file(features).build()
+        merci.create_and_start_loader(10)
+
+        self.assertEqual(True, feature_manager.is_active("enable-tenants", {"tenant": "globex"}, False))
+        self.assertEqual(False, feature_manager.is_active("enable-tenants", {"tenant": "hooli"}, True))
+        self.assertEqual(True, feature_manager.is_active("enable-versions", {"version": "3.10"}, False))
+        self.assertEqual(False, feature_manager.is_active("enable-versions", {"version": "3.1.2"}, True))
+        self.assertEqual(True, feature_manager.is_active("enable-hosts", {"host": "db-1"}, False))
+        self.assertEqual(False, feature_manager.is_active("enable-hosts", {"host": "web-1"}, True))
+        self.assertEqual(True, feature_manager.is_active("enable-domains", {"host": "db-1.qa"}, False))
+        self.assertEqual(False, feature_manager.is_active("enable-domains", {"host": "db-1.prod"}, True))
+
     def test_skip_non_instantiable(self):
         app = 'mini-app'
         first_configs = '/first-configs.json'
@@ -176,7 +247,7 @@ class TestMerci(unittest.TestCase):
             second_configs: missing_class_config
         }
 
-        configuration_fetcher: ConfigurationFetcher = mock()
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
         when(configuration_fetcher).fetch_files(
             app, [first_configs, second_configs]).thenReturn(config_contents)
 
@@ -219,7 +290,7 @@ class TestMerci(unittest.TestCase):
             second_configs: missing_class_config
         }
 
-        configuration_fetcher: ConfigurationFetcher = mock()
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
         when(configuration_fetcher).fetch_files(
             app, [first_configs, second_configs]).thenReturn(config_contents)
 
@@ -252,6 +323,347 @@ class TestMerci(unittest.TestCase):
         self.assertEqual(-1, mini_config.port)
         self.assertEqual([], mini_config.hosts)
 
+    def test_adaptive_refresh(self):
+        app = 'mini-app'
+        features = '/features.json'
+        enable_none = {features: '{ "feature-flags": { "enable-all": { "value": false } } }'}
+        enable_all = {features: '{ "feature-flags": { "enable-all": { "value": true } } }'}
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
+        when(configuration_fetcher).fetch_files(app, [features])\
+            .thenReturn(enable_none)\
+            .thenRaise(IOError("unreachable"))\
+            .thenRaise(IOError("unreachable"))\
+            .thenReturn(enable_all)\
+            .thenReturn(enable_all)\
+            .thenReturn(enable_all)
+        scheduler = RecordingScheduler()
+        merci = Merci(configuration_fetcher, scheduler)
+        merci.set_refresh_policy(RefreshPolicy(maximum_backoff_seconds=30, jitter_ratio=0,
+                                               fast_interval_seconds=2, fast_refreshes=2))
+        feature_manager = merci.add_feature_flag_manager(app)\
+            .register_file(features)\
+            .set_refresh_interval(10)\
+            .build()
+        loader_metrics = ConfigurationLoaderMetrics()
+        merci.set_metrics(loader_metrics)
+
+        merci.create_and_start_loader(60)
+        for _ in range(5):
+            scheduler.run_next_job()
+
+        self.assertEqual([10, 20, 30, 2, 2, 10], scheduler.delays)
+        self.assertEqual(True, feature_manager.is_active("enable-all", {}, False))
+        self.assertEqual(6, loader_metrics.configuration_requests)
+        self.assertEqual(2, loader_metrics.configuration_failures)
+        self.assertEqual(5, loader_metrics.scheduled_refreshes)
+        self.assertEqual(2, loader_metrics.backoff_refreshes)
+        self.assertEqual(2, loader_metrics.fast_refreshes)
+        self.assertEqual(6, loader_metrics.refresh_delays.count)
+
+    def test_refresh_jitter(self):
+        policy = RefreshPolicy(jitter_ratio=0.2, random_generator=random.Random(7))
+        delays = [policy.jitter(10) for _ in range(100)]
+        self.assertTrue(all(8 <= delay <= 12 for delay in delays))
+        self.assertGreater(max(delays) - min(delays), 2)
+        self.assertRaises(ValueError, RefreshPolicy, jitter_ratio=1.5)
+
+    def test_refresh_backoff_limit(self):
+        policy = RefreshPolicy(maximum_backoff_seconds=600, backoff_multiplier=2.0)
+        self.assertEqual(180, policy.backoff(180, 0))
+        self.assertEqual(360, policy.backoff(180, 1))
+        self.assertEqual(600, policy.backoff(180, 2))
+        self.assertEqual(600, policy.backoff(180, 1100))
+        self.assertEqual(900, policy.backoff(900, 1100))
+        self.assertEqual(180, RefreshPolicy(backoff_multiplier=1).backoff(180, 1100))
+
+    def test_background_start(self):
+        features = '/features.json'
+        enable_all = '{ "feature-flags": { "enable-all": { "value": true } } }'
+        fetcher = BlockingFetcher({features: enable_all}, blocked_application='slow-app')
+        merci = Merci(fetcher, mock())
+        slow_manager = merci.add_feature_flag_manager('slow-app').register_file(features).build()
+        fast_manager = merci.add_feature_flag_manager('fast-app').register_file(features).build()
+        loader_metrics = ConfigurationLoaderMetrics()
+        merci.set_metrics(loader_metrics)
+
+        loader = merci.create_loader(10)
+        slow_load, fast_load = loader.start_in_background(initial_load_timeout_seconds=0.2)
+
+        self.assertFalse(slow_manager.is_ready())
+        self.assertTrue(fast_manager.wait_until_ready(5))
+        self.assertEqual(True, fast_manager.is_active("enable-all", {}, False))
+        self.assertTrue(fast_load.result(5))
+
+        self.assertTrue(slow_manager.wait_until_ready(5))
+        self.assertEqual(False, slow_manager.is_active("enable-all", {}, False))
+        self.assertEqual(1, loader_metrics.initial_load_timeouts)
+
+        fetcher.release.set()
+        self.assertTrue(slow_load.result(5))
+        self.assertEqual(True, slow_manager.is_active("enable-all", {}, False))
+        self.assertEqual(2, loader_metrics.configuration_requests)
+        self.assertEqual(0, loader_metrics.configuration_failures)
+        loader.shutdown()
+
+    def test_watch(self):
+        fetcher = ScriptedWatchFetcher(['5', '5', ValueError('unexpected'), '7', '3', '4'])
+        merci = Merci(fetcher, mock())
+        merci.add_feature_flag_manager('mini-app').register_file('/features.json').build()
+        loader_metrics = ConfigurationLoaderMetrics()
+        merci.set_metrics(loader_metrics)
+        loader = merci.create_loader(3600)
+        loader.WATCH_RETRY_SECONDS = 0.01
+        loader.WATCH_MIN_INTERVAL_SECONDS = 0.05
+
+        loader.start()
+        try:
+            self.assertTrue(fetcher.scripted.wait(5))
+            watches = len(fetcher.watched_indexes)
+            time.sleep(0.25)
+            # watches, that are answered right away, are not repeated faster than the minimum interval
+            self.assertLessEqual(len(fetcher.watched_indexes) - watches, 6)
+        finally:
+            loader.shutdown()
+        loader.watch_threads[0].join(5)
+
+        # an index, that went backwards, starts the watch over
+        self.assertEqual([None, '5', '5', '5', '7', None, '4'], fetcher.watched_indexes[:7])
+        self.assertFalse(loader.watch_threads[0].is_alive())
+        self.assertEqual(2, loader_metrics.watch_triggers)
+        self.assertEqual(1, loader_metrics.watch_reconnects)
+
+    def test_watch_long_outage(self):
+        fetcher = ScriptedWatchFetcher([IOError('unreachable')] * 1100 + ['5'])
+        merci = Merci(fetcher, mock())
+        merci.add_feature_flag_manager('mini-app').register_file('/features.json').build()
+        loader_metrics = ConfigurationLoaderMetrics()
+        merci.set_metrics(loader_metrics)
+        loader = merci.create_loader(3600)
+        loader.WATCH_RETRY_SECONDS = 0.0
+        loader.WATCH_MIN_INTERVAL_SECONDS = 0.05
+
+        loader.start()
+        try:
+            self.assertTrue(fetcher.scripted.wait(5))
+            # the retry delay stays bounded, so that the watch survives any number of failures
+            self.assertTrue(loader.watch_threads[0].is_alive())
+        finally:
+            loader.shutdown()
+        loader.watch_threads[0].join(5)
+
+        self.assertEqual(1, loader_metrics.watch_reconnects)
+
+    def test_forced_refresh(self):
+        app = 'mini-app'
+        configs = '/configs.json'
+        content = '{ "configs": { "test_merci.MiniConfig": { "value": { "hosts": [ "one" ], "port": 80 } },' \
+                  ' "test_merci.MicroConfig": { "value": { "names": [ "me" ] }, "volatile": true } } }'
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
+        when(configuration_fetcher).fetch_files(app, [configs]).thenReturn({configs: content})
+        merci = Merci(configuration_fetcher, mock())
+        config_metrics = ConfigurationManagerMetrics()
+        config_manager = merci.add_config_manager(app)\
+            .register_file(configs)\
+            .set_metrics(config_metrics)\
+            .build()
+        loader = merci.create_loader(10)
+        loader.execute_readers()
+        mini_config = config_manager.get_config(MiniConfig, {})
+        micro_config = config_manager.get_config(MicroConfig, {})
+
+        loader.execute_readers()
+
+        self.assertIs(mini_config, config_manager.get_config(MiniConfig, {}))
+        self.assertIsNot(micro_config, config_manager.get_config(MicroConfig, {}))
+        self.assertEqual(["me"], config_manager.get_config(MicroConfig, {}).names)
+        self.assertEqual(1, config_metrics.new_content_updates)
+        self.assertEqual(1, config_metrics.forced_refreshes)
+        self.assertEqual(1, config_metrics.durations[RefreshPhases.PARSE].count)
+
+        module = sys.modules[MiniConfig.__module__]
+        module.MiniConfig = type('MiniConfig', (MiniConfig,), {})
+        try:
+            loader.execute_readers()
+            self.assertIs(module.MiniConfig, type(config_manager.get_config(MiniConfig, {})))
+        finally:
+            module.MiniConfig = MiniConfig
+        self.assertEqual(2, config_metrics.forced_refreshes)
+        self.assertEqual(1, config_metrics.durations[RefreshPhases.PARSE].count)
+
+    def test_forced_refresh_after_failed_update(self):
+        app = 'mini-app'
+        configs = '/configs.json'
+        other = '/other.json'
+        applied = {configs: '{ "configs": { "test_merci.MicroConfig": { "value": { "names": [ "me" ] },'
+                            ' "volatile": true } } }',
+                   other: '{ "configs": { } }'}
+        failed = {configs: '{ "configs": { "test_merci.MicroConfig": { "value": { "names": [ "you" ] },'
+                           ' "volatile": true } } }',
+                  other: '{ "configs": '}
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
+        when(configuration_fetcher).fetch_files(app, [configs, other])\
+            .thenReturn(applied).thenReturn(failed).thenReturn(applied)
+        merci = Merci(configuration_fetcher, mock())
+        config_metrics = ConfigurationManagerMetrics()
+        config_manager = merci.add_config_manager(app)\
+            .register_file(configs)\
+            .register_file(other)\
+            .set_metrics(config_metrics)\
+            .build()
+        loader = merci.create_loader(10)
+
+        for _ in range(3):
+            loader.execute_readers()
+
+        # the forced refresh only instantiates configurations of the applied content again
+        self.assertEqual(["me"], config_manager.get_config(MicroConfig, {}).names)
+        self.assertEqual(1, config_metrics.content_failures)
+        self.assertEqual(1, config_metrics.forced_refreshes)
+
+    def test_shared_fetches(self):
+        app = 'mini-app'
+        shared = '/shared.json'
+        content = '{ "feature-flags": { "enable-all": { "value": true } },' \
+                  ' "configs": { "test_merci.MicroConfig": { "value": { "names": [ "me" ] } } } }'
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
+        when(configuration_fetcher).fetch_files(app, [shared])\
+            .thenReturn({shared: content})\
+            .thenRaise(IOError("unreachable"))
+        merci = Merci(configuration_fetcher, mock())
+        feature_manager = merci.add_feature_flag_manager(app).register_file(shared).build()
+        config_manager = merci.add_config_manager(app).register_file(shared).build()
+        loader_metrics = ConfigurationLoaderMetrics()
+        merci.set_metrics(loader_metrics)
+        loader = merci.create_loader(10)
+
+        loader.execute_readers()
+
+        verify(configuration_fetcher, times=1).fetch_files(app, [shared])
+        self.assertEqual(True, feature_manager.is_active("enable-all", {}, False))
+        self.assertEqual(["me"], config_manager.get_config(MicroConfig, {}).names)
+        self.assertEqual(1, loader_metrics.coalesced_fetches)
+
+        loader.execute_readers()
+
+        verify(configuration_fetcher, times=2).fetch_files(app, [shared])
+        self.assertEqual(4, loader_metrics.configuration_requests)
+        self.assertEqual(2, loader_metrics.configuration_failures)
+        self.assertEqual(2, loader_metrics.coalesced_fetches)
+
+    def test_shared_fetch_failure(self):
+        app = 'mini-app'
+        shared = '/shared.json'
+        missing = '/missing.json'
+        content = '{ "feature-flags": { "enable-all": { "value": true } },' \
+                  ' "configs": { "test_merci.MicroConfig": { "value": { "names": [ "me" ] } } } }'
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
+        when(configuration_fetcher).fetch_files(app, [shared, missing]).thenRaise(IOError("missing"))
+        when(configuration_fetcher).fetch_files(app, [shared]).thenReturn({shared: content})
+        merci = Merci(configuration_fetcher, mock())
+        feature_manager = merci.add_feature_flag_manager(app).register_file(shared).register_file(missing).build()
+        config_manager = merci.add_config_manager(app).register_file(shared).build()
+        loader_metrics = ConfigurationLoaderMetrics()
+        merci.set_metrics(loader_metrics)
+        loader = merci.create_loader(10)
+
+        loader.execute_readers()
+
+        # the failure of the first reader may be caused by a file, that the second reader does not request
+        verify(configuration_fetcher, times=1).fetch_files(app, [shared, missing])
+        verify(configuration_fetcher, times=1).fetch_files(app, [shared])
+        self.assertFalse(feature_manager.is_ready())
+        self.assertEqual(["me"], config_manager.get_config(MicroConfig, {}).names)
+        self.assertEqual(1, loader_metrics.configuration_failures)
+
+    def test_parse_cache(self):
+        app = 'mini-app'
+        first_features = '/first-features.json'
+        second_features = '/second-features.json'
+        enable_one = '{ "feature-flags": { "enable-one": { "value": true }, "enable-all": { "value": false } } }'
+        enable_all = '{ "feature-flags": { "enable-all": { "value": true } } }'
+        enable_none = '{ "feature-flags": { "enable-all": { "value": false } } }'
+        configuration_fetcher: ConfigurationFetcher = mock_fetcher()
+        when(configuration_fetcher).fetch_files(app, [first_features, second_features])\
+            .thenReturn({first_features: enable_one, second_features: enable_none})\
+            .thenReturn({first_features: enable_one, second_features: enable_all})
+        merci = Merci(configuration_fetcher, mock())
+        feature_metrics = ConfigurationManagerMetrics()
+        feature_manager = merci.add_feature_flag_manager(app)\
+            .register_file(first_features)\
+            .register_file(second_features)\
+            .set_metrics(feature_metrics)\
+            .build()
+        loader = merci.create_loader(10)
+
+        loader.execute_readers()
+        loader.execute_readers()
+
+        self.assertEqual(1, feature_metrics.file_durations[(RefreshPhases.PARSE, first_features)].count)
+        self.assertEqual(2, feature_metrics.file_durations[(RefreshPhases.PARSE, second_features)].count)
+        self.assertEqual(1, feature_metrics.parse_cache_hits)
+        self.assertEqual(True, feature_manager.is_active("enable-one", {}, False))
+        self.assertEqual(True, feature_manager.is_active("enable-all", {}, False))
+
+
+class BlockingFetcher(ConfigurationFetcher):
+    """
+    Fetcher, that blocks requests of one application until released.
+    """
+    def __init__(self, contents, blocked_application):
+        self.contents = contents
+        self.blocked_application = blocked_application
+        self.release = threading.Event()
+
+    def fetch_files(self, application, file_names):
+        if application == self.blocked_application:
+            self.release.wait(5)
+        return self.contents
+
+
+class ScriptedWatchFetcher(WatchableConfigurationFetcher):
+    """
+    Watchable fetcher, that answers watches right away with scripted indexes or errors, then with unchanged indexes.
+    """
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.watched_indexes = []
+        self.scripted = threading.Event()
+
+    def fetch_files(self, application, file_names):
+        return {file_name: '{ "feature-flags": { } }' for file_name in file_names}
+
+    def watch(self, application, index, wait_seconds):
+        self.watched_indexes.append(index)
+        if not self.answers:
+            self.scripted.set()
+            return index
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+class RecordingScheduler:
+    """
+    Scheduler, that records one-off jobs and runs them on demand.
+    """
+    def __init__(self):
+        self.jobs = []
+        self.delays = []
+
+    def add_job(self, func, trigger, run_date, args, misfire_grace_time=1, coalesce=False):
+        if misfire_grace_time is not None or not coalesce:
+            raise AssertionError("One-off jobs must run however late they are.")
+        self.delays.append(round((run_date - datetime.now()).total_seconds()))
+        self.jobs.append((func, args))
+
+    def run_next_job(self):
+        func, args = self.jobs.pop(0)
+        func(*args)
+
+    def start(self):
+        pass
+
 
 class ArgumentCaptor(Matcher):
     """
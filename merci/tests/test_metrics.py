@@ -0,0 +1,182 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Unit tests for metrics and their Prometheus exposition.
+"""
+import gc
+import sys
+import threading
+import unittest
+
+from mockito import when
+
+from merci.deserialization import ConfigurationMapper, SingleValueDecoderFactory
+from merci.fetchers import ConfigurationFetcher
+from merci.managers import ConfigurationManager
+from merci.metrics import LatencyHistogram, ConfigurationManagerMetrics, ConfigurationLoaderMetrics, RefreshPhases, \
+    StripedCounters
+from merci.prometheus import PrometheusExposition
+from merci.readers import ConfigurationReader
+from merci.tests.mocks import mock_fetcher
+
+
+class TestMetrics(unittest.TestCase):
+    """ Unit tests for metrics. """
+
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram([0.001, 0.01, 0.1])
+        self.assertEqual(0.0, histogram.quantile(0.5))
+        for seconds in [0.0005, 0.001, 0.002, 0.005, 0.05, 3.0]:
+            histogram.observe(seconds)
+        self.assertEqual([2, 2, 1, 1], histogram.bucket_counts)
+        self.assertEqual(6, histogram.count)
+        self.assertAlmostEqual(3.0585, histogram.sum)
+        self.assertEqual(3.0, histogram.max)
+        self.assertEqual(0.001, histogram.quantile(0.3))
+        self.assertEqual(0.01, histogram.quantile(0.5))
+        self.assertEqual(3.0, histogram.quantile(0.99))
+
+    def test_refresh_phase_durations(self):
+        features = '/features.json'
+        enable_all = '{ "feature-flags": { "enable-all": { "value": true } } }'
+        enable_none = '{ "feature-flags": { "enable-all": { "value": false } } }'
+        fetcher: ConfigurationFetcher = mock_fetcher()
+        when(fetcher).fetch_files('mini-app', [features])\
+            .thenReturn({features: enable_all})\
+            .thenReturn({features: enable_none})
+        metrics = ConfigurationManagerMetrics()
+        mapper = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False, metrics)
+        reader = ConfigurationReader('mini-app', [features], fetcher, mapper, ConfigurationManager(), metrics, 0)
+
+        reader.execute()
+        reader.execute()
+
+        for phase in [RefreshPhases.FETCH, RefreshPhases.HASH, RefreshPhases.PARSE, RefreshPhases.INSTANTIATE,
+                      RefreshPhases.STORE]:
+            self.assertEqual(2, metrics.durations[phase].count)
+        self.assertEqual(2, metrics.file_durations[(RefreshPhases.PARSE, features)].count)
+        self.assertNotIn((RefreshPhases.FETCH, features), metrics.file_durations)
+
+    def test_prometheus_exposition(self):
+        manager_metrics = ConfigurationManagerMetrics()
+        manager_metrics.increment_updates(3)
+        manager_metrics.observe_duration(RefreshPhases.PARSE, 0.003, '/features.json')
+        loader_metrics = ConfigurationLoaderMetrics()
+        loader_metrics.observe_cycle_duration(0.02)
+
+        text = PrometheusExposition()\
+            .add_manager_metrics(manager_metrics, {"application": "my\"app"})\
+            .add_loader_metrics(loader_metrics)\
+            .generate()
+
+        self.assertIn('# TYPE merci_configuration_updates_total counter\n', text)
+        self.assertIn('merci_configuration_updates_total{application="my\\"app"} 3\n', text)
+        self.assertIn('# TYPE merci_refresh_phase_duration_seconds histogram\n', text)
+        self.assertIn('merci_refresh_phase_duration_seconds_bucket{application="my\\"app",phase="parse",le="0.0025"} 0\n', text)
+        self.assertIn('merci_refresh_phase_duration_seconds_bucket{application="my\\"app",phase="parse",le="0.005"} 1\n', text)
+        self.assertIn('merci_refresh_phase_duration_seconds_count{application="my\\"app",phase="parse"} 1\n', text)
+        self.assertIn('merci_refresh_file_phase_duration_seconds_bucket{application="my\\"app",phase="parse",file="/features.json",le="+Inf"} 1\n', text)
+        self.assertIn('merci_loader_cycle_duration_seconds_sum 0.02\n', text)
+        self.assertEqual(1, text.count('# TYPE merci_loader_configuration_requests_total counter\n'))
+
+    def test_no_lost_increments(self):
+        metrics = ConfigurationManagerMetrics()
+        threads_count = 16
+        increments = 2000
+        start = threading.Barrier(threads_count + 1)
+        snapshots = []
+
+        def increment():
+            start.wait()
+            for _ in range(increments):
+                metrics.increment_updates()
+                metrics.increment_same_content_skips(2)
+                metrics.observe_duration(RefreshPhases.PARSE, 0.001, '/features.json')
+
+        def take_snapshots():
+            start.wait()
+            for _ in range(200):
+                snapshots.append(metrics.snapshot())
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(0.000001)
+        try:
+            threads = [threading.Thread(target=increment) for _ in range(threads_count)]
+            threads.append(threading.Thread(target=take_snapshots))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        self.assertEqual(threads_count * increments, metrics.updates)
+        self.assertEqual(2 * threads_count * increments, metrics.same_content_skips)
+        self.assertEqual(threads_count * increments, metrics.durations[RefreshPhases.PARSE].count)
+        self.assertEqual(threads_count * increments, metrics.file_durations[(RefreshPhases.PARSE, '/features.json')].count)
+        for previous, snapshot in zip(snapshots, snapshots[1:]):
+            self.assertLessEqual(previous['updates'], snapshot['updates'])
+            self.assertLessEqual(previous['same_content_skips'], snapshot['same_content_skips'])
+        self.assertEqual({'updates': threads_count * increments, 'content_failures': 0,
+                          'same_content_skips': 2 * threads_count * increments, 'new_content_updates': 0,
+                          'name_duplicates': 0, 'non_instantiable_skips': 0, 'parse_offload_failures': 0,
+                          'forced_refreshes': 0, 'parse_cache_hits': 0, 'cache_loads': 0, 'cache_failures': 0},
+                         metrics.snapshot())
+
+    def test_striped_counters_snapshot_is_atomic(self):
+        counters = StripedCounters(['first', 'second'])
+        stop = threading.Event()
+
+        def increment_both():
+            while not stop.is_set():
+                counters.increment('first')
+                counters.increment('second')
+
+        # increments of both counters by the same thread must be observed in order
+        thread = threading.Thread(target=increment_both)
+        thread.start()
+        try:
+            for _ in range(1000):
+                snapshot = counters.snapshot()
+                self.assertIn(snapshot['first'] - snapshot['second'], (0, 1))
+        finally:
+            stop.set()
+            thread.join()
+
+    def test_striped_counters_of_ended_threads(self):
+        counters = StripedCounters(['first'])
+        for _ in range(10):
+            thread = threading.Thread(target=counters.increment, args=('first', 2))
+            thread.start()
+            thread.join()
+        gc.collect()
+
+        self.assertEqual(20, counters.value('first'))
+        self.assertEqual({'first': 20}, counters.snapshot())
+        # stripes of ended threads are folded into retired values
+        self.assertEqual(0, len(counters._stripes))
+
+    def test_reset_counters(self):
+        metrics = ConfigurationManagerMetrics()
+        thread = threading.Thread(target=metrics.increment_updates)
+        thread.start()
+        thread.join()
+        metrics.increment_updates()
+
+        metrics.updates = 0
+        metrics.increment_updates()
+
+        self.assertEqual(1, metrics.updates)
@@ -0,0 +1,146 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Unit tests for spill store.
+"""
+import gc
+import json
+import os
+import tempfile
+import unittest
+
+from merci.deserialization import ConfigurationMapper, ContextDecoder, ObjectValueDecoderFactory, \
+    SingleValueDecoder, SingleValueDecoderFactory
+from merci.metrics import ConfigurationManagerMetrics
+from merci.spillover import SpillStore, SpilledContexts
+
+
+class TestSpillStore(unittest.TestCase):
+    """ Unit tests for spill store. """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = SpillStore(self.directory.name, min_contexts=3, cache_size=2)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    @staticmethod
+    def tenants_flag(count: int) -> str:
+        tenants = ', '.join('"tenant-%d": { "value": %d, "modifiers": { "type": "environment",'
+                            ' "contexts": { "qa": { "value": -1 } } } }' % (index, index) for index in range(count))
+        return '{ "value": 0, "modifiers": { "type": "tenant", "contexts": { ' + tenants + ' } } }'
+
+    def test_spilled_contexts(self):
+        tree = json.loads(self.tenants_flag(10))
+        expected = ContextDecoder(value_decoder=SingleValueDecoder()).decode_tree(tree)
+        decoder = ContextDecoder(value_decoder=SingleValueDecoder(), spill_store=self.store)
+
+        context = decoder.decode_tree(tree)
+
+        self.assertTrue(decoder.spilled)
+        contexts = context.modifiers.contexts
+        self.assertIsInstance(contexts, SpilledContexts)
+        self.assertEqual(10, len(contexts))
+        self.assertEqual(sorted(expected.modifiers.contexts), sorted(contexts))
+        for tenant in ['tenant-0', 'tenant-7', 'tenant-10', 'other', None]:
+            for environment in ['qa', 'prod']:
+                runtime_context = {'tenant': tenant, 'environment': environment}
+                self.assertEqual(expected.get_value(runtime_context), context.get_value(runtime_context))
+        self.assertIsNone(contexts.get(7))
+        self.assertNotIn('other', contexts)
+        self.assertRaises(KeyError, contexts.__getitem__, 'other')
+        # nested contexts maps are below the threshold, so they are not spilled again on load
+        self.assertIsInstance(contexts['tenant-1'].modifiers.contexts, dict)
+
+    def test_bounded_cache(self):
+        context = ContextDecoder(value_decoder=SingleValueDecoder(), spill_store=self.store)\
+            .decode_tree(json.loads(self.tenants_flag(10)))
+        contexts = context.modifiers.contexts
+
+        first = contexts['tenant-1']
+        self.assertIs(first, contexts['tenant-1'])
+        contexts.get('tenant-2')
+        contexts.get('missing')
+
+        self.assertEqual(['tenant-2', 'missing'], list(contexts.cache))
+        # evicted sub-contexts are decoded again
+        self.assertIsNot(first, contexts['tenant-1'])
+        self.assertEqual(1, contexts['tenant-1'].get_value({}))
+
+    def test_partially_evaluate(self):
+        context = ContextDecoder(value_decoder=SingleValueDecoder(), spill_store=self.store)\
+            .decode_tree(json.loads(self.tenants_flag(10)))
+
+        pruned = context.partially_evaluate({'environment': 'qa'})
+
+        self.assertIsInstance(pruned.modifiers.contexts, SpilledContexts)
+        self.assertEqual(-1, pruned.get_value({'tenant': 'tenant-3'}))
+        self.assertEqual(0, pruned.get_value({'tenant': 'other'}))
+        self.assertEqual(3, context.get_value({'tenant': 'tenant-3'}))
+
+    def test_mapper(self):
+        metrics = ConfigurationManagerMetrics()
+        mapper = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False, metrics,
+                                     spill_store=self.store)
+        document = '{ "feature-flags": { "tenants": ' + self.tenants_flag(10) + ', "small": ' + \
+                   self.tenants_flag(2) + ' } }'
+
+        configurations = mapper.read_value(document, '/features.json')
+
+        self.assertEqual(9, configurations['tenants'].get_value({'tenant': 'tenant-9'}))
+        self.assertEqual(1, configurations['small'].get_value({'tenant': 'tenant-1'}))
+        # parsed trees of spilled configurations are not kept in memory
+        self.assertIsNone(mapper.compiled_files['/features.json']['tenants'].tree)
+
+    def test_invalid_sub_context(self):
+        configs = '{ "configs": { "merci.tests.configs.MessageConfig": { "value": { "message": "Hello" },' \
+                  ' "modifiers": { "type": "tenant", "contexts": { "1": { "value": { "message": "Hi" } },' \
+                  ' "2": { "value": { "message": "Hey" } }, "3": { "value": { "unknown": "field" } } } } } } }'
+        metrics = ConfigurationManagerMetrics()
+        mapper = ConfigurationMapper('configs', ObjectValueDecoderFactory(), True, metrics, spill_store=self.store)
+
+        configurations = mapper.read_value(configs, '/configs.json')
+
+        # invalid sub-contexts are skipped at load time, like without spilling
+        self.assertEqual({}, configurations)
+        self.assertEqual(1, metrics.non_instantiable_skips)
+        self.assertEqual(0, self.store.connection.execute('SELECT COUNT(*) FROM contexts').fetchone()[0])
+        failing_mapper = ConfigurationMapper('configs', ObjectValueDecoderFactory(), False, metrics,
+                                             spill_store=self.store)
+        self.assertRaises(TypeError, failing_mapper.read_value, configs, '/configs.json')
+
+    def test_temporary_file(self):
+        # the index file is unlinked right away, so that it does not outlive the process
+        self.assertEqual([], os.listdir(self.directory.name))
+        self.assertEqual(1, ContextDecoder(value_decoder=SingleValueDecoder(), spill_store=self.store)
+                         .decode_tree(json.loads(self.tenants_flag(10))).get_value({'tenant': 'tenant-1'}))
+
+    def test_release(self):
+        decoder = ContextDecoder(value_decoder=SingleValueDecoder(), spill_store=self.store)
+        decoder.decode_tree(json.loads(self.tenants_flag(10)))
+        gc.collect()
+
+        context = decoder.decode_tree(json.loads(self.tenants_flag(5)))
+
+        rows = self.store.connection.execute('SELECT COUNT(*) FROM contexts').fetchone()[0]
+        self.assertEqual(5, rows)
+        self.assertEqual(4, context.get_value({'tenant': 'tenant-4'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,7 +18,9 @@ Unit tests for structure classes, like Context, Modifiers and Configuration.
 """
 from unittest import TestCase
 
-from merci.structure import Context, Modifiers, Configuration
+from merci.structure import Context, Modifiers, Configuration, PercentageModifiers, SetModifiers, RangeModifiers, \
+    RuntimeContext, \
+    PrefixModifiers, SuffixModifiers
 from merci.tests.configs import MessageConfig
 
 
@@ -103,3 +105,169 @@ class TestConfiguration(TestCase):
         enable_joe_configuration = Configuration("enable-joe", self.only_true_for_joe_in_qa)
         self.assertTrue(enable_joe_configuration.get_value(self.joe_on_cem341_in_qa))
         self.assertFalse(enable_joe_configuration.get_value(self.joe_on_cem1001_in_prod))
+
+    def test_partially_evaluate_static_environment(self):
+        in_qa = self.config_context.partially_evaluate({"environment": "qa"})
+        self.assertIsInstance(in_qa.modifiers, Modifiers)
+        self.assertEqual("cluster", in_qa.modifiers.context_type)
+        self.assertEqual("I am almost there.", in_qa.get_value(self.empty).message)
+        self.assertEqual("Someone is testing in cem341.", in_qa.get_value({"cluster": "cem341"}).message)
+        self.assertEqual("I am testing in cem341, Joe.", in_qa.get_value({"cluster": "cem341", "user": "joe"}).message)
+
+        in_prod = self.config_context.partially_evaluate({"environment": "prod"})
+        self.assertIsNone(in_prod.modifiers)
+        self.assertEqual("Yeah. I made it.", in_prod.get_value(self.joe_on_cem341_in_qa).message)
+
+        in_dev = self.config_context.partially_evaluate({"environment": "dev"})
+        self.assertIsNone(in_dev.modifiers)
+        self.assertEqual("I just started.", in_dev.get_value(self.joe_on_cem341_in_qa).message)
+
+    def test_partially_evaluate_static_environment_and_cluster(self):
+        on_cem341 = self.config_context.partially_evaluate({"environment": "qa", "cluster": "cem341"})
+        self.assertEqual("user", on_cem341.modifiers.context_type)
+        self.assertEqual("Someone is testing in cem341.", on_cem341.get_value({"user": "jack"}).message)
+        self.assertEqual("I am testing in cem341, Joe.", on_cem341.get_value({"user": "joe"}).message)
+
+    def test_partially_evaluate_dynamic_only(self):
+        pruned = self.only_true_for_joe_in_qa.partially_evaluate({"cluster": "cem341"})
+        for runtime_context in [self.empty, self.qa, self.prod, self.joe_on_cem341_in_qa, self.jack_on_cem341_in_qa]:
+            self.assertEqual(self.only_true_for_joe_in_qa.get_value(runtime_context), pruned.get_value(runtime_context))
+
+    def test_percentage_modifiers(self):
+        rollout = Context("old", PercentageModifiers("user", {"10": Context("new"), "35.5": Context("beta")}, "seed"))
+        users = ["user-" + str(number) for number in range(20000)]
+        values = [rollout.get_value({"user": user}) for user in users]
+        self.assertAlmostEqual(0.10, values.count("new") / len(users), delta=0.01)
+        self.assertAlmostEqual(0.255, values.count("beta") / len(users), delta=0.01)
+        self.assertAlmostEqual(0.645, values.count("old") / len(users), delta=0.01)
+        self.assertEqual(values, [rollout.get_value({"user": user}) for user in users])
+        self.assertEqual("old", rollout.get_value(self.empty))
+
+    def test_percentage_modifiers_bucket_is_stable(self):
+        modifiers = PercentageModifiers("user", {"50": Context(True)}, "enable-feature-one")
+        self.assertEqual(modifiers.bucket("joe"), PercentageModifiers("user", {}, "enable-feature-one").bucket("joe"))
+        self.assertNotEqual([modifiers.bucket(str(user)) for user in range(10)],
+                            [PercentageModifiers("user", {}, "other-seed").bucket(str(user)) for user in range(10)])
+        self.assertEqual(369, modifiers.bucket("joe"))
+
+    def test_percentage_modifiers_invalid_percentage(self):
+        with self.assertRaises(ValueError):
+            PercentageModifiers("user", {"0": Context(True)})
+        with self.assertRaises(ValueError):
+            PercentageModifiers("user", {"100.5": Context(True)})
+        with self.assertRaises(ValueError):
+            PercentageModifiers("user", {"10": Context(True), "10.0": Context(False)})
+
+    def test_partially_evaluate_percentage_modifiers(self):
+        rollout = Context(False, Modifiers("environment", {"qa": Context(False, PercentageModifiers("user", {"50": Context(True)}))}))
+        in_qa = rollout.partially_evaluate({"environment": "qa"})
+        self.assertIsInstance(in_qa.modifiers, PercentageModifiers)
+        for user in ["joe", "jack", "jill", "john"]:
+            self.assertEqual(rollout.get_value({"environment": "qa", "user": user}), in_qa.get_value({"user": user}))
+        for_joe = rollout.partially_evaluate({"user": "joe"})
+        self.assertIsNone(for_joe.modifiers.contexts["qa"].modifiers)
+
+    def test_set_modifiers(self):
+        tenants = Context("none", SetModifiers("tenant", [(["acme", "globex"], Context("first")),
+                                                          (["globex", "initech"], Context("second"))]))
+        self.assertEqual("first", tenants.get_value({"tenant": "acme"}))
+        self.assertEqual("first", tenants.get_value({"tenant": "globex"}))
+        self.assertEqual("second", tenants.get_value({"tenant": "initech"}))
+        self.assertEqual("none", tenants.get_value({"tenant": "hooli"}))
+        self.assertEqual("none", tenants.get_value(self.empty))
+        mapped = tenants.modifiers.map_contexts(lambda context: Context(context.get_value(self.empty) + "!"))
+        self.assertEqual("first!", mapped.find_context("globex").get_value(self.empty))
+        self.assertEqual("second!", mapped.find_context("initech").get_value(self.empty))
+
+    def test_numeric_range_modifiers(self):
+        load = Context("low", RangeModifiers("load", [("0.5", "0.8", Context("medium")), ("0.8", None, Context("high")),
+                                                      (None, "0", Context("invalid"))]))
+        self.assertEqual("invalid", load.get_value({"load": "-1"}))
+        self.assertEqual("low", load.get_value({"load": "0.2"}))
+        self.assertEqual("medium", load.get_value({"load": "0.5"}))
+        self.assertEqual("medium", load.get_value({"load": "0.79"}))
+        self.assertEqual("high", load.get_value({"load": "0.8"}))
+        self.assertEqual("high", load.get_value({"load": "1000"}))
+        self.assertEqual("low", load.get_value({"load": "unknown"}))
+        self.assertEqual("low", load.get_value({"load": "nan"}))
+        self.assertEqual("low", load.get_value({"load": "inf"}))
+        self.assertEqual("low", load.get_value({"load": "-inf"}))
+
+    def test_semver_range_modifiers(self):
+        versions = Context("old", RangeModifiers("version", [("3.2", "4.0", Context("three")), ("4", None, Context("four"))],
+                                                 RangeModifiers.SEMVER))
+        self.assertEqual("old", versions.get_value({"version": "3.1.9"}))
+        self.assertEqual("three", versions.get_value({"version": "3.2"}))
+        self.assertEqual("three", versions.get_value({"version": "3.2.0"}))
+        self.assertEqual("three", versions.get_value({"version": "3.10.1-beta"}))
+        self.assertEqual("four", versions.get_value({"version": "4.0.0"}))
+        self.assertEqual("four", versions.get_value({"version": "12.1"}))
+
+    def test_invalid_range_modifiers(self):
+        with self.assertRaises(ValueError):
+            RangeModifiers("version", [("1", "3", Context(True)), ("2", "4", Context(False))])
+        with self.assertRaises(ValueError):
+            RangeModifiers("version", [("1", None, Context(True)), ("2", "4", Context(False))])
+        with self.assertRaises(ValueError):
+            RangeModifiers("version", [("3", "3", Context(True))])
+        with self.assertRaises(ValueError):
+            RangeModifiers("version", [("3", "4", Context(True))], "alphabetic")
+
+    def test_prefix_and_suffix_modifiers(self):
+        hosts = Context("none", PrefixModifiers("host", {"db-": Context("db"), "db-eu-": Context("db-eu"), "web": Context("web")}))
+        self.assertEqual("db", hosts.get_value({"host": "db-us-1"}))
+        self.assertEqual("db-eu", hosts.get_value({"host": "db-eu-1"}))
+        self.assertEqual("web", hosts.get_value({"host": "web"}))
+        self.assertEqual("none", hosts.get_value({"host": "we"}))
+        self.assertEqual("none", hosts.get_value({"host": "app-1"}))
+
+        domains = Context("none", SuffixModifiers("host", {".example.com": Context("example"), ".qa.example.com": Context("qa")}))
+        self.assertEqual("example", domains.get_value({"host": "db1.example.com"}))
+        self.assertEqual("qa", domains.get_value({"host": "db1.qa.example.com"}))
+        self.assertEqual("none", domains.get_value({"host": "db1.example.org"}))
+
+    def test_partially_evaluate_indexed_modifiers(self):
+        hosts = Context(False, Modifiers("environment", {"qa": Context(False, PrefixModifiers("host", {"db-": Context(True)}))}))
+        in_qa = hosts.partially_evaluate({"environment": "qa"})
+        self.assertIsInstance(in_qa.modifiers, PrefixModifiers)
+        self.assertTrue(in_qa.get_value({"host": "db-1"}))
+        on_db = hosts.partially_evaluate({"host": "db-1"})
+        self.assertTrue(on_db.get_value({"environment": "qa"}))
+        self.assertFalse(on_db.get_value({"environment": "prod"}))
+
+    def test_trace_value(self):
+        self.assertEqual((True, 0, False), Context(True).trace_value(self.qa))
+        self.assertEqual((False, 1, False), self.only_true_for_joe_in_qa.trace_value(self.empty))
+        self.assertEqual((False, 1, True), self.only_true_for_joe_in_qa.trace_value(self.prod))
+        self.assertEqual((False, 2, True), self.only_true_for_joe_in_qa.trace_value(self.jack_on_cem341_in_qa))
+        self.assertEqual((True, 2, True), self.only_true_for_joe_in_qa.trace_value(self.joe_on_cem341_in_qa))
+        message_config, depth, overridden = self.config_context.trace_value(self.joe_on_cem341_in_qa)
+        self.assertEqual("I am testing in cem341, Joe.", message_config.message)
+        self.assertEqual((3, True), (depth, overridden))
+
+    def test_runtime_context(self):
+        context = RuntimeContext(self.joe_on_cem341_in_qa)
+        self.assertEqual(self.joe_on_cem341_in_qa, context)
+        self.assertEqual(context, RuntimeContext(**self.joe_on_cem341_in_qa))
+        self.assertEqual(hash(context), hash(RuntimeContext(dict(reversed(list(self.joe_on_cem341_in_qa.items()))))))
+        self.assertNotEqual(context, RuntimeContext(self.qa))
+        self.assertEqual({context: 1}[RuntimeContext(self.joe_on_cem341_in_qa)], 1)
+        self.assertEqual(self.joe_on_cem341_in_qa.get("user"), context.get("user"))
+        self.assertIsNone(context.get("tenant"))
+        with self.assertRaises(TypeError):
+            context["user"] = "jack"
+        self.assertRaises(AttributeError, setattr, context, "user", "jack")
+        self.assertRaises(AttributeError, setattr, context, "get", {}.get)
+        self.assertRaises(AttributeError, delattr, context, "_hash")
+        with self.assertRaises(TypeError):
+            context._values["user"] = "jack"
+        self.assertEqual("jack", context.with_values({"user": "jack"})["user"])
+        self.assertEqual("joe", context["user"])
+
+        for runtime_context in [self.empty, self.qa, self.prod, self.jack_on_cem341_in_qa, self.joe_on_cem341_in_qa]:
+            self.assertEqual(self.only_true_for_joe_in_qa.get_value(runtime_context),
+                             self.only_true_for_joe_in_qa.get_value(RuntimeContext(runtime_context)))
+            self.assertEqual(self.config_context.trace_value(runtime_context)[1:],
+                             self.config_context.trace_value(RuntimeContext(runtime_context))[1:])
+        static = self.only_true_for_joe_in_qa.partially_evaluate(RuntimeContext(self.qa))
+        self.assertTrue(static.get_value(RuntimeContext(user="joe")))
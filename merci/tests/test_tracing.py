@@ -0,0 +1,164 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Unit tests for tracing of refresh phases.
+"""
+import unittest
+from contextlib import contextmanager
+from typing import Dict
+
+from mockito import mock, when
+
+from merci.deserialization import ConfigurationMapper, SingleValueDecoderFactory
+from merci.fetchers import ConfigurationFetcher
+from merci.loaders import ConfigurationLoader
+from merci.managers import ConfigurationManager
+from merci.metrics import ConfigurationManagerMetrics, ConfigurationLoaderMetrics, RefreshPhases
+from merci.readers import ConfigurationReader
+from merci.tests.mocks import mock_fetcher
+from merci.tracing import RefreshTracer, NO_OP_TRACER, OpenTelemetryRefreshTracer
+
+
+class RecordingTracer(RefreshTracer):
+    """ Records started and finished spans, with their nesting depth. """
+    def __init__(self):
+        self.events = []
+        self.depth = 0
+
+    @contextmanager
+    def span(self, phase: str, attributes: Dict[str, str]):
+        self.events.append(('start', phase, self.depth, dict(attributes)))
+        self.depth += 1
+        try:
+            yield
+        except Exception as exception:
+            self.events.append(('error', phase, type(exception).__name__))
+            raise
+        finally:
+            self.depth -= 1
+
+
+class StubSpan:
+    """ Span of the stub OpenTelemetry tracer. """
+    def __init__(self, name: str, attributes: Dict[str, str], parent: 'StubSpan'):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.exceptions = []
+        self.ended = False
+
+    def record_exception(self, exception: BaseException):
+        self.exceptions.append(exception)
+
+
+class StubOpenTelemetryTracer:
+    """ Stub of an OpenTelemetry tracer, that records spans like start_as_current_span of the SDK does. """
+    def __init__(self):
+        self.spans = []
+        self.current: StubSpan = None
+
+    @contextmanager
+    def start_as_current_span(self, name: str, attributes: Dict[str, str] = None):
+        span = StubSpan(name, dict(attributes or {}), self.current)
+        self.spans.append(span)
+        self.current = span
+        try:
+            yield span
+        except Exception as exception:
+            span.record_exception(exception)
+            raise
+        finally:
+            self.current = span.parent
+            span.ended = True
+
+
+class TestTracing(unittest.TestCase):
+    """ Unit tests for tracing. """
+
+    def setUp(self):
+        self.features = '/features.json'
+        self.fetcher: ConfigurationFetcher = mock_fetcher()
+        self.tracer = RecordingTracer()
+        metrics = ConfigurationManagerMetrics()
+        mapper = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False, metrics, None, self.tracer)
+        reader = ConfigurationReader('mini-app', [self.features], self.fetcher, mapper, ConfigurationManager(),
+                                     metrics, 0, self.tracer)
+        self.loader = ConfigurationLoader([reader], mock(), 10, ConfigurationLoaderMetrics(), self.tracer)
+
+    def test_refresh_phase_spans(self):
+        when(self.fetcher).fetch_files('mini-app', [self.features])\
+            .thenReturn({self.features: '{ "feature-flags": { "enable-all": { "value": true } } }'})
+
+        self.loader.execute_readers()
+
+        started = [(event[1], event[2]) for event in self.tracer.events if event[0] == 'start']
+        self.assertEqual([(RefreshPhases.CYCLE, 0), (RefreshPhases.READ, 1), (RefreshPhases.FETCH, 2),
+                          (RefreshPhases.HASH, 2), (RefreshPhases.PARSE, 2), (RefreshPhases.INSTANTIATE, 2),
+                          (RefreshPhases.STORE, 2)], started)
+        attributes = {event[1]: event[3] for event in self.tracer.events}
+        self.assertEqual({'merci.application': 'mini-app'}, attributes[RefreshPhases.READ])
+        self.assertEqual(self.features, attributes[RefreshPhases.PARSE]['merci.file'])
+
+    def test_failed_phase_is_recorded_in_span(self):
+        when(self.fetcher).fetch_files('mini-app', [self.features]).thenRaise(IOError('unreachable'))
+
+        self.loader.execute_readers()
+
+        self.assertIn(('error', RefreshPhases.FETCH, 'OSError'), self.tracer.events)
+        self.assertIn(('error', RefreshPhases.READ, 'OSError'), self.tracer.events)
+        self.assertEqual(0, self.tracer.depth)
+
+    def test_open_telemetry_tracer(self):
+        stub = StubOpenTelemetryTracer()
+        tracer = OpenTelemetryRefreshTracer(stub)
+        metrics = ConfigurationManagerMetrics()
+        mapper = ConfigurationMapper('feature-flags', SingleValueDecoderFactory(), False, metrics, None, tracer)
+        reader = ConfigurationReader('mini-app', [self.features], self.fetcher, mapper, ConfigurationManager(),
+                                     metrics, 0, tracer)
+        loader = ConfigurationLoader([reader], mock(), 10, ConfigurationLoaderMetrics(), tracer)
+        when(self.fetcher).fetch_files('mini-app', [self.features])\
+            .thenReturn({self.features: '{ "feature-flags": { "enable-all": { "value": true } } }'})
+
+        loader.execute_readers()
+
+        spans = {span.name: span for span in stub.spans}
+        self.assertEqual(['merci.cycle', 'merci.read', 'merci.fetch', 'merci.hash', 'merci.parse',
+                          'merci.instantiate', 'merci.store'], [span.name for span in stub.spans])
+        self.assertIsNone(spans['merci.cycle'].parent)
+        self.assertIs(spans['merci.cycle'], spans['merci.read'].parent)
+        self.assertIs(spans['merci.read'], spans['merci.parse'].parent)
+        self.assertEqual({'merci.application': 'mini-app'}, spans['merci.read'].attributes)
+        self.assertEqual(self.features, spans['merci.parse'].attributes['merci.file'])
+        self.assertTrue(all(span.ended and not span.exceptions for span in stub.spans))
+
+        stub.spans.clear()
+        when(self.fetcher).fetch_files('mini-app', [self.features]).thenRaise(IOError('unreachable'))
+
+        loader.execute_readers()
+
+        spans = {span.name: span for span in stub.spans}
+        self.assertEqual(['unreachable'], [str(exception) for exception in spans['merci.fetch'].exceptions])
+        self.assertEqual(['unreachable'], [str(exception) for exception in spans['merci.read'].exceptions])
+        self.assertEqual([], spans['merci.cycle'].exceptions)
+        self.assertIsNone(stub.current)
+
+    def test_no_op_tracer(self):
+        with NO_OP_TRACER.span(RefreshPhases.PARSE, {}) as span:
+            self.assertIs(span, NO_OP_TRACER.span(RefreshPhases.STORE, {}).__enter__())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#
+# Copyright 2019 Medallia, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""
+Hooks for tracing the phases of configuration refreshes, i.e. with OpenTelemetry.
+
+Sample code on how to trace refreshes with OpenTelemetry:
+
+merci: Merci = Merci(fetcher)
+merci.set_tracer(OpenTelemetryRefreshTracer())
+"""
+from abc import ABC, abstractmethod
+from typing import ContextManager, Dict
+
+
+class RefreshTracer(ABC):
+    """ Traces phases of configuration refreshes, i.e. fetching, hashing, parsing, instantiation and storing. """
+    @abstractmethod
+    def span(self, phase: str, attributes: Dict[str, str]) -> ContextManager:
+        """
+        Return context manager, that traces the enclosed refresh phase.
+        :param phase: name of refresh phase, i.e. RefreshPhases.PARSE
+        :param attributes: attributes of the phase, i.e. the application or file name
+        :return: context manager for the span of the phase
+        """
+
+
+class _NoOpSpan:
+    """ Context manager, that does nothing. """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class NoOpRefreshTracer(RefreshTracer):
+    """ Tracer, that does not trace anything. Returns the same no-op context manager for each span. """
+    _span = _NoOpSpan()
+
+    def span(self, phase: str, attributes: Dict[str, str]) -> ContextManager:
+        return self._span
+
+
+NO_OP_TRACER = NoOpRefreshTracer()
+
+
+class OpenTelemetryRefreshTracer(RefreshTracer):
+    """
+    Tracer, that records each refresh phase as an OpenTelemetry span named 'merci.<phase>', i.e. 'merci.parse'.
+    Requires the opentelemetry-api package.
+    """
+    def __init__(self, tracer=None):
+        """
+        Initialize tracer.
+        :param tracer: OpenTelemetry tracer, or None for the tracer named 'merci' of the global tracer provider
+        """
+        if tracer is None:
+            try:
+                from opentelemetry import trace
+            except ImportError as exception:
+                raise ImportError('OpenTelemetryRefreshTracer requires the opentelemetry-api package.') from exception
+            tracer = trace.get_tracer('merci')
+        self.tracer = tracer
+
+    def span(self, phase: str, attributes: Dict[str, str]) -> ContextManager:
+        return self.tracer.start_as_current_span('merci.' + phase, attributes=attributes)